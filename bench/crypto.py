@@ -0,0 +1,256 @@
+"""
+Benchmarks for the cryptographic operations vula performs in production.
+
+Results are written as JSON, and can be compared against a baseline file
+written by a previous run on the same machine:
+
+    PYTHONPATH=. python bench/crypto.py -o bench/baseline.json
+    PYTHONPATH=. python bench/crypto.py -b bench/baseline.json
+
+When comparing, the exit status is 1 if any benchmark is slower than its
+baseline by more than the given tolerance.
+"""
+
+import json
+import platform
+import sys
+import time
+from logging import getLogger
+from types import SimpleNamespace
+from typing import Any, Callable, Optional, TextIO
+
+import click
+from nacl.utils import random
+
+from vula.configure import Configure
+from vula.constants import _TEST_DESC_UNSIGNED
+from vula.csidh import _ctidh, ctidh_dh_raw, hkdf
+from vula.discover_alt import Discover_Alt
+from vula.peer import Descriptor
+from vula.publish_alt import Publish_Alt
+
+BENCHMARKS: dict[str, Callable[[], Callable[[], Any]]] = {}
+
+
+def benchmark(name: str) -> Callable[..., Any]:
+    """
+    Register a benchmark. The decorated function does the setup, and returns
+    the function to be timed.
+    """
+
+    def decorator(
+        setup: Callable[[], Callable[[], Any]],
+    ) -> Callable[[], Callable[[], Any]]:
+        BENCHMARKS[name] = setup
+        return setup
+
+    return decorator
+
+
+@benchmark("csidh.ctidh_keygen")
+def _ctidh_keygen() -> Callable[[], Any]:
+    c = _ctidh()
+    return lambda: c.generate_secret_key().derive_public_key()
+
+
+@benchmark("csidh.ctidh_dh")
+def _ctidh_dh() -> Callable[[], Any]:
+    c = _ctidh()
+    sk = bytes(c.generate_secret_key())
+    pk = bytes(c.generate_secret_key().derive_public_key())
+    return lambda: ctidh_dh_raw(sk, pk)
+
+
+@benchmark("csidh.hkdf")
+def _hkdf() -> Callable[[], Any]:
+    raw_key = random(64)
+    return lambda: hkdf(raw_key)
+
+
+@benchmark("peer.descriptor_sign")
+def _descriptor_sign() -> Callable[[], Any]:
+    desc = Descriptor.parse(_TEST_DESC_UNSIGNED)
+    seed = random(32)
+    return lambda: desc.sign(seed)
+
+
+@benchmark("peer.descriptor_verify")
+def _descriptor_verify() -> Callable[[], Any]:
+    desc = Descriptor.parse(_TEST_DESC_UNSIGNED).sign(random(32))
+    return desc.verify_signature
+
+
+@benchmark("configure.curve25519_keygen")
+def _curve25519_keygen() -> Callable[[], Any]:
+    return Configure()._curve25519_keypair_gen
+
+
+@benchmark("configure.ed25519_keygen")
+def _ed25519_keygen() -> Callable[[], Any]:
+    return Configure()._ed25519_keypair_gen
+
+
+@benchmark("configure.ctidh_keygen")
+def _configure_ctidh_keygen() -> Callable[[], Any]:
+    return Configure()._ctidh_keypair_gen
+
+
+# discover_alt and publish_alt open raw sockets when instantiated, so their
+# methods are called with a stand-in for self
+_alt = SimpleNamespace(log=getLogger())
+
+
+@benchmark("publish_alt.compress_and_encrypt")
+def _compress_and_encrypt() -> Callable[[], Any]:
+    key = random(6)
+    return lambda: Publish_Alt.compress_and_encrypt(
+        _alt, _TEST_DESC_UNSIGNED, key  # type: ignore[arg-type]
+    )
+
+
+@benchmark("discover_alt.decrypt")
+def _decrypt() -> Callable[[], Any]:
+    key = random(6)
+    message = Publish_Alt.compress_and_encrypt(
+        _alt, "addrs=" + _TEST_DESC_UNSIGNED, key  # type: ignore[arg-type]
+    )
+    assert Discover_Alt.decrypt(_alt, message, key)  # type: ignore[arg-type]
+    return lambda: Discover_Alt.decrypt(
+        _alt, message, key  # type: ignore[arg-type]
+    )
+
+
+def measure(
+    func: Callable[[], Any], repeat: int, min_time: float
+) -> dict[str, Any]:
+    """
+    Time func, calling it enough times per round for the round to take at
+    least min_time seconds. Returns the fastest and median time per call in
+    microseconds.
+    """
+    number = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time:
+            break
+        number *= 2 if elapsed == 0 else max(2, int(min_time / elapsed) + 1)
+    rounds = [elapsed / number]
+    for _ in range(repeat - 1):
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        rounds.append((time.perf_counter() - start) / number)
+    rounds.sort()
+    return dict(
+        number=number,
+        repeat=repeat,
+        min_us=round(rounds[0] * 1e6, 3),
+        median_us=round(rounds[len(rounds) // 2] * 1e6, 3),
+    )
+
+
+def compare(
+    results: dict[str, Any], baseline: dict[str, Any], tolerance: float
+) -> list[str]:
+    """
+    Returns a description of each benchmark which is slower than in the
+    baseline by more than tolerance (a fraction of the baseline time).
+
+    >>> base = {'a': {'min_us': 10.0}, 'b': {'min_us': 10.0}}
+    >>> compare({'a': {'min_us': 12.0}, 'b': {'min_us': 20.0}}, base, 0.25)
+    ['b: 20.0us vs 10.0us baseline (+100%)']
+    """
+    regressions = []
+    for name, result in sorted(results.items()):
+        if name not in baseline:
+            continue
+        old, new = baseline[name]['min_us'], result['min_us']
+        if new > old * (1 + tolerance):
+            regressions.append(
+                "%s: %sus vs %sus baseline (%+d%%)"
+                % (name, new, old, round(100 * (new - old) / old))
+            )
+    return regressions
+
+
+@click.command(short_help="Benchmark vula's cryptographic hot paths")
+@click.option(
+    "-o",
+    "--output",
+    type=click.File("w"),
+    default="-",
+    help="write JSON results to this file",
+)
+@click.option(
+    "-b",
+    "--baseline",
+    type=click.File("r"),
+    help="compare against results from a previous run",
+)
+@click.option(
+    "-t",
+    "--tolerance",
+    type=float,
+    default=0.25,
+    show_default=True,
+    help="allowed slowdown relative to the baseline",
+)
+@click.option("-r", "--repeat", type=int, default=5, show_default=True)
+@click.option(
+    "--min-time",
+    type=float,
+    default=0.2,
+    show_default=True,
+    help="minimum duration of each round in seconds",
+)
+@click.option(
+    "-k",
+    "--only",
+    "only",
+    type=str,
+    help="only run benchmarks whose names contain this string",
+)
+def main(
+    output: TextIO,
+    baseline: Optional[TextIO],
+    tolerance: float,
+    repeat: int,
+    min_time: float,
+    only: Optional[str],
+) -> None:
+    results = {}
+    for name, setup in BENCHMARKS.items():
+        if only and only not in name:
+            continue
+        results[name] = measure(setup(), repeat, min_time)
+        print(
+            "%-36s %12.3fus" % (name, results[name]['min_us']),
+            file=sys.stderr,
+        )
+    json.dump(
+        dict(
+            python=platform.python_version(),
+            machine=platform.machine(),
+            results=results,
+        ),
+        output,
+        indent=2,
+        sort_keys=True,
+    )
+    output.write("\n")
+
+    if baseline is not None:
+        regressions = compare(
+            results, json.load(baseline)['results'], tolerance
+        )
+        for regression in regressions:
+            print("REGRESSION " + regression, file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,170 @@
+"""
+Simulation of the multicast traffic of vula's mDNS discovery on a segment
+with many hosts, comparing the default mode with large segment mode
+(`vula discover --large-segment` and `vula publish --large-segment`, or the
+large_segment pref in monolithic mode).
+
+Every multicast packet is received by every host, so the cost that grows
+with the size of the segment is the number of packets each host receives.
+The model counts, per hour:
+
+- record refreshes: each service's records are queried for once per 80% of
+  their TTL, and answered once (the answer refreshes every host's cache, so
+  other hosts' refresh queries are suppressed).
+- descriptor refreshes: each host re-signs its descriptor every
+  _DESCRIPTOR_REFRESH_AGE seconds (less the jitter) and announces it three
+  times, with all of its records.
+- resolutions: with some probability a host receives an announcement or
+  answer without the TXT record (eg, because a large answer was truncated),
+  and has to resolve the service. In the default mode every such host
+  queries at once; in large segment mode each waits a random delay of up to
+  _LARGE_SEGMENT_RESOLVE_JITTER seconds, and doesn't query if an answer to
+  another host's query arrived in the meantime. This part is simulated.
+
+Queries sent within an answer's response delay (20-120ms, as in RFC 6762
+section 6) of each other are answered with a single multicast answer.
+"""
+
+import json
+import random
+import sys
+from typing import Any
+
+import click
+
+from vula.constants import (
+    _DESCRIPTOR_REFRESH_AGE,
+    _DESCRIPTOR_REFRESH_JITTER,
+    _DESCRIPTOR_VALIDITY_PERIOD,
+    _LARGE_SEGMENT_RESOLVE_JITTER,
+    _LARGE_SEGMENT_TTL_FRACTION,
+)
+
+# python-zeroconf's default TTL for service records
+_DEFAULT_TTL = 4500
+
+_ANNOUNCEMENTS = 3
+
+
+def resolve(
+    waiting: int, jitter: float, rng: random.Random
+) -> tuple[int, int]:
+    """
+    Simulate *waiting* hosts resolving the same service, each after a random
+    delay of up to *jitter* seconds. Returns the number of queries and
+    answers sent.
+
+    >>> resolve(100, 0, random.Random(0))
+    (100, 1)
+    >>> queries, answers = resolve(100, 5.0, random.Random(0))
+    >>> queries < 10 and answers == 1
+    True
+    >>> resolve(0, 5.0, random.Random(0))
+    (0, 0)
+    """
+    if waiting == 0:
+        return 0, 0
+    delays = sorted(rng.uniform(0, jitter) for _ in range(waiting))
+    queries = answers = 0
+    answered_at = None
+    for delay in delays:
+        if answered_at is not None and delay >= answered_at:
+            # the answer to an earlier query is in our cache by now
+            continue
+        queries += 1
+        if answered_at is None:
+            answers += 1
+            answered_at = delay + rng.uniform(0.02, 0.12)
+    return queries, answers
+
+
+def simulate(
+    hosts: int,
+    large_segment: bool,
+    missing_txt: float,
+    rng: random.Random,
+) -> dict[str, Any]:
+    """
+    Returns the packets sent and received per host per hour, for a segment
+    of the given number of hosts.
+    """
+    ttl = (
+        _DESCRIPTOR_VALIDITY_PERIOD * _LARGE_SEGMENT_TTL_FRACTION
+        if large_segment
+        else _DEFAULT_TTL
+    )
+    jitter = _LARGE_SEGMENT_RESOLVE_JITTER if large_segment else 0.0
+
+    refresh_packets = hosts * 2 * 3600 / (0.8 * ttl)
+
+    # each host refreshes its descriptor this many times per hour
+    descriptor_refreshes = (
+        hosts
+        * 3600
+        / (_DESCRIPTOR_REFRESH_AGE - _DESCRIPTOR_REFRESH_JITTER / 2)
+    )
+    announcement_packets = descriptor_refreshes * _ANNOUNCEMENTS
+
+    # simulate the resolutions caused by one hour's descriptor refreshes
+    resolution_packets = 0
+    events = max(1, round(descriptor_refreshes))
+    for _ in range(events):
+        waiting = sum(rng.random() < missing_txt for _ in range(hosts - 1))
+        queries, answers = resolve(waiting, jitter, rng)
+        resolution_packets += queries + answers
+    resolution_packets *= descriptor_refreshes / events
+
+    total = refresh_packets + announcement_packets + resolution_packets
+    return dict(
+        hosts=hosts,
+        mode="large_segment" if large_segment else "default",
+        record_ttl=int(ttl),
+        sent_per_host_per_hour=round(total / hosts, 3),
+        received_per_host_per_hour=round(total, 3),
+        resolution_packets_per_hour=round(resolution_packets, 3),
+    )
+
+
+def _row(result: dict[str, Any]) -> str:
+    return "%6d %-14s %12s %12s" % (
+        result['hosts'],
+        result['mode'],
+        result['sent_per_host_per_hour'],
+        result['received_per_host_per_hour'],
+    )
+
+
+@click.command(short_help="Simulate mDNS traffic on large segments")
+@click.option(
+    "-n",
+    "--hosts",
+    type=int,
+    multiple=True,
+    default=(10, 50, 200, 500),
+    show_default=True,
+)
+@click.option(
+    "--missing-txt",
+    type=float,
+    default=0.5,
+    show_default=True,
+    help="probability that a host needs to resolve an updated service",
+)
+@click.option("--seed", type=int, default=0, show_default=True)
+def main(hosts: tuple[int, ...], missing_txt: float, seed: int) -> None:
+    rng = random.Random(seed)
+    results = []
+    print(
+        "%6s %-14s %12s %12s" % ("hosts", "mode", "sent/h", "received/h"),
+        file=sys.stderr,
+    )
+    for n in hosts:
+        for large_segment in (False, True):
+            results.append(simulate(n, large_segment, missing_txt, rng))
+            print(_row(results[-1]), file=sys.stderr)
+    json.dump(results, sys.stdout, indent=2)
+    sys.stdout.write("\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,22 @@
-from unittest.mock import MagicMock
+import asyncio
+import socket
+from collections import OrderedDict
+from ipaddress import ip_network
+from typing import Any
+from unittest.mock import AsyncMock, MagicMock, patch
 
-from vula.constants import _TEST_DESC
+import pytest
+from zeroconf import (
+    DNSIncoming,
+    DNSOutgoing,
+    DNSText,
+    IPVersion,
+    ServiceStateChange,
+)
+from zeroconf.const import _CLASS_IN, _FLAGS_QR_RESPONSE, _TYPE_TXT
+
+from vula.common import RateLimiter
+from vula.constants import _LABEL, _TEST_DESC
 from vula.peer import Descriptor
 import vula.discover
 
@@ -46,6 +62,91 @@ class TestVulaServiceListener:
 
         callback.assert_not_called()
 
+    def test_add_service_drops_unchanged(self) -> None:
+        callback = MagicMock()
+        zeroconf = MagicMock()
+        desc = Descriptor.parse(_TEST_DESC)
+        zeroconf.get_service_info().properties = desc.as_zeroconf_properties
+        listener = vula.discover.VulaServiceListener(
+            callback, descriptor_filter=vula.discover.DescriptorFilter()
+        )
+
+        listener.add_service(zeroconf, "test_type", "test_name")
+        listener.update_service(zeroconf, "test_type", "test_name")
+        assert callback.call_count == 1
+
+        zeroconf.get_service_info().properties = Descriptor(
+            dict(desc, vf=desc.vf + 1)
+        ).as_zeroconf_properties
+        listener.update_service(zeroconf, "test_type", "test_name")
+        assert callback.call_count == 2
+
+        listener.remove_service(zeroconf, "test_type", "test_name")
+        listener.add_service(zeroconf, "test_type", "test_name")
+        assert callback.call_count == 3
+
+    def test_add_service_rate_limited(self) -> None:
+        callback = MagicMock()
+        zeroconf = MagicMock()
+        desc = Descriptor.parse(_TEST_DESC)
+        zeroconf.get_service_info().properties = desc.as_zeroconf_properties
+        source_limiter = RateLimiter(rate=0, burst=2)
+        listener = vula.discover.VulaServiceListener(
+            callback,
+            source_limiter=source_limiter,
+            sources=OrderedDict(test_name='10.89.0.3'),
+        )
+
+        # services are limited by the address their records came from
+        for _ in range(3):
+            listener.add_service(zeroconf, "test_type", "Test_Name")
+        assert callback.call_count == 2
+        assert source_limiter.dropped == 1
+
+        # and not by (forgeable) vk, or when their source is unknown
+        listener.add_service(zeroconf, "test_type", "other_name")
+        assert callback.call_count == 3
+
+    def test_source_tap(self) -> None:
+        def response(name: str) -> bytes:
+            out = DNSOutgoing(_FLAGS_QR_RESPONSE)
+            out.add_answer_at_time(
+                DNSText(name, _TYPE_TXT, _CLASS_IN, 120, b'\x03a=b'), 0
+            )
+            return out.packets()[0]
+
+        def received(data: bytes, addrs: tuple[Any, ...]) -> None:
+            protocol.data = data
+            protocol.last_message = DNSIncoming(data, addrs)
+
+        protocol = MagicMock(data=None, last_message=None)
+        protocol.datagram_received.side_effect = received
+        sources: OrderedDict[str, str] = OrderedDict()
+        tap = vula.discover._SourceTap(protocol, sources)
+
+        tap.datagram_received(response('Host.' + _LABEL), ('10.0.0.1', 5353))
+        tap.datagram_received(response('other.local.'), ('10.0.0.2', 5353))
+        assert sources == {'host.' + _LABEL: '10.0.0.1'}
+
+        # duplicates which zeroconf ignores aren't recorded
+        protocol.datagram_received.side_effect = None
+        tap.datagram_received(response('Host.' + _LABEL), ('10.0.0.3', 5353))
+        assert sources == {'host.' + _LABEL: '10.0.0.1'}
+
+        # the rest of the protocol is zeroconf's
+        tap.error_received(OSError())
+        protocol.error_received.assert_called_once()
+
+        # packets are passed on even if zeroconf's messages can't be read
+        del protocol.last_message
+        tap.datagram_received(response('Host.' + _LABEL), ('10.0.0.4', 5353))
+        assert protocol.datagram_received.call_count == 4
+        assert sources == {'host.' + _LABEL: '10.0.0.1'}
+
+        # and listeners without them aren't tapped at all
+        with pytest.raises(AttributeError):
+            vula.discover._SourceTap(protocol, sources)
+
     def test_update_service_calls_add_service(self) -> None:
         listener = vula.discover.VulaServiceListener(MagicMock())
         listener.add_service = MagicMock()  # type: ignore[method-assign]
@@ -56,12 +157,6 @@ class TestVulaServiceListener:
         listener.add_service.assert_called_once_with(m, "bar", "foo")
 
 
-def alive_mock(x: bool) -> MagicMock:
-    m = MagicMock()
-    m.is_alive.return_value = x
-    return m
-
-
 class TestDiscover:
     def test_callback_calls_all(self) -> None:
         a = MagicMock()
@@ -80,53 +175,242 @@ class TestDiscover:
 
     def test_is_not_alive(self) -> None:
         discover = vula.discover.Discover()
-        discover.browsers = {
-            '192.168.1.1': (MagicMock(), alive_mock(False)),
-            '192.168.1.2': (MagicMock(), alive_mock(False)),
-            '192.168.1.3': (MagicMock(), alive_mock(False)),
-        }
+        assert discover.is_alive() is False
 
-        alive = discover.is_alive()
-        print(alive)
-        assert alive is False
+        discover.browser = MagicMock()
+        assert discover.is_alive() is False
 
-    def test_is_alive(self) -> None:
+    @patch("vula.discover.AsyncServiceBrowser")
+    @patch("vula.discover.AsyncZeroconf")
+    def test_listen_uses_one_zeroconf(
+        self, zeroconf: MagicMock, browser: MagicMock
+    ) -> None:
+        zeroconf.side_effect = lambda **kw: AsyncMock()
+        browser.side_effect = lambda *a, **kw: AsyncMock()
         discover = vula.discover.Discover()
-        discover.browsers = {
-            '192.168.1.1': (MagicMock(), alive_mock(False)),
-            '192.168.1.2': (MagicMock(), alive_mock(False)),
-            '192.168.1.3': (MagicMock(), alive_mock(True)),
-            '192.168.1.4': (MagicMock(), alive_mock(False)),
-        }
+        discover._async_rebind = AsyncMock()  # type: ignore[method-assign]
 
-        alive = discover.is_alive()
-        assert alive is True
+        discover.listen(['192.168.1.1', '192.168.1.2'])
+        zeroconf.assert_called_once_with(
+            interfaces=['192.168.1.1', '192.168.1.2'],
+            ip_version=IPVersion.All,
+        )
+        browser.assert_called_once()
+        assert discover.is_alive()
 
-    def test_shutdown_removes_browsers(self) -> None:
-        discover = vula.discover.Discover()
-        discover.browsers = {
-            '192.168.1.1': (MagicMock(), MagicMock()),
-            '192.168.1.2': (MagicMock(), MagicMock()),
-            '192.168.1.3': (MagicMock(), MagicMock()),
-        }
+        # the same IPs (in any order) don't change anything
+        discover.listen(['192.168.1.2', '192.168.1.1'])
+        assert zeroconf.call_count == 1
+        discover._async_rebind.assert_not_awaited()
+
+        # other IPs are changed on the running instance
+        first = discover.zeroconf, discover.browser
+        discover.listen(['192.168.1.3'])
+        discover._async_rebind.assert_awaited_once_with(['192.168.1.3'])
+        assert zeroconf.call_count == 1
+        assert (discover.zeroconf, discover.browser) == first
 
+        # which is replaced if that fails
+        discover._async_rebind.side_effect = Exception("no internals")
+        discover.listen(['192.168.1.4'])
+        assert zeroconf.call_count == 2
+        assert discover.zeroconf is not first[0]
+        assert first[1] is not None
+        first[1].async_cancel.assert_awaited_once()
+        assert first[0] is not None
+        first[0].async_close.assert_awaited_once()
+
+        second = discover.zeroconf
         discover.shutdown()
+        assert second is not None
+        second.async_close.assert_awaited_once()
+        assert discover.zeroconf is None
+        assert not discover.is_alive()
+
+    @patch("vula.discover.AsyncListener", lambda zc: MagicMock())
+    @patch("vula.discover.new_respond_socket")
+    @patch("vula.discover.add_multicast_member")
+    @patch("vula.discover._drop_multicast_member")
+    def test_rebind_only_changes_changed_ips(
+        self,
+        drop_member: MagicMock,
+        add_member: MagicMock,
+        new_respond_socket: MagicMock,
+    ) -> None:
+        """
+        Sockets are added and removed on the running zeroconf instance, and
+        those of unchanged IPs (and the instance's cache) are kept.
+        """
+
+        def respond_socket(ip: str) -> socket.socket:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            sock.bind((ip, 0))
+            return sock
+
+        add_member.return_value = True
+        new_respond_socket.side_effect = respond_socket
+        discover = vula.discover.Discover()
+        discover.zeroconf = MagicMock()
+        zc = discover.zeroconf.zeroconf
+        engine = zc.engine
+        engine._listen_socket = MagicMock()
+        engine.readers, engine.senders, engine.protocols = [], [], []
 
-        assert discover.browsers == {}
+        async def rebind() -> None:
+            engine.loop = asyncio.get_running_loop()
+            await discover._async_rebind(['127.0.0.1', '127.0.0.2'])
+            assert discover._bound_ips == ['127.0.0.1', '127.0.0.2']
+            assert [r.sock_name[0] for r in engine.senders] == [
+                '127.0.0.1',
+                '127.0.0.2',
+            ]
+            assert len(engine.readers) == len(engine.protocols) == 2
+            query.assert_called_once_with(zc)
+            kept = engine.senders[1]
 
-    def test_shutdown_cancels_browsers(self) -> None:
-        browser1 = MagicMock()
-        browser2 = MagicMock()
-        browser3 = MagicMock()
+            await discover._async_rebind(['127.0.0.2', '127.0.0.3'])
+            assert discover._bound_ips == ['127.0.0.2', '127.0.0.3']
+            assert [r.sock_name[0] for r in engine.readers] == [
+                '127.0.0.2',
+                '127.0.0.3',
+            ]
+            assert engine.senders[0] is kept
+            assert len(engine.senders) == len(engine.protocols) == 2
+            assert drop_member.call_args.args[1] == '127.0.0.1'
+            assert add_member.call_count == 3
+            for reader in engine.readers:
+                reader.transport.close()
+
+        with patch.object(discover, '_async_query', AsyncMock()) as query:
+            asyncio.run(rebind())
+
+    @patch("vula.discover.new_respond_socket")
+    def test_rebind_without_zeroconf_internals(
+        self, new_respond_socket: MagicMock
+    ) -> None:
+        """
+        If zeroconf's internals aren't what _async_rebind expects, it changes
+        nothing, and listen replaces the instance instead.
+        """
         discover = vula.discover.Discover()
-        discover.browsers = {
-            '192.168.1.1': (MagicMock(), browser1),
-            '192.168.1.2': (MagicMock(), browser2),
-            '192.168.1.3': (MagicMock(), browser3),
+        discover.zeroconf = MagicMock()
+        engine = discover.zeroconf.zeroconf.engine
+        del engine._listen_socket
+        with pytest.raises(RuntimeError, match='engine._listen_socket'):
+            asyncio.run(discover._async_rebind(['127.0.0.1']))
+        new_respond_socket.assert_not_called()
+        assert discover._bound_ips == []
+
+        with patch.object(vula.discover, '_HAVE_ZEROCONF_INTERNALS', False):
+            with pytest.raises(RuntimeError, match='unsupported zeroconf'):
+                asyncio.run(discover._async_rebind(['127.0.0.1']))
+
+    @patch("vula.discover.GLib")
+    @patch("vula.discover.AsyncServiceInfo")
+    def test_bounded_concurrent_resolution(
+        self, service_info: MagicMock, glib: MagicMock
+    ) -> None:
+        properties = Descriptor.parse(_TEST_DESC).as_zeroconf_properties
+        in_flight = []
+        most_in_flight = 0
+
+        async def request(*a: Any) -> bool:
+            nonlocal most_in_flight
+            in_flight.append(a)
+            most_in_flight = max(most_in_flight, len(in_flight))
+            await asyncio.sleep(0.01)
+            in_flight.pop()
+            return True
+
+        def info(s_type: str, name: str) -> MagicMock:
+            m = MagicMock(properties=properties)
+            m.load_from_cache.return_value = name == "test_3"
+            m.async_request.side_effect = request
+            return m
+
+        service_info.side_effect = info
+        glib.idle_add.side_effect = lambda f: f()
+        callback = MagicMock()
+        discover = vula.discover.Discover(max_resolutions=2)
+        discover.callbacks.append(callback)
+        discover.listener = vula.discover.VulaServiceListener(
+            discover._deliver
+        )
+
+        async def browse() -> None:
+            discover._resolution_slots = asyncio.Semaphore(2)
+            for i in (1, 2, 3, 4, 4, 4):
+                discover._on_service_state_change(
+                    MagicMock(),
+                    "test_type",
+                    f"test_{i}",
+                    ServiceStateChange.Added,
+                )
+            while discover._resolving:
+                await asyncio.sleep(0.01)
+
+        asyncio.run(browse())
+        assert service_info.call_count == 4
+        assert most_in_flight == 2
+        assert callback.call_count == 4
+        assert (discover.queries, discover.cache_hits) == (3, 1)
+
+    @patch("vula.discover._DISCOVER_REFRESH_QUERIES", 1)
+    @patch("vula.discover.GLib")
+    @patch("vula.discover.AsyncServiceInfo")
+    def test_refresh_forwards_cached_services(
+        self, service_info: MagicMock, glib: MagicMock
+    ) -> None:
+        properties = Descriptor.parse(_TEST_DESC).as_zeroconf_properties
+        service_info.return_value = MagicMock(properties=properties)
+        service_info.return_value.load_from_cache.return_value = True
+        glib.idle_add.side_effect = lambda f: f()
+        callback = MagicMock()
+        discover = vula.discover.Discover()
+        discover.callbacks.append(callback)
+        discover.listener = vula.discover.VulaServiceListener(
+            discover._deliver, descriptor_filter=discover.descriptor_filter
+        )
+        discover.zeroconf = MagicMock()
+        zeroconf = discover.zeroconf.zeroconf
+
+        async def browse(coro: Any = None) -> None:
+            discover._resolution_slots = asyncio.Semaphore(2)
+            if coro is None:
+                for name in ("test_1", "test_1", "test_2"):
+                    discover._on_service_state_change(
+                        zeroconf, "test_type", name, ServiceStateChange.Added
+                    )
+                    await asyncio.sleep(0.01)
+            else:
+                await coro
+            while discover._resolving:
+                await asyncio.sleep(0.01)
+
+        asyncio.run(browse())
+        assert callback.call_count == 2
+        assert discover.descriptor_filter.suppressed == 1
+        assert discover.services == {"test_1", "test_2"}
+
+        # everything in the cache is forwarded again, without restarting
+        discover.refresh()
+        asyncio.run(browse(discover._async_refresh()))
+        assert callback.call_count == 4
+        zeroconf.async_send.assert_called_once()
+        assert discover.zeroconf.zeroconf is zeroconf
+
+    def test_callback_attributes_interface(self) -> None:
+        discover = vula.discover.Discover()
+        discover.interfaces = {
+            '10.89.0.1': ('eth0', ip_network('10.89.0.0/24')),
         }
+        desc = Descriptor.parse(_TEST_DESC)
 
-        discover.shutdown()
+        discover.callback(desc)
+
+        assert discover.attribution == {str(desc.vk): 'eth0'}
+        assert discover.peers_by_interface() == {'eth0': 1}
 
-        browser1.cancel.assert_called_once()
-        browser2.cancel.assert_called_once()
-        browser3.cancel.assert_called_once()
+        with patch("vula.discover._LRU_CACHE_MAX_SIZE", 1):
+            discover.callback(Descriptor(dict(desc, vk=b'\x01' * 32)))
+        assert len(discover.attribution) == 1
@@ -0,0 +1,89 @@
+import socket
+from unittest.mock import patch
+
+import vula.discover_alt
+
+from .test_publish_alt import publish_alt
+
+_MAC = b"\x02\x00\x00\x00\x00\x01"
+_DESCRIPTOR = "addrs=10.0.0.1;" + "x" * 40
+
+
+def arp(payload: bytes, mac: bytes = _MAC) -> bytes:
+    "make an ethernet frame carrying an ARP packet, followed by a payload"
+    header = b"\xff" * 6 + mac + b"\x08\x06"
+    header += b"\x00\x01\x08\x00\x06\x04\x00\x01" + mac + bytes(14)
+    assert len(header) == vula.discover_alt.PAYLOAD_OFFSET
+    return header + payload
+
+
+class TestDiscoverAlt:
+    def setup_method(self) -> None:
+        self.sender, receiver = socket.socketpair(
+            socket.AF_UNIX, socket.SOCK_DGRAM
+        )
+        with patch.object(
+            vula.discover_alt.socket, "socket", return_value=receiver
+        ), patch("vula.discover_alt.pydbus"):
+            self.discover = vula.discover_alt.Discover_Alt(
+                insert_into_vula=True,
+                max_age=30,
+                arp_code=0x0806,
+                packet_max_length=60,
+            )
+
+    def teardown_method(self) -> None:
+        self.sender.close()
+        self.discover.socket.close()
+
+    def frames(self, mac: bytes = _MAC) -> list[bytes]:
+        "our descriptor's packets, exactly as publish_alt sends them"
+        publish = publish_alt(op_code=b"\x00\x01")
+        sock = {"ip": "10.0.0.1", "mac_addr": mac, "dest_ip": bytes(4)}
+        publish.descriptor[sock["ip"]] = _DESCRIPTOR
+        packets = publish.get_packets(sock, publish.get_frames(sock))
+        # including the last one, which the link may not pad
+        assert {len(p) for p in packets} == {60}
+        return packets
+
+    def test_receive_packets(self) -> None:
+        frames = self.frames()
+        assert len(frames) > 2
+        # ordinary ARP frames, with zero padding or none at all, are
+        # dropped by the socket's filter and never reach us
+        for packet in [arp(bytes(18)), arp(b"")] + frames[:-1]:
+            self.sender.send(packet)
+        assert self.discover.receive_packets() == len(frames) - 1
+        assert self.discover.descriptor_queue.empty()
+
+        self.sender.send(arp(bytes(18)))
+        self.sender.send(frames[-1])
+        assert self.discover.receive_packets() == 1
+        assert self.discover.descriptor_queue.get_nowait() == _DESCRIPTOR
+        assert self.discover.receive_packets() == 0
+
+    def test_process_packet(self) -> None:
+        # frames without a payload are checked again, in case they arrived
+        # before the filter was attached
+        for packet in arp(b""), arp(bytes(18)), arp(b"a" * 10):
+            self.discover.process_packet(0, packet)
+        assert self.discover.peers == {}
+
+        # frames are reassembled per sender, in any order, and a message
+        # encrypted for another sender's MAC is dropped
+        other = b"\x02\x00\x00\x00\x00\x02"
+        frames = self.frames()
+        forged = [
+            arp(f[vula.discover_alt.PAYLOAD_OFFSET :], other) for f in frames
+        ]
+        for packet in reversed(frames):
+            self.discover.process_packet(1, packet)
+        for packet in forged:
+            self.discover.process_packet(1, packet)
+        assert set(self.discover.peers) == {_MAC, other}
+        assert self.discover.descriptor_queue.get_nowait() == _DESCRIPTOR
+        assert self.discover.descriptor_queue.empty()
+
+        self.discover.max_age = 0
+        self.discover.flush_old_peers()
+        assert self.discover.peers == {}
@@ -1,10 +1,12 @@
+import threading
+import time
 import unittest
 from typing import Self, Any, Optional
 
 import schema
 
 from vula.common import raw
-from vula.engine import Result
+from vula.engine import Persister, Result
 from vula.organize import OrganizeState, SystemState
 
 from .test_peer import desc, mkk
@@ -383,6 +385,117 @@ class TestOrganizeEngine(unittest.TestCase):
             ['ADJUST_TO_NEW_SYSTEM_STATE', 'REMOVE_PEER'],
         )
 
+    def test_new_system_state_only_updates_affected_peers(self) -> None:
+        self._add_alice_ok()
+        self._assert_res_no_error(
+            self.state.event_NEW_SYSTEM_STATE(
+                SystemState(
+                    self.state.system_state,
+                    current_subnets={
+                        '10.0.0.0/24': ['10.0.0.9'],
+                        '192.168.1.0/24': ['192.168.1.9'],
+                    },
+                )
+            )
+        )
+        self._assert_res_actions(
+            self._add_bob_maybe(v4a='192.168.1.2'), ['ACCEPT_NEW_PEER']
+        )
+
+        # an unrelated subnet appears: no peer is touched
+        res = self._assert_res_no_error(
+            self.state.event_NEW_SYSTEM_STATE(
+                SystemState(
+                    self.state.system_state,
+                    current_subnets={
+                        '10.0.0.0/24': ['10.0.0.9'],
+                        '192.168.1.0/24': ['192.168.1.9'],
+                        '172.16.0.0/24': ['172.16.0.9'],
+                    },
+                )
+            )
+        )
+        self.assertEqual([w[0] for w in res.writes], ['SET'])
+        self.assertEqual(res.triggers, [])
+
+        # bob's subnet disappears: only bob is re-evaluated (and removed)
+        res = self._assert_res_actions(
+            self.state.event_NEW_SYSTEM_STATE(
+                SystemState(
+                    self.state.system_state,
+                    current_subnets={'10.0.0.0/24': ['10.0.0.9']},
+                )
+            ),
+            ['ADJUST_TO_NEW_SYSTEM_STATE', 'REMOVE_PEER'],
+        )
+        self.assertEqual(
+            [name for name, args in res.triggers],
+            ['remove_wg_peer', 'remove_routes'],
+        )
+        self.assertEqual(list(self.state.peers), [mkk('alicevk')])
+
+    def test_new_system_state_gateway_change(self) -> None:
+        self._add_alice_ok()
+        res = self._assert_res_no_error(
+            self.state.event_NEW_SYSTEM_STATE(
+                SystemState(self.state.system_state, gateways=['10.0.0.1'])
+            )
+        )
+        self.assertTrue(self.state.peers[mkk('alicevk')].use_as_gateway)
+        self.assertIn(('sync_peer', (mkk('alicevk'),)), res.triggers)
+
+    def test_expire_peers(self) -> None:
+        scheduled: list[list[str]] = []
+        self.state.schedule_expiry = scheduled.append
+        self._add_alice_ok()
+        self._assert_res_actions(
+            self._add_bob_maybe(v4a='10.0.0.2'), ['ACCEPT_NEW_PEER']
+        )
+        self.assertEqual(scheduled, [[mkk('alicevk')], [mkk('bobvk')]])
+        self._assert_res_no_error(
+            self.state.event_USER_EDIT(
+                'SET', ['peers', mkk('bobvk'), 'pinned'], True
+            )
+        )
+        alice = self.state.peers[mkk('alicevk')]
+        self.assertEqual(self.state.peer_expiry(alice), 3600)
+        self.assertIsNone(
+            self.state.peer_expiry(self.state.peers[mkk('bobvk')])
+        )
+
+        vks = [mkk('alicevk'), mkk('bobvk'), mkk('unknownvk')]
+        res = self._assert_res_no_error(
+            self.state.event_EXPIRE_PEERS(3599, vks)
+        )
+        self.assertEqual(res.writes, [])
+        self._assert_res_actions(
+            self.state.event_EXPIRE_PEERS(3600, vks),
+            ['EXPIRE_PEER', 'REMOVE_PEER'],
+        )
+        self.assertEqual(list(self.state.peers), [mkk('bobvk')])
+
+        # changing expire_time reschedules all peers
+        scheduled.clear()
+        self._assert_res_no_error(
+            self.state.event_USER_EDIT('SET', ['prefs', 'expire_time'], -1)
+        )
+        self.assertEqual(scheduled, [[mkk('bobvk')]])
+
+    def test_psk_ready(self) -> None:
+        self._add_alice_ok()
+        alice = self.state.peers[mkk('alicevk')]
+        res = self._assert_res_actions(
+            self.state.event_PSK_READY(str(alice.descriptor.c)),
+            ['SYNC_PEER'],
+        )
+        self.assertEqual(res.writes, [])
+        self.assertEqual(res.triggers, [('sync_peer', (mkk('alicevk'),))])
+        self.assertEqual(
+            alice.wg_config(None),
+            dict(public_key=str(alice.descriptor.pk), remove=True),
+        )
+        self.assertIn('endpoint_addr', alice.wg_config(mkk('psk')))
+
     def test_user_edit_hostname_collision(self) -> None:
         self._add_alice_ok()
         self._assert_res_actions(
@@ -407,5 +520,61 @@ class TestOrganizeEngine(unittest.TestCase):
             )
 
 
+class TestPersister(unittest.TestCase):
+    def test_coalesces_while_writing(self: Self) -> None:
+        written: list[int] = []
+        writing = threading.Event()
+        release = threading.Event()
+
+        def write(snapshot: int) -> None:
+            written.append(snapshot)
+            writing.set()
+            release.wait(5)
+
+        p = Persister(write, max_staleness=0).start()
+        p.submit(1)
+        self.assertTrue(writing.wait(5))
+        for i in range(2, 10):
+            p.submit(i)
+        release.set()
+        p.stop()
+        self.assertEqual(written, [1, 9])
+        self.assertEqual((p.submitted, p.written), (9, 2))
+
+    def test_max_staleness(self: Self) -> None:
+        written: list[int] = []
+        p = Persister(written.append, max_staleness=0.05).start()
+        p.submit(1)
+        p.submit(2)
+        self.assertEqual(written, [])
+        deadline = time.monotonic() + 5
+        while not written and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(written, [2])
+        p.stop()
+        self.assertEqual(written, [2])
+
+    def test_stop_flushes(self: Self) -> None:
+        written: list[int] = []
+        p = Persister(written.append, max_staleness=3600).start()
+        p.submit(1)
+        p.stop()
+        self.assertEqual(written, [1])
+        p.submit(2)
+        self.assertTrue(p.flush())
+        self.assertEqual(written, [1, 2])
+
+    def test_write_errors_are_logged(self: Self) -> None:
+        errors = []
+
+        def write(snapshot: int) -> None:
+            raise OSError("disk full")
+
+        p = Persister(write, error_log=lambda *a: errors.append(a))
+        p.submit(1)
+        self.assertTrue(p.flush())
+        self.assertEqual(len(errors), 1)
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,38 @@
+from pathlib import Path
+
+from vula.hosts import Cdb, cdb_dumps, hosts_cdb, lookup
+
+
+class TestCdb:
+    def test_many_records(self) -> None:
+        records = [
+            (f"host{i}.local.".encode(), f"10.0.{i // 256}.{i % 256}".encode())
+            for i in range(3000)
+        ]
+        db = Cdb(cdb_dumps(records))
+        for key, value in records:
+            assert db.get_all(key) == [value]
+        assert db.get(b"host3000.local.") is None
+
+    def test_empty(self) -> None:
+        assert Cdb(cdb_dumps([])).get(b"anything") is None
+
+
+class TestLookup:
+    def test_lookup_flat_file(self, tmp_path: Path) -> None:
+        hosts = tmp_path / "hosts"
+        hosts.write_text("fdff::1 alice.local.\n10.0.0.1 alice.local.\n")
+
+        assert lookup("Alice.local.", str(hosts), str(tmp_path / "x")) == [
+            "fdff::1",
+            "10.0.0.1",
+        ]
+        assert lookup("bob.local.", str(hosts), str(tmp_path / "x")) == []
+
+    def test_lookup_prefers_cdb(self, tmp_path: Path) -> None:
+        hosts = tmp_path / "hosts"
+        hosts.write_text("fdff::1 alice.local.\n")
+        cdb = tmp_path / "hosts.cdb"
+        cdb.write_bytes(hosts_cdb([("fdff::2", "alice.local.")]))
+
+        assert lookup("alice.local.", str(hosts), str(cdb)) == ["fdff::2"]
@@ -1,14 +1,24 @@
+import json
 import unittest
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+from typing import Any
 
 import pytest
+import yaml
 
 from unittest.mock import MagicMock, patch
 from click.globals import push_context, pop_context
 from highctidh import ctidh  # type: ignore[attr-defined, unused-ignore]
 
+from vula.common import RateLimiter
 from vula.csidh import ctidh_parameters
-from vula.organize import Organize
+from vula.engine import Persister, Result
+from vula.hosts import lookup
+from vula.organize import Organize, SystemState
+from vula.peer import Descriptor
+
+from .test_peer import desc, mkk
 
 
 class TestOrganize(unittest.TestCase):
@@ -16,6 +26,42 @@ class TestOrganize(unittest.TestCase):
     def _tmp_path(self, tmp_path: Path) -> None:
         self.tmp_path = tmp_path
 
+    def make_organize(
+        self, keys_file: str = "keys.json", **kwargs: Any
+    ) -> Organize:
+        """
+        Make an Organize with its files in tmp_path, for tests which have
+        patched vula.organize.Sys and tkinter.Tk.
+        """
+        keys = self.tmp_path.joinpath(keys_file)
+        keys.touch()
+        push_context(MagicMock())
+        try:
+            # mypy is reporting: Missing positional argument "ctx" in call to
+            # "Organize" but the argument ctx is provided by the
+            # @click.pass_context decorator
+            return Organize(
+                keys_file=keys.as_posix(),
+                state_file=self.tmp_path.joinpath("state.json").as_posix(),
+                interface=MagicMock(),
+                **kwargs,
+            )  # type: ignore[call-arg]
+        finally:
+            pop_context()
+
+    def make_organize_on_segment(self) -> Organize:
+        """
+        Make an Organize which is on 10.0.0.0/24 (at 10.0.0.9), and which
+        doesn't write the hosts file or run triggers.
+        """
+        organize = self.make_organize()
+        organize._write_hosts_file = MagicMock()  # type: ignore[method-assign]
+        organize.state.trigger_target = None
+        organize.state.event_NEW_SYSTEM_STATE(
+            SystemState(current_subnets={'10.0.0.0/24': ['10.0.0.9']})
+        )
+        return organize
+
     @patch("tkinter.Tk")
     @patch("vula.organize.Sys")
     @patch("vula.organize.ctidh", wraps=ctidh)
@@ -102,3 +148,500 @@ class TestOrganize(unittest.TestCase):
 
         # Assert - first and second result must be identical
         assert result_one_first == result_one_third
+
+    @patch("tkinter.Tk")
+    @patch("vula.organize.Sys")
+    def test_write_hosts_file_only_on_change(
+        self,
+        mocked_sys: MagicMock,
+        mocked_tk: MagicMock,
+    ) -> None:
+        hosts_file = self.tmp_path.joinpath("hosts")
+        cdb_file = self.tmp_path.joinpath("hosts.cdb")
+        organize = self.make_organize()
+
+        with patch(
+            "vula.organize._ORGANIZE_HOSTS_FILE", hosts_file.as_posix()
+        ), patch(
+            "vula.organize._ORGANIZE_HOSTS_CDB_FILE", cdb_file.as_posix()
+        ):
+            assert organize._write_hosts_file() is True
+            assert organize._write_hosts_file() is False
+            assert not cdb_file.exists()
+
+            # a new organize process doesn't rewrite current files
+            organize._hosts_hash = None
+            assert organize._write_hosts_file() is False
+
+            organize.state.event_USER_EDIT('SET', ['prefs', 'hosts_cdb'], True)
+            assert cdb_file.exists()
+            assert organize._write_hosts_file() is False
+            assert lookup(
+                organize.hostname, hosts_file.as_posix(), cdb_file.as_posix()
+            ) == [str(organize.prefs.primary_ip)]
+
+            # but does rebuild a cdb truncated by a crash
+            cdb_file.write_bytes(cdb_file.read_bytes()[:100])
+            organize._hosts_hash = None
+            assert organize._write_hosts_file() is True
+            assert lookup(
+                organize.hostname, hosts_file.as_posix(), cdb_file.as_posix()
+            ) == [str(organize.prefs.primary_ip)]
+
+    @patch("tkinter.Tk")
+    @patch("vula.organize.Sys")
+    def test_save_behind(
+        self,
+        mocked_sys: MagicMock,
+        mocked_tk: MagicMock,
+    ) -> None:
+        state_file = self.tmp_path.joinpath("state.json")
+        organize = self.make_organize()
+
+        with patch(
+            "vula.organize._ORGANIZE_HOSTS_FILE",
+            self.tmp_path.joinpath("hosts").as_posix(),
+        ):
+            organize._persister = Persister(
+                organize._write_state, max_staleness=3600
+            ).start()
+            organize.state.save = organize._save_behind
+            for value in (True, False):
+                res = organize.state.event_USER_EDIT(
+                    'SET', ['prefs', 'pin_new_peers'], value
+                )
+                assert res.error is None
+            assert not state_file.exists()
+            assert organize._persister.submitted == 2
+
+            organize._persister.stop()
+            assert organize._persister.written == 1
+            assert "pin_new_peers: false" in state_file.read_text()
+
+    @patch("tkinter.Tk")
+    @patch("vula.organize.GLib")
+    @patch("vula.organize.Sys")
+    def test_ctidh_psk_async(
+        self,
+        mocked_sys: MagicMock,
+        mocked_glib: MagicMock,
+        mocked_tk: MagicMock,
+    ) -> None:
+        organize = self.make_organize()
+        _ctidh = ctidh(ctidh_parameters)
+        public_key = bytes(_ctidh.generate_secret_key().derive_public_key())
+
+        organize._psk_pool = ThreadPoolExecutor(max_workers=1)
+        assert organize.ctidh_psk(public_key) is None
+        # a second request while the first is pending doesn't start another
+        assert organize.ctidh_psk(public_key) is None
+        organize._psk_pool.shutdown(wait=True)
+
+        mocked_glib.idle_add.assert_called_once_with(
+            organize._psk_ready, public_key
+        )
+        assert organize.ctidh_psk(public_key) == organize.ctidh_dh(public_key)
+
+    @patch("tkinter.Tk")
+    @patch("vula.organize.Sys")
+    def test_psk_cache(
+        self,
+        mocked_sys: MagicMock,
+        mocked_tk: MagicMock,
+    ) -> None:
+        psk_cache_file = self.tmp_path.joinpath("psk-cache")
+
+        def make_organize(keys_file: str) -> Organize:
+            return self.make_organize(
+                keys_file, psk_cache_file=psk_cache_file.as_posix()
+            )
+
+        organize = make_organize("keys.json")
+        pk = b'\x01' * 64
+        psk = 'Y52eWgiYuPYtHlnqZpRqAG2USxILzRS57s61ePUdWO4='
+        organize._write_psk_cache({pk: psk})
+        assert psk.encode() not in psk_cache_file.read_bytes()
+
+        # a restarted organize with the same keys uses the cache
+        organize = make_organize("keys.json")
+        organize._load_psk_cache()
+        organize._psk_pool = MagicMock()
+        assert organize.ctidh_psk(pk) == psk
+        organize._psk_pool.submit.assert_not_called()
+
+        # after key rotation, the cache is discarded
+        organize = make_organize("new-keys.json")
+        organize._load_psk_cache()
+        assert organize._psks == {}
+
+    @patch("tkinter.Tk")
+    @patch("vula.organize.Sys")
+    def test_warm_up_psks(
+        self,
+        mocked_sys: MagicMock,
+        mocked_tk: MagicMock,
+    ) -> None:
+        organize = self.make_organize_on_segment()
+        _ctidh = ctidh(ctidh_parameters)
+        pks = []
+        for i, name in enumerate(('alice', 'bob', 'carol'), 1):
+            pk = bytes(_ctidh.generate_secret_key().derive_public_key())
+            pks.append(pk)
+            res = organize.state.event_INCOMING_DESCRIPTOR(
+                desc(
+                    vk=mkk(name + 'vk'),
+                    pk=mkk(name + 'pk'),
+                    p=f'fdff::{i}',
+                    v4a=f'10.0.0.{i}',
+                    hostname=f'{name}.local.',
+                    c=pk,
+                )
+            )
+            assert res.error is None
+        organize._psks[pks[0]] = organize.ctidh_dh(pks[0])
+
+        organize._psk_pool = ThreadPoolExecutor(max_workers=2)
+        organize._warm_up_psks()
+        organize._psk_pool.shutdown()
+
+        for pk in pks:
+            assert organize._psks[pk] == organize.ctidh_dh(pk)
+        stats = json.loads(organize.ctidh_stats())
+        assert stats['cached_psks'] == 3
+        assert stats['pending_psks'] == 0
+        assert stats['warmup']['peers'] == 3
+        assert stats['warmup']['cached'] == 1
+        assert stats['warmup']['derived'] == 2
+
+    @patch("tkinter.Tk")
+    @patch("vula.organize.Sys")
+    def test_duplicate_descriptors(
+        self,
+        mocked_sys: MagicMock,
+        mocked_tk: MagicMock,
+    ) -> None:
+        organize = self.make_organize_on_segment()
+        alice = desc(
+            vk=mkk('alicevk'), v4a='10.0.0.1', hostname='alice.local.'
+        )
+        event = MagicMock(wraps=organize.state.event_INCOMING_DESCRIPTOR)
+        organize.state.event_INCOMING_DESCRIPTOR = event
+
+        def stats() -> tuple[int, int]:
+            res = json.loads(organize.descriptor_stats())
+            return res['cache_hits'], res['cache_misses']
+
+        with patch.object(Descriptor, 'verify_signature', return_value=True):
+            # the first one changes the state, so the second is processed too
+            results = [
+                Result(yaml.safe_load(organize.process_descriptor_string(s)))
+                for s in [str(alice)] * 4
+            ]
+            assert event.call_count == 2
+            assert stats() == (2, 2)
+            assert results[0].actions[0][0] == 'ACCEPT_NEW_PEER'
+            assert results[2].actions == [['IGNORE', 'duplicate descriptor']]
+
+            # any state change invalidates the cache
+            organize.state.event_USER_EDIT(
+                'SET', ['prefs', 'pin_new_peers'], True
+            )
+            organize.process_descriptor(alice)
+            assert event.call_count == 3
+            assert stats() == (2, 3)
+
+        bob = desc(vk=mkk('bobvk'), v4a='10.0.0.2', hostname='bob.local.')
+        with patch.object(
+            Descriptor, 'verify_signature', return_value=False
+        ) as verify:
+            results = [organize.process_descriptor(bob) for _ in range(3)]
+            assert verify.call_count == 1
+            assert Result(yaml.safe_load(results[0])).error == (
+                'invalid signature'
+            )
+            assert event.call_count == 3
+            assert stats() == (4, 4)
+
+        # forged descriptors don't use up the rate of the vk they claim
+        organize._vk_limiter = RateLimiter(rate=0, burst=2)
+
+        def eves(n: int) -> list[str]:
+            return [
+                organize.process_descriptor(
+                    desc(
+                        vk=mkk('eve'),
+                        v4a=f'10.0.0.{100 + n + i}',
+                        hostname='eve.local.',
+                    )
+                )
+                for i in range(5)
+            ]
+
+        with patch.object(
+            Descriptor, 'verify_signature', return_value=False
+        ) as verify:
+            eves(0)
+            assert verify.call_count == 5
+        assert json.loads(organize.descriptor_stats())['rate_limited_vks'] == 0
+
+        # while verified floods are limited, and once the vk has exceeded its
+        # rate they are dropped before their signatures are verified
+        with patch.object(
+            Descriptor, 'verify_signature', return_value=True
+        ) as verify:
+            results = eves(10)
+            assert verify.call_count == 2
+        assert [Result(yaml.safe_load(r)).actions for r in results][2:] == [
+            [['IGNORE', 'rate limited']]
+        ] * 3
+        assert json.loads(organize.descriptor_stats())['rate_limited_vks'] == 3
+
+    @patch("tkinter.Tk")
+    @patch("vula.organize.Sys")
+    def test_process_descriptor_string_from_cli(
+        self,
+        mocked_sys: MagicMock,
+        mocked_tk: MagicMock,
+    ) -> None:
+        organize = self.make_organize_on_segment()
+        organize._verifier = MagicMock()
+        discover = MagicMock(sender=':1.1')
+        discover.bus.dbus.GetNameOwner.return_value = ':1.1'
+        cli = MagicMock(sender=':1.2')
+        cli.bus.dbus.GetNameOwner.return_value = ':1.1'
+        alice = desc(
+            vk=mkk('alicevk'), v4a='10.0.0.1', hostname='alice.local.'
+        )
+        bob = desc(vk=mkk('bobvk'), v4a='10.0.0.2', hostname='bob.local.')
+
+        with patch.object(Descriptor, 'verify_signature', return_value=True):
+            # descriptors from discover are queued for verification
+            res = Result(
+                yaml.safe_load(
+                    organize.process_descriptor_string(
+                        str(alice), dbus_context=discover
+                    )
+                )
+            )
+            assert res.actions == [['IGNORE', 'queued for verification']]
+            organize._verifier.submit.assert_called_once()
+            assert alice.id not in organize.peers
+
+            # while the CLI gets the result of processing them
+            res = Result(
+                yaml.safe_load(
+                    organize.process_descriptor_string(
+                        str(bob), dbus_context=cli
+                    )
+                )
+            )
+            assert res.ok and res.actions[0][0] == 'ACCEPT_NEW_PEER'
+            assert bob.id in organize.peers
+            organize._verifier.submit.assert_called_once()
+
+        res = Result(
+            yaml.safe_load(
+                organize.process_descriptor_string('junk', dbus_context=cli)
+            )
+        )
+        assert not res.ok
+
+        # other callers are rate-limited by their DBus sender (and discover
+        # by the source of the packets)
+        organize._source_limiter = RateLimiter(rate=0, burst=1)
+        carol, dave = (
+            desc(
+                vk=mkk(name),
+                pk=mkk(name + 'pk'),
+                v4a=f'10.0.0.{i}',
+                hostname=f'{name}.local.',
+            )
+            for i, name in ((3, 'carol'), (4, 'dave'))
+        )
+        with patch.object(Descriptor, 'verify_signature', return_value=True):
+            results = [
+                Result(
+                    yaml.safe_load(
+                        organize.process_descriptor_string(
+                            str(d), dbus_context=cli
+                        )
+                    )
+                )
+                for d in (carol, dave)
+            ]
+            organize.process_descriptor_string(
+                str(dave), dbus_context=discover
+            )
+        assert results[0].actions[0][0] == 'ACCEPT_NEW_PEER'
+        assert results[1].actions == [['IGNORE', 'rate limited']]
+        assert organize._verifier.submit.call_count == 2
+
+    @patch("tkinter.Tk")
+    @patch("vula.organize.Sys")
+    def test_publish_only_changed_descriptors(
+        self,
+        mocked_sys: MagicMock,
+        mocked_tk: MagicMock,
+    ) -> None:
+        organize = self.make_organize()
+        organize._write_hosts_file = MagicMock()  # type: ignore[method-assign]
+        organize.state.trigger_target = None
+        organize.port = 5354
+        organize.discover = MagicMock()
+        organize.publish = MagicMock()
+
+        def set_ips(*ips: str) -> None:
+            organize.state.event_NEW_SYSTEM_STATE(
+                SystemState(
+                    current_subnets={'10.0.0.0/24': list(ips)},
+                    current_interfaces={'eth0': list(ips)},
+                )
+            )
+
+        signalled = MagicMock()
+        organize.DescriptorsChanged.connect(signalled)
+
+        def published() -> Descriptor:
+            (descriptors,) = organize.publish.listen.call_args.args
+            (signalled_descriptors,) = signalled.call_args.args
+            assert json.loads(signalled_descriptors) == descriptors
+            return Descriptor.parse(descriptors['eth0'])
+
+        set_ips('10.0.0.9')
+        with patch("vula.organize.time.time", return_value=1000):
+            organize._instruct_zeroconf()
+        assert organize.publish.listen.call_count == 1
+        first = published()
+        assert first.vf == 1000
+
+        # unchanged content is neither re-signed nor published again
+        with patch("vula.organize.time.time", return_value=2000):
+            organize._instruct_zeroconf()
+            assert organize.publish.listen.call_count == 1
+            # but discover is still told which IPs to use, in case it was
+            # restarted
+            assert organize.discover.listen.call_count == 2
+            organize._instruct_zeroconf(force=True)
+            assert organize.publish.listen.call_count == 2
+            assert str(published()) == str(first)
+
+            set_ips('10.0.0.10')
+            organize._instruct_zeroconf()
+        assert organize.publish.listen.call_count == 3
+        second = published()
+        assert second.vf == 2000
+        assert str(second.v4a) == '10.0.0.10'
+
+        # descriptors are re-signed before they expire
+        with patch(
+            "vula.organize.time.time", return_value=2000 + second.dt // 2
+        ):
+            organize._refresh_descriptors()
+        assert organize.publish.listen.call_count == 4
+        assert published().vf == 2000 + second.dt // 2
+        assert signalled.call_count == 4
+
+    @patch("tkinter.Tk")
+    @patch("vula.organize.Sys")
+    def test_unicast_refresh(
+        self,
+        mocked_sys: MagicMock,
+        mocked_tk: MagicMock,
+    ) -> None:
+        organize = self.make_organize_on_segment()
+        organize.state.event_USER_EDIT('SET', ['prefs', 'pin_new_peers'], True)
+        organize._unicast = MagicMock()
+        alice = desc(
+            vk=mkk('alicevk'),
+            v4a='10.0.0.1',
+            hostname='alice.local.',
+            p='fdff::a',
+        )
+        bob = desc(
+            vk=mkk('bobvk'),
+            v4a='10.0.0.2',
+            hostname='bob.local.',
+            p='fdff::b',
+            pk=mkk('bobpk'),
+        )
+        with patch.object(Descriptor, 'verify_signature', return_value=True):
+            organize.process_descriptor(alice)
+            organize.state.event_USER_EDIT(
+                'SET', ['prefs', 'pin_new_peers'], False
+            )
+            organize.process_descriptor(bob)
+
+            # our descriptors are sent only to pinned peers
+            organize._send_unicast_refresh(['ours'])
+            organize._unicast.send.assert_called_once_with(
+                ['ours'], ['fdff::a']
+            )
+
+            # and only accepted from a pinned peer's primary IP
+            roamed = Descriptor(dict(alice, v4a='10.0.0.11', vf=1))
+            organize._unicast_descriptor_received(str(roamed), 'fdff::b')
+            assert str(organize.peers[alice.id].descriptor.v4a) == '10.0.0.1'
+            organize._unicast_descriptor_received(str(roamed), 'fdff::a')
+            assert str(organize.peers[alice.id].descriptor.v4a) == '10.0.0.11'
+
+            roamed_bob = Descriptor(dict(bob, v4a='10.0.0.12', vf=1))
+            organize._unicast_descriptor_received(str(roamed_bob), 'fdff::b')
+            assert str(organize.peers[bob.id].descriptor.v4a) == '10.0.0.2'
+
+    @patch("tkinter.Tk")
+    @patch("vula.organize.Sys")
+    def test_typed_dbus_api(
+        self,
+        mocked_sys: MagicMock,
+        mocked_tk: MagicMock,
+    ) -> None:
+        organize = self.make_organize_on_segment()
+        alice = desc(
+            vk=mkk('alicevk'),
+            v4a='10.0.0.1',
+            hostname='alice.local.',
+            p='fdff::a',
+        )
+        organize.sys.get_stats.return_value = {
+            str(alice.pk): dict(latest_handshake=1234, rx_bytes=1, tx_bytes=2)
+        }
+        with patch.object(Descriptor, 'verify_signature', return_value=True):
+            organize.process_descriptor(alice)
+
+        # results are variants, which pydbus sends without re-encoding
+        [peer] = [
+            {k: v.unpack() for k, v in p.items()}
+            for p in organize.get_peers('all')
+        ]
+        assert peer['id'] == alice.id
+        assert peer['name'] == 'alice.local.'
+        assert peer['enabled'] and not peer['pinned']
+        assert peer['primary_ip'] == 'fdff::a'
+        assert peer['latest_handshake'] == 1234
+        assert peer['rx_bytes'] == 1
+        assert organize.get_peer('nobody.local.') == {}
+        assert organize.get_peer(alice.id)['wg_pubkey'].unpack() == str(
+            alice.pk
+        )
+
+        prefs = {k: v.unpack() for k, v in organize.read_prefs().items()}
+        assert prefs['pin_new_peers'] is False
+        assert isinstance(prefs['subnets_allowed'], list)
+
+        result = organize.edit_pref('SET', 'pin_new_peers', 'true')
+        assert result['ok'].unpack() is True
+        assert result['writes'].unpack() == ['SET prefs.pin_new_peers']
+        assert organize.read_prefs()['pin_new_peers'].unpack() is True
+        result = organize.edit_pref('SET', 'expire_time', 'soon')
+        assert result['ok'].unpack() is False
+        assert 'error' in result
+        with pytest.raises(ValueError):
+            organize.edit_pref('DROP', 'pin_new_peers', '')
+
+        result = organize.delete_peer(alice.id)
+        assert result['actions'].unpack() == ['REMOVE_PEER']
+        assert organize.get_peers('all') == []
+
+        stats = organize.get_stats()['descriptors'].unpack()
+        assert stats['cache_misses'] >= 1
+        assert 'cached_psks' in organize.get_stats()['ctidh'].unpack()
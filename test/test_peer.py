@@ -5,7 +5,8 @@ from typing import Any
 
 import schema
 
-from vula.peer import Descriptor
+from vula.constants import _TEST_DESC
+from vula.peer import Descriptor, DescriptorVerifier, _verify_key
 
 
 def desc(vk: str, v4a: str, hostname: str, **kw: Any) -> Descriptor:
@@ -66,6 +67,24 @@ class TestDescriptor(unittest.TestCase):
             desc(hostname='alice.local', vk=mkk('1'), v4a='10.0.0.256')
 
 
+class TestDescriptorVerifier(unittest.TestCase):
+    def test_verify_key_cache(self) -> None:
+        d = Descriptor.parse(_TEST_DESC)
+        assert d.verify_signature()
+        hits = _verify_key.cache_info().hits
+        assert d.verify_signature()
+        self.assertEqual(_verify_key.cache_info().hits, hits + 1)
+
+    def test_drops_when_full(self) -> None:
+        results: list[bool] = []
+        verifier = DescriptorVerifier(
+            lambda d, ok: results.append(ok), max_pending=0
+        )
+        self.assertFalse(verifier.submit(Descriptor.parse(_TEST_DESC)))
+        verifier.shutdown()
+        self.assertEqual((results, verifier.dropped), ([], 1))
+
+
 class TestPeerShow(unittest.TestCase):
     """
     This is a doctest-style test so that we can use click.echo to strip the
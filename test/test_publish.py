@@ -0,0 +1,90 @@
+from unittest.mock import MagicMock, call, patch
+
+from vula.constants import _LABEL, _TEST_DESC
+from vula.peer import Descriptor
+import vula.publish
+
+
+def announcements(**ifaces: str) -> dict[str, str]:
+    "make an announcement for each interface, with the given v4a"
+    desc = Descriptor.parse(_TEST_DESC)
+    return {
+        iface: str(Descriptor(dict(desc, v4a=v4a, v6a='')))
+        for iface, v4a in ifaces.items()
+    }
+
+
+@patch("vula.publish.hostname", MagicMock(return_value="host"))
+@patch("vula.publish.Zeroconf")
+class TestPublish:
+    def test_responder_per_interface(self, zeroconf: MagicMock) -> None:
+        zeroconf.side_effect = lambda **kw: MagicMock()
+        publish = vula.publish.Publish()
+
+        publish.listen(announcements(eth0='10.0.0.1', eth1='10.0.1.1'))
+
+        # each segment only gets its own addresses, under our usual name
+        assert zeroconf.call_args_list == [
+            call(interfaces=['10.0.0.1']),
+            call(interfaces=['10.0.1.1']),
+        ]
+        for iface, ip in ('eth0', '10.0.0.1'), ('eth1', '10.0.1.1'):
+            info = publish.zeroconfs[iface].register_service.call_args.args[0]
+            assert info.parsed_addresses() == [ip]
+            assert info.name == "host." + _LABEL
+
+    def test_update_in_place(self, zeroconf: MagicMock) -> None:
+        zeroconf.side_effect = lambda **kw: MagicMock()
+        publish = vula.publish.Publish()
+        publish.listen(announcements(eth0='10.0.0.1', eth1='10.0.1.1'))
+        eth0, eth1 = publish.zeroconfs['eth0'], publish.zeroconfs['eth1']
+
+        # unchanged announcements do nothing
+        publish.listen(announcements(eth0='10.0.0.1', eth1='10.0.1.1'))
+        eth0.update_service.assert_not_called()
+        eth1.update_service.assert_not_called()
+
+        # removing an interface only stops its responder, and changing an
+        # interface's records doesn't restart it
+        publish.listen(announcements(eth0='10.0.0.1'))
+        eth1.close.assert_called_once()
+        eth0.close.assert_not_called()
+        desc = Descriptor.parse(announcements(eth0='10.0.0.1')['eth0'])
+        publish.listen({'eth0': str(Descriptor(dict(desc, port=5355)))})
+        eth0.update_service.assert_called_once()
+        eth0.close.assert_not_called()
+        assert zeroconf.call_count == 2
+        assert set(publish.zeroconfs) == {'eth0'}
+
+    def test_restart_for_new_ip(self, zeroconf: MagicMock) -> None:
+        zeroconf.side_effect = lambda **kw: MagicMock()
+        publish = vula.publish.Publish()
+        publish.listen(announcements(eth0='10.0.0.1', eth1='10.0.1.1'))
+        eth0, eth1 = publish.zeroconfs['eth0'], publish.zeroconfs['eth1']
+
+        publish.listen(announcements(eth0='10.0.0.2', eth1='10.0.1.1'))
+
+        eth0.close.assert_called_once()
+        eth1.close.assert_not_called()
+        assert publish.bound_ips == {
+            'eth0': {'10.0.0.2'},
+            'eth1': {'10.0.1.1'},
+        }
+        publish.zeroconfs['eth0'].register_service.assert_called_once()
+        assert publish.zeroconfs['eth1'] is eth1
+
+        publish.listen({})
+        assert publish.zeroconfs == {}
+        assert publish.services == {}
+
+    def test_large_segment_ttls(self, zeroconf: MagicMock) -> None:
+        desc = announcements(eth0='10.0.0.1')['eth0']
+
+        default = vula.publish.Publish()._service_info('eth0', desc)
+        large = vula.publish.Publish(large_segment=True)._service_info(
+            'eth0', desc
+        )
+
+        assert large.other_ttl == Descriptor.parse(desc).dt // 4
+        assert large.other_ttl > default.other_ttl
+        assert large.host_ttl > default.host_ttl
@@ -0,0 +1,179 @@
+import json
+import socket
+import threading
+from typing import Any, Callable
+from unittest.mock import MagicMock, patch
+
+from pyroute2.netlink.rtnl.ndmsg import ndmsg
+
+from vula.publish_alt import NeighbourTable, Publish_Alt
+
+
+def publish_alt(**kw: Any) -> Publish_Alt:
+    "make a Publish_Alt with the CLI's defaults, without connecting to DBus"
+    args: dict[str, Any] = dict(
+        descriptor=None,
+        verbose=False,
+        is_reply=False,
+        broadcast_mac=b"\xff" * 6,
+        ethernet_type=b"\x08\x06",
+        hardware_type=b"\x00\x01",
+        protocol_type=b"\x08\x00",
+        hardware_size=b"\x06",
+        protocol_size=b"\x04",
+        zero_mac=bytes(6),
+        interval_min=0.01,
+        interval_max=0.1,
+        op_code=None,
+        arp_packet_max_length=60,
+        formatting_string="256s",
+        hardware_address_ioctl_code=0x8927,
+        pa_address_code=0x8915,
+        time_interval=90,
+    )
+    with patch("vula.publish_alt.pydbus"):
+        return Publish_Alt(**dict(args, **kw))
+
+
+class TestNeighbourTable:
+    def test_monitor_stops_without_events(self) -> None:
+        a, b = socket.socketpair()
+        msg = ndmsg()
+        msg.update(ifindex=2, state=2, family=socket.AF_INET)
+        msg.update(attrs=[('NDA_DST', '10.0.0.1')], event='RTM_NEWNEIGH')
+        ip = MagicMock(fileno=b.fileno)
+        ip.get.side_effect = lambda: [msg] if b.recv(1) else []
+        table = NeighbourTable()
+        table.stopped = threading.Event()
+        thread = threading.Thread(
+            target=table.monitor, args=(ip, table.stopped), daemon=True
+        )
+        thread.start()
+
+        a.send(b"x")
+        for _ in range(100):
+            if table.get(2):
+                break
+            thread.join(0.01)
+        assert table.get(2) == ['10.0.0.1']
+
+        # the monitor isn't blocked waiting for another event
+        table.stop()
+        thread.join(5)
+        assert not thread.is_alive()
+        ip.close.assert_called_once()
+        a.close()
+        b.close()
+
+    @patch.object(NeighbourTable, "monitor", MagicMock())
+    @patch("vula.publish_alt.IPRoute", MagicMock())
+    @patch("vula.publish_alt.IPRSocket")
+    def test_restart_before_monitor_exits(self, iprsocket: MagicMock) -> None:
+        """
+        Restarting the table starts a new monitor, even if the old one
+        hasn't noticed that it was stopped yet.
+        """
+        table = NeighbourTable()
+        table.start()
+        table.start()
+        assert iprsocket.call_count == 1
+        first = table.stopped
+
+        table.stop()
+        table.start()
+        assert iprsocket.call_count == 2
+        second = table.stopped
+        assert first is not None and first.is_set()
+        assert second is not None and not second.is_set()
+
+        table.stop()
+        assert second.is_set()
+
+
+class TestPublishAlt:
+    def test_packets_are_sent_in_time_order(self) -> None:
+        publish = publish_alt(interval_min=1, interval_max=1)
+        eth0, eth1 = MagicMock(), MagicMock()
+
+        publish.schedule_packets(eth0, [b"a1", b"a2", b"a3"], t=0)
+        publish.schedule_packets(eth1, [b"b1", b"b2"], t=0.5)
+
+        # trains on several interfaces are interleaved
+        assert [(s, p) for _, _, s, p in publish.due_packets(1)] == [
+            (eth0, b"a1"),
+            (eth1, b"b1"),
+            (eth0, b"a2"),
+        ]
+        assert publish.due_packets(1) == []
+        assert [p for _, _, _, p in publish.due_packets(10)] == [
+            b"b2",
+            b"a3",
+        ]
+
+    def test_send_packets(self) -> None:
+        publish = publish_alt(interval_min=0.01, interval_max=0.01)
+        sent = []
+
+        def send(packet: bytes) -> None:
+            sent.append(packet)
+            if len(sent) == 5:
+                publish.active = False
+
+        eth0, eth1 = MagicMock(), MagicMock()
+        eth0.send.side_effect = eth1.send.side_effect = send
+        publish.active = True
+        thread = threading.Thread(target=publish.send_packets, daemon=True)
+        thread.start()
+
+        # the sending thread is woken for packets due before its timeout
+        publish.schedule_packets(eth0, [b"a1", b"a2", b"a3"])
+        publish.schedule_packets(eth1, [b"b1", b"b2"])
+        thread.join(5)
+
+        assert not thread.is_alive()
+        assert sorted(sent) == [b"a1", b"a2", b"a3", b"b1", b"b2"]
+        assert sent.index(b"a1") < sent.index(b"a2") < sent.index(b"a3")
+        assert sent.index(b"b1") < sent.index(b"b2")
+        assert publish.send_schedule == []
+
+    @patch("vula.publish_alt.socket.socket", MagicMock())
+    def test_run_wakes_for_new_entries_and_descriptors(self) -> None:
+        publish = publish_alt()
+        publish.organize.our_latest_descriptors.return_value = '{}'
+        publish.get_interface = MagicMock(  # type: ignore[method-assign]
+            return_value=('eth0', 2)
+        )
+        publish.get_mac = MagicMock(  # type: ignore[method-assign]
+            return_value=b"\x02" * 6
+        )
+        publish.schedule_packets = MagicMock()  # type: ignore[method-assign]
+        publish.active = True
+        thread = threading.Thread(target=publish.run, daemon=True)
+        thread.start()
+
+        def wait_for(condition: Callable[[], Any]) -> None:
+            for _ in range(500):
+                if condition():
+                    return
+                thread.join(0.01)
+            raise AssertionError("timed out")
+
+        # new entries are processed at once, rather than after the time
+        # interval, even though there is no descriptor for them yet
+        publish.setup(['10.0.0.1'])
+        wait_for(lambda: publish.publish_entries.queue[0]["updated"])
+        publish.schedule_packets.assert_not_called()
+
+        # organize's signal carries our descriptor for each interface, which
+        # entries look up by their interface's name
+        publish.on_descriptors_changed(
+            json.dumps({'eth0': 'addrs=10.0.0.1;', 'eth1': 'addrs=10.0.1.1;'})
+        )
+        wait_for(lambda: publish.schedule_packets.called)
+        assert publish.descriptor == {'10.0.0.1': 'addrs=10.0.0.1;'}
+        assert publish.load_descriptor('eth1') == 'addrs=10.0.1.1;'
+        assert publish.load_descriptor('eth2') is None
+
+        publish.stop()
+        thread.join(5)
+        assert not thread.is_alive()
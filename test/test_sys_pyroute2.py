@@ -1,6 +1,10 @@
 import time
+from base64 import b64encode
 from unittest.mock import MagicMock, patch
 
+from pyroute2.netlink.exceptions import NetlinkError
+
+from vula.common import attrdict
 import vula.sys_pyroute2
 
 
@@ -68,3 +72,72 @@ class TestSys:
 
             sys.get_new_system_state.assert_not_called()
             assert mock_organize.log.info.call_count == 2
+
+    @patch("vula.wg.PyRoute2WireGuard")
+    @patch("vula.sys_pyroute2.IPRoute")
+    def test_sync_peers_with_rejected_peer(
+        self, ipr: MagicMock, wg_class: MagicMock
+    ) -> None:
+        wg = wg_class.return_value
+        wg.prid = 42
+        wg.pid = 0
+        wg.info.side_effect = Exception("no peers yet")
+        wg._wg_set_peer.side_effect = lambda msg, peer: msg['attrs'].append(
+            [
+                'WGDEVICE_A_PEERS',
+                [{'attrs': [['WGPEER_A_PUBLIC_KEY', peer.public_key]]}],
+            ]
+        )
+        bad = bytes([1]) * 32
+        wg.get.side_effect = lambda: [
+            {
+                'header': (
+                    {'error': NetlinkError(22)}
+                    if bad in wg.sendto.call_args.args[0]
+                    else {}
+                )
+            }
+        ]
+        peers = [
+            MagicMock(
+                routes=(f'10.0.0.{i}/32',),
+                use_as_gateway=False,
+                **{
+                    'wg_config.return_value': attrdict(
+                        public_key=b64encode(bytes([i]) * 32).decode(),
+                        allowed_ips=[f'10.0.0.{i}/32'],
+                    )
+                },
+            )
+            for i in range(3)
+        ]
+        organize = MagicMock()
+        organize.peers.limit.return_value.values.return_value = peers
+        sys = vula.sys_pyroute2.Sys(organize)
+        sys.sync_routes = MagicMock(return_value='')  # type: ignore[method-assign]  # noqa: E501
+
+        res = sys.sync_peers()
+
+        # the other peers are configured, and the rejected one is reported
+        ok = [
+            c.args[0] for c in wg.sendto.call_args_list if bad not in c.args[0]
+        ]
+        for i in (0, 2):
+            assert any(bytes([i]) * 32 in data for data in ok)
+        assert any(
+            'failed to configure wireguard peer ' + b64encode(bad).decode()
+            in line
+            for line in res
+        )
+        # and every peer's routes are synced
+        assert [c.args[0] for c in sys.sync_routes.call_args_list] == [
+            peer.routes for peer in peers
+        ]
+
+        # even if the wg step fails entirely
+        sys.sync_routes.reset_mock()
+        sys.wgi.apply_peerconfigs = MagicMock(  # type: ignore[method-assign]
+            side_effect=Exception("wg failed")
+        )
+        assert "Exception('wg failed')" in sys.sync_peers()
+        assert sys.sync_routes.call_count == 3
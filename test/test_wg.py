@@ -1,8 +1,11 @@
 from unittest import mock
 from unittest.mock import Mock
+from base64 import b64encode
 
 from nacl.signing import SigningKey
+from pyroute2.netlink.exceptions import NetlinkError
 
+import vula.peer
 import vula.wg
 from vula.common import attrdict
 
@@ -305,6 +308,175 @@ class TestInterface:
             peer=attrdict(public_key=existing_peer_pubkey, remove=True),
         )
 
+    @mock.patch("vula.wg.PyRoute2WireGuard")
+    def test_apply_peerconfigs(self, wg_class_mock: Mock) -> None:
+        """
+        Ensure that many peers are diffed against a single interface dump and
+        submitted with a single call to set_peers.
+        """
+        interface = vula.wg.Interface("vula")
+        wg_mock = wg_class_mock.return_value
+        wg_mock.info.reset_mock()
+        wg_mock.info.return_value = mock_wg_info_return()
+        interface.set_peers = Mock(  # type: ignore[method-assign]
+            return_value=[]
+        )
+        existing_peer_pubkey = 'hDzSznlwlq9mk07QpNk+AcsfprrLg2DxSv3JAOLXhFQ='
+        new_peer_pubkey = "Rbt3m34X1PPIEd/LvW9G0tbImDfcQW0MyvGikM7ayio="
+        unchanged = attrdict(
+            public_key=existing_peer_pubkey,
+            allowed_ips=['10.89.0.3/32'],
+            endpoint_addr='10.89.0.3',
+            endpoint_port=5354,
+        )
+        new = attrdict(
+            public_key=new_peer_pubkey,
+            allowed_ips=['10.89.0.4/32'],
+            endpoint_addr='10.89.0.4',
+            endpoint_port=5354,
+        )
+
+        res = interface.apply_peerconfigs([unchanged, new])
+
+        wg_mock.info.assert_called_once_with('vula')
+        interface.set_peers.assert_called_once_with([new])
+        assert res == (
+            f"# configure new wireguard peer {new_peer_pubkey}\n"
+            f"vula wg set vula peer {new_peer_pubkey} endpoint "
+            "10.89.0.4:5354 allowed-ips 10.89.0.4/32 "
+        )
+
+        """
+        Nothing is submitted when nothing has changed, and query=False reuses
+        the previous dump.
+        """
+        interface.set_peers.reset_mock()
+        res = interface.apply_peerconfigs([unchanged], query=False)
+        wg_mock.info.assert_called_once_with('vula')
+        interface.set_peers.assert_not_called()
+        assert res == ""
+
+    @mock.patch("vula.wg.PyRoute2WireGuard")
+    def test_apply_peerconfigs_pending_psk(self, wg_class_mock: Mock) -> None:
+        """
+        Ensure that a configured peer whose CTIDH PSK is still being derived
+        is removed (clearing its endpoint, PSK and allowed IPs), and that an
+        unconfigured one is left alone.
+        """
+        interface = vula.wg.Interface("vula")
+        wg_mock = wg_class_mock.return_value
+        wg_mock.info.reset_mock()
+        wg_mock.info.return_value = mock_wg_info_return()
+        interface.set_peers = Mock(  # type: ignore[method-assign]
+            return_value=[]
+        )
+        descriptor = mock.MagicMock()
+        descriptor.pk = 'hDzSznlwlq9mk07QpNk+AcsfprrLg2DxSv3JAOLXhFQ='
+        peer = mock.MagicMock(descriptor=descriptor)
+        pending = vula.peer.Peer.wg_config(peer, None)
+
+        res = interface.apply_peerconfigs([pending])
+
+        interface.set_peers.assert_called_once_with(
+            [attrdict(public_key=descriptor.pk, remove=True)]
+        )
+        assert res.startswith("# removing wireguard peer")
+
+        interface.set_peers.reset_mock()
+        descriptor.pk = "Rbt3m34X1PPIEd/LvW9G0tbImDfcQW0MyvGikM7ayio="
+        pending = vula.peer.Peer.wg_config(peer, None)
+        interface.apply_peerconfigs([pending], query=False)
+        interface.set_peers.assert_not_called()
+
+    @mock.patch("vula.wg.PyRoute2WireGuard")
+    def test_set_peers_splits_messages(self, wg_class_mock: Mock) -> None:
+        """
+        Ensure that set_peers batches peers into one message, and splits the
+        batch when the message would be too large.
+        """
+        interface = vula.wg.Interface("vula")
+        wg_mock = wg_class_mock.return_value
+        wg_mock.prid = 42
+        wg_mock.pid = 0
+        wg_mock.get.return_value = [{'header': {}}]
+        wg_mock._wg_set_peer.side_effect = lambda msg, peer: msg[
+            'attrs'
+        ].append(
+            [
+                'WGDEVICE_A_PEERS',
+                [{'attrs': [['WGPEER_A_PUBLIC_KEY', peer.public_key]]}],
+            ]
+        )
+        peers = [
+            attrdict(public_key=b64encode(bytes([i]) * 32).decode())
+            for i in range(8)
+        ]
+
+        assert len(interface.set_peers(peers)) == 1
+        assert wg_mock.sendto.call_count == 1
+
+        wg_mock.sendto.reset_mock()
+        interface._SET_PEERS_MAX_MSG_LEN = 200
+        assert len(interface.set_peers(peers)) > 1
+        sent = [c.args[0] for c in wg_mock.sendto.call_args_list]
+        assert all(len(data) <= 200 for data in sent)
+        # every peer is sent exactly once
+        for i in range(8):
+            key = bytes([i]) * 32
+            assert sum(data.count(key) for data in sent) == 1
+
+    @mock.patch("vula.wg.PyRoute2WireGuard")
+    def test_set_peers_retries_rejected_peer(
+        self, wg_class_mock: Mock
+    ) -> None:
+        """
+        Ensure that when the kernel rejects a peer in a batch, the batch's
+        peers are retried one at a time and only that peer's failure is
+        reported.
+        """
+        interface = vula.wg.Interface("vula")
+        wg_mock = wg_class_mock.return_value
+        wg_mock.prid = 42
+        wg_mock.pid = 0
+        wg_mock._wg_set_peer.side_effect = lambda msg, peer: msg[
+            'attrs'
+        ].append(
+            [
+                'WGDEVICE_A_PEERS',
+                [{'attrs': [['WGPEER_A_PUBLIC_KEY', peer.public_key]]}],
+            ]
+        )
+        bad = bytes([3]) * 32
+        wg_mock.get.side_effect = lambda: [
+            {
+                'header': (
+                    {'error': NetlinkError(22)}
+                    if bad in wg_mock.sendto.call_args.args[0]
+                    else {}
+                )
+            }
+        ]
+        peers = [
+            attrdict(public_key=b64encode(bytes([i]) * 32).decode())
+            for i in range(8)
+        ]
+
+        res = interface.set_peers(peers)
+
+        # one batch, then each peer on its own
+        assert wg_mock.sendto.call_count == 9
+        assert [r for r in res if isinstance(r, str)] == [
+            "# failed to configure wireguard peer %s: %r"
+            % (b64encode(bad).decode(), NetlinkError(22))
+        ]
+        assert len(res) == 8
+
+        interface.set_peers = Mock(  # type: ignore[method-assign]
+            return_value=[{'header': {}}, "# failed"]
+        )
+        wg_mock.info.side_effect = Exception("no interface")
+        assert interface.apply_peerconfigs(peers).endswith("\n# failed")
+
 
 def popluated_interface() -> Dict[str, Any]:
     return {
@@ -12,6 +12,7 @@ from . import (  # noqa: F40
     discover,
     discover_alt,
     engine,
+    hosts,
     organize,
     peer,
     prefs,
@@ -9,7 +9,9 @@ import json
 import os
 import pdb
 import re
+import time
 from base64 import b64decode, b64encode
+from collections import OrderedDict
 from ipaddress import (
     ip_address,
     ip_network,
@@ -20,12 +22,14 @@ from ipaddress import (
 )
 from logging import Logger, getLogger
 from pathlib import Path
+from threading import Lock
 from typing import (
     Any,
     Dict,
     Optional,
     Callable,
     Self,
+    Iterable,
     Iterator,
     TypeVar,
     Mapping,
@@ -38,10 +42,15 @@ from typing import (
 import click
 import pydbus
 import yaml
+from gi.repository import GLib
 from schema import And, Or, Schema, SchemaError, Use
 
 from vula.utils import optional_import
-from .constants import _ORGANIZE_DBUS_NAME, _ORGANIZE_DBUS_PATH
+from .constants import (
+    _LRU_CACHE_MAX_SIZE,
+    _ORGANIZE_DBUS_NAME,
+    _ORGANIZE_DBUS_PATH,
+)
 from .notclick import DualUse  # noqa: F401
 
 pygments = optional_import("pygments")
@@ -474,6 +483,55 @@ class jsonrepr_hl(jsonrepr):
         return res
 
 
+def to_variant(value: Any) -> GLib.Variant:
+    """
+    Convert a value to a GLib Variant, for organize's typed DBus API.
+
+    Flexibool values become booleans, mappings become a{sv} (without their
+    None values), lists of strings (or of other values which we have no DBus
+    type for, such as IP addresses and keys) become as, other lists become
+    av, and any other value we have no DBus type for becomes a string.
+
+    >>> nets = {ip_network('10.0.0.0/8')}
+    >>> print(to_variant({'a': 1, 'b': nets, 'c': None}))
+    {'a': <int64 1>, 'b': <['10.0.0.0/8']>}
+    >>> print(to_variant([True, IntBool(0), 1.5]))
+    [<true>, <false>, <1.5>]
+    >>> to_variant({'x': [{'y': 'z'}]}).unpack()
+    {'x': [{'y': 'z'}]}
+    """
+    if isinstance(value, GLib.Variant):
+        return value
+    if isinstance(value, (bool, IntBool)):
+        return GLib.Variant('b', bool(value))
+    if isinstance(value, int):
+        return GLib.Variant('x', value)
+    if isinstance(value, float):
+        return GLib.Variant('d', value)
+    if isinstance(value, Mapping):
+        return GLib.Variant('a{sv}', variant_dict(value))
+    if isinstance(value, (list, tuple, set, frozenset)):
+        items = (
+            sorted(value, key=str)
+            if isinstance(value, (set, frozenset))
+            else value
+        )
+        if all(
+            not isinstance(v, (bool, int, float, Mapping, list, tuple, set))
+            for v in items
+        ):
+            return GLib.Variant('as', [str(v) for v in items])
+        return GLib.Variant('av', [to_variant(v) for v in items])
+    return GLib.Variant('s', str(value))
+
+
+def variant_dict(value: Mapping[Any, Any]) -> dict[str, GLib.Variant]:
+    """
+    Convert a mapping to a dict of Variants, to be returned as a{sv}.
+    """
+    return {str(k): to_variant(v) for k, v in value.items() if v is not None}
+
+
 class Bug(Exception):
     pass
 
@@ -1220,6 +1278,89 @@ def sort_LL_first(
     )
 
 
+class RateLimiter(object):
+    """
+    Token-bucket admission control. Each key (eg, a source address or a vk)
+    has a bucket holding up to *burst* tokens, which refills at *rate*
+    tokens per second. Something is admitted if all of its keys' buckets
+    have a token, in which case a token is taken from each of them.
+
+    Only the buckets of the *max_keys* most recently seen keys are kept;
+    forgotten keys start again with a full bucket.
+
+    >>> r = RateLimiter(rate=1, burst=2)
+    >>> [r.allow(['a'], now=0) for i in range(3)]
+    [True, True, False]
+    >>> r.allow(['b'], now=0), r.allow(['a'], now=1)
+    (True, True)
+    >>> r.allow(['a', 'b'], now=1.5)
+    False
+    >>> r.allow(['b'], now=1.5)
+    True
+    >>> r.allowed, r.dropped
+    (5, 2)
+
+    *check* tells whether something would be admitted without taking any
+    tokens, so that keys which can be forged (eg, an unverified vk) are only
+    charged by *allow* once they have been authenticated. Both count drops.
+
+    >>> r.check(['c'], now=2), r.check(['c'], now=2), r.allow(['c'], now=2)
+    (True, True, True)
+    >>> r = RateLimiter(rate=0, burst=1)
+    >>> r.allow(['a'], now=0), r.check(['a'], now=0)
+    (True, False)
+    >>> r.allowed, r.dropped
+    (1, 1)
+    """
+
+    def __init__(
+        self, rate: float, burst: float, max_keys: int = _LRU_CACHE_MAX_SIZE
+    ) -> None:
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        self._lock = Lock()
+        # key -> (tokens, time they were counted)
+        self._buckets: OrderedDict[str, tuple[float, float]] = OrderedDict()
+        self.allowed = 0
+        self.dropped = 0
+
+    def _tokens(self, keys: Iterable[str], now: float) -> dict[str, float]:
+        buckets = {}
+        for key in keys:
+            tokens, then = self._buckets.get(key, (self.burst, now))
+            buckets[key] = min(self.burst, tokens + (now - then) * self.rate)
+        return buckets
+
+    def check(self, keys: Iterable[str], now: Optional[float] = None) -> bool:
+        if now is None:
+            now = time.monotonic()
+        with self._lock:
+            admit = all(
+                tokens >= 1 for tokens in self._tokens(keys, now).values()
+            )
+            if not admit:
+                self.dropped += 1
+            return admit
+
+    def allow(self, keys: Iterable[str], now: Optional[float] = None) -> bool:
+        if now is None:
+            now = time.monotonic()
+        with self._lock:
+            buckets = self._tokens(keys, now)
+            admit = all(tokens >= 1 for tokens in buckets.values())
+            for key, tokens in buckets.items():
+                self._buckets[key] = (tokens - 1 if admit else tokens, now)
+                self._buckets.move_to_end(key)
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+            if admit:
+                self.allowed += 1
+            else:
+                self.dropped += 1
+            return admit
+
+
 class KeyFile(yamlrepr_hl, schemattrdict, yamlfile):
     schema = Schema(
         {
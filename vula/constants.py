@@ -24,6 +24,7 @@ _WG_SERVICES: List[str] = [
 ]
 _ORGANIZE_CACHE_BASEDIR: str = "/var/lib/vula-organize/"
 _WG_PORT: int = 5354
+_UNICAST_REFRESH_PORT: int = 5356
 _TABLE: int = 666
 _FWMARK: int = 555
 _IP_RULE_PRIORITY: int = 666
@@ -38,6 +39,8 @@ _ORGANIZE_CACHE_FILE: str = _ORGANIZE_CACHE_BASEDIR + "vula-organize-cache"
 _ORGANIZE_CONF_FILE: str = _ORGANIZE_CACHE_BASEDIR + "vula-organize.yaml"
 _ORGANIZE_KEYS_CONF_FILE: str = _ORGANIZE_CACHE_BASEDIR + "keys.yaml"
 _ORGANIZE_HOSTS_FILE: str = _ORGANIZE_CACHE_BASEDIR + "hosts"
+_ORGANIZE_HOSTS_CDB_FILE: str = _ORGANIZE_HOSTS_FILE + ".cdb"
+_ORGANIZE_PSK_CACHE_FILE: str = _ORGANIZE_CACHE_BASEDIR + "psk-cache"
 _ORGANIZE_UPDATE_TEMP: str = "vula-organize-peer-update-"
 _DEFAULT_TABLE: int = 666
 
@@ -72,6 +75,45 @@ _IPv6_ULA = ip_network("fc00::/7")
 # Update interval for the tray in seconds
 _TRAY_UPDATE_INTERVAL = 5
 
+# granularity (in seconds) and size of organize's peer expiry timer wheel
+_EXPIRY_WHEEL_TICK: int = 60
+_EXPIRY_WHEEL_SLOTS: int = 512
+
+# validity period (the dt field, in seconds) of our descriptors, the age at
+# which an unchanged descriptor is re-signed and published again, and how
+# often (in seconds) organize checks for that
+_DESCRIPTOR_VALIDITY_PERIOD: int = 86400
+_DESCRIPTOR_REFRESH_AGE: int = _DESCRIPTOR_VALIDITY_PERIOD // 2
+_DESCRIPTOR_REFRESH_CHECK_INTERVAL: int = 3600
+# maximum random amount (in seconds) by which descriptors are refreshed
+# early, so that hosts which started together don't all refresh together
+_DESCRIPTOR_REFRESH_JITTER: int = 3600
+
+# seconds after which discover forwards an unchanged descriptor again
+_DISCOVER_REFRESH_INTERVAL: int = 300
+
+# how many services discover resolves at once, and for how long (in
+# milliseconds) it waits for each
+_DISCOVER_MAX_RESOLUTIONS: int = 16
+_DISCOVER_RESOLUTION_TIMEOUT: int = 3000
+
+# how many PTR queries discover sends when asked to refresh (the first
+# immediately, then after one second, two seconds, etc)
+_DISCOVER_REFRESH_QUERIES: int = 3
+
+# large segment mode: the TTL of our address records (in seconds), the
+# fraction of the descriptor's dt used as the TTL of its service records,
+# and the maximum random delay (in seconds) before discover resolves a
+# service, during which another host's query may already put it in our cache
+_LARGE_SEGMENT_HOST_TTL: int = 3600
+_LARGE_SEGMENT_TTL_FRACTION: float = 0.25
+_LARGE_SEGMENT_RESOLVE_JITTER: float = 5.0
+
+# rate (per second) and burst size of the token buckets which limit how many
+# descriptors discover and organize accept per source address and per vk
+_DESCRIPTOR_RATE_LIMIT: float = 1.0
+_DESCRIPTOR_RATE_BURST: float = 10.0
+
 # example descriptor for tests (use "vula verify my-descriptor" in
 # testnet-shell to regenerate when something needs to change)
 _TEST_DESC = "c=cBVKup6b9dM6hfY0pE81fCKPJ6EFVvT7m+Gkt/W7gIHhBl50fdKZzT5feHACzJXDRzhxYicoyi358tREqhcyWw==; dt=86400; e=0; hostname=vula-bookworm-test2.local.; pk=6T2K6Xcmlsr1XQVZTAHrZs/d9v3IadKYI+74559/3Aw=; port=5354; r=; s=PuDfyhWpftSbWUMMydt1Qv7o618KIli9ncxUkcPP8yqaspDXa0jJUnwNwydEpXjVfY96BmVu5Jwba8ahZPzBDA==; v4a=10.89.0.3; v6a=fdff:ffff:ffdf:e436:dfba:4f29:bcbf:6af8,fe80::cc69:7dff:fe6b:9e79,fd54:f27a:17c1:3a61::3; vf=1743985213; vk=Gy+arU0cowJC2vek9EnoGHVSQxUl5Qv1LUrDL/WjGos=;"  # noqa: E501
@@ -2,7 +2,8 @@
 *vula* CTIDH interface functions.
 """
 
-from typing import ByteString
+from functools import lru_cache
+from typing import ByteString, cast
 
 from highctidh import ctidh  # type: ignore[attr-defined, unused-ignore]
 from cryptography.hazmat.primitives import hashes
@@ -38,6 +39,49 @@ def hkdf(raw_key: ByteString) -> str:
     return psk
 
 
+def psk_cache_key(sk: ByteString) -> bytes:
+    """
+    Derive the key used to encrypt organize's PSK cache from our CTIDH secret
+    key.
+
+    >>> len(psk_cache_key(b"test string"))
+    32
+    >>> psk_cache_key(b"a") == psk_cache_key(b"b")
+    False
+    """
+    return HKDF(
+        algorithm=hashes.SHA512(),
+        length=32,
+        salt=None,
+        info=b"vula-organize-psk-cache-1",
+    ).derive(bytes(sk))
+
+
+@lru_cache(maxsize=1)
+def _ctidh() -> ctidh:
+    return ctidh(ctidh_parameters)
+
+
+def ctidh_dh_raw(sk: bytes, pk: bytes) -> bytes:
+    """
+    Returns the raw CTIDH shared secret of a secret key and a public key.
+
+    This is a module-level function so that it can be run in a process pool.
+
+    >>> c = _ctidh()
+    >>> a, b = c.generate_secret_key(), c.generate_secret_key()
+    >>> ab = ctidh_dh_raw(bytes(a), bytes(b.derive_public_key()))
+    >>> ba = ctidh_dh_raw(bytes(b), bytes(a.derive_public_key()))
+    >>> ab == ba
+    True
+    """
+    c = _ctidh()
+    return cast(
+        bytes,
+        c.dh(c.private_key_from_bytes(sk), c.public_key_from_bytes(pk)),
+    )
+
+
 if __name__ == "__main__":
     import doctest
 
@@ -45,6 +89,8 @@ if __name__ == "__main__":
 
 __all__ = [
     "ctidh",
+    "ctidh_dh_raw",
     "ctidh_parameters",
     "hkdf",
+    "psk_cache_key",
 ]
@@ -13,28 +13,289 @@ hosts such as `127.0.0.1` or other addresses. Care should be taken that only
 addresses for the local network segment are used as WireGuard peers.
 """
 
+import asyncio
+import json
+import random
+import socket
+import struct
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from ipaddress import IPv4Network, IPv6Network, ip_interface
 from ipaddress import ip_address as ip_addr_parser
 from logging import Logger, getLogger
+from threading import Lock, Thread
 from typing import Optional, Callable, Any
 import click
 import pydbus
 from click.exceptions import Exit
 from gi.repository import GLib
 from pyroute2 import IPRoute
-from zeroconf import ServiceBrowser, ServiceInfo, ServiceListener, Zeroconf
+from zeroconf import (
+    DNSOutgoing,
+    DNSQuestion,
+    IPVersion,
+    ServiceInfo,
+    ServiceListener,
+    ServiceStateChange,
+    Zeroconf,
+)
+from zeroconf.asyncio import (
+    AsyncServiceBrowser,
+    AsyncServiceInfo,
+    AsyncZeroconf,
+)
+from zeroconf.const import (
+    _CLASS_IN,
+    _FLAGS_QR_QUERY,
+    _MDNS_ADDR,
+    _MDNS_ADDR6,
+    _TYPE_PTR,
+)
 
+# python-zeroconf has no API for changing the IPs of a running instance, or
+# for finding out which address records came from, so Discover uses some of
+# its internals (as of the minimum version we depend on). Each use is checked
+# first, so that if they change, Discover falls back to restarting zeroconf
+# when its IPs change, and to not rate-limiting services by their source.
+try:
+    from zeroconf._listener import AsyncListener
+    from zeroconf._transport import make_wrapped_transport
+    from zeroconf._utils.net import (
+        add_multicast_member,
+        new_respond_socket,
+        normalize_interface_choice,
+    )
+
+    _HAVE_ZEROCONF_INTERNALS = True
+except ImportError:
+    _HAVE_ZEROCONF_INTERNALS = False
+
+from .common import RateLimiter
 from .constants import (
+    _DESCRIPTOR_RATE_BURST,
+    _DESCRIPTOR_RATE_LIMIT,
     _DISCOVER_DBUS_NAME,
+    _DISCOVER_MAX_RESOLUTIONS,
+    _DISCOVER_REFRESH_INTERVAL,
+    _DISCOVER_REFRESH_QUERIES,
+    _DISCOVER_RESOLUTION_TIMEOUT,
     _LABEL,
+    _LARGE_SEGMENT_RESOLVE_JITTER,
+    _LRU_CACHE_MAX_SIZE,
     _ORGANIZE_DBUS_NAME,
     _ORGANIZE_DBUS_PATH,
 )
 from .peer import Descriptor
 
 
+class DescriptorFilter(object):
+    """
+    *DescriptorFilter* remembers the last descriptor forwarded for each
+    service name and each vk, so that re-announcements of unchanged
+    descriptors don't need to be sent to organize again.
+
+    Unchanged descriptors are still forwarded every *refresh_interval*
+    seconds, and after *refresh* is called.
+
+    >>> from .constants import _TEST_DESC
+    >>> f = DescriptorFilter(refresh_interval=60)
+    >>> d = Descriptor.parse(_TEST_DESC)
+    >>> f.changed('a', d, now=0), f.changed('a', d, now=1)
+    (True, False)
+    >>> f.changed('b', d, now=2), f.changed('a', d, now=61)
+    (True, True)
+    >>> f.changed('a', Descriptor(dict(d, vf=d.vf + 1)), now=62)
+    True
+    >>> f.forget('a'); f.changed('a', d, now=63)
+    True
+    >>> f.refresh(); f.changed('b', d, now=64)
+    True
+    >>> f.forwarded, f.suppressed
+    (6, 1)
+    """
+
+    def __init__(
+        self,
+        refresh_interval: float = _DISCOVER_REFRESH_INTERVAL,
+        max_size: int = _LRU_CACHE_MAX_SIZE,
+    ) -> None:
+        self.refresh_interval = refresh_interval
+        self.max_size = max_size
+        self._lock = Lock()
+        # name or vk -> (descriptor string, time it was last forwarded)
+        self._by_name: OrderedDict[str, tuple[str, float]] = OrderedDict()
+        self._by_vk: OrderedDict[str, tuple[str, float]] = OrderedDict()
+        self.forwarded = 0
+        self.suppressed = 0
+
+    def changed(
+        self, name: str, desc: Descriptor, now: Optional[float] = None
+    ) -> bool:
+        """
+        Returns True if *desc* should be forwarded, and remembers it if so.
+        """
+        if now is None:
+            now = time.time()
+        value = str(desc)
+        vk = str(desc.vk)
+        with self._lock:
+            for cache, key in ((self._by_name, name), (self._by_vk, vk)):
+                last = cache.get(key)
+                if (
+                    last is None
+                    or last[0] != value
+                    or now - last[1] >= self.refresh_interval
+                ):
+                    break
+            else:
+                self.suppressed += 1
+                return False
+            for cache, key in ((self._by_name, name), (self._by_vk, vk)):
+                cache[key] = (value, now)
+                cache.move_to_end(key)
+                while len(cache) > self.max_size:
+                    cache.popitem(last=False)
+            self.forwarded += 1
+            return True
+
+    def forget(self, name: str) -> None:
+        with self._lock:
+            self._by_name.pop(name, None)
+
+    def refresh(self) -> None:
+        "Forward the next announcement of every service, changed or not."
+        with self._lock:
+            self._by_name.clear()
+            self._by_vk.clear()
+
+
+def _drop_multicast_member(
+    listen_socket: socket.socket, ip: str, respond_socket: socket.socket
+) -> None:
+    """
+    Leave the mDNS multicast group on the interface of a respond socket,
+    undoing zeroconf's add_multicast_member.
+    """
+    try:
+        if ip_addr_parser(ip).version == 6:
+            index = respond_socket.getsockopt(
+                socket.IPPROTO_IPV6, socket.IPV6_MULTICAST_IF
+            )
+            listen_socket.setsockopt(
+                socket.IPPROTO_IPV6,
+                socket.IPV6_LEAVE_GROUP,
+                socket.inet_pton(socket.AF_INET6, _MDNS_ADDR6)
+                + struct.pack('@I', index),
+            )
+        else:
+            listen_socket.setsockopt(
+                socket.IPPROTO_IP,
+                socket.IP_DROP_MEMBERSHIP,
+                socket.inet_aton(_MDNS_ADDR) + socket.inet_aton(ip),
+            )
+    except OSError as ex:
+        # the address or interface may already be gone
+        getLogger().debug("Couldn't leave multicast group on %s: %r", ip, ex)
+
+
+_ENGINE_INTERNALS = (
+    'loop',
+    '_listen_socket',
+    'readers',
+    'senders',
+    'protocols',
+)
+_TRANSPORT_INTERNALS = ('transport', 'sock', 'sock_name')
+_PROTOCOL_INTERNALS = ('data', 'last_message')
+
+
+def _unsupported_zeroconf_internals(zc: Zeroconf) -> list[str]:
+    """
+    Returns the python-zeroconf internals which Discover._async_rebind uses
+    but which this version of it (or this instance) doesn't have.
+    """
+    if not _HAVE_ZEROCONF_INTERNALS:
+        return ['zeroconf._listener, _transport or _utils.net']
+    engine = getattr(zc, 'engine', None)
+    if engine is None:
+        return ['Zeroconf.engine']
+    missing = [
+        'engine.' + name
+        for name in _ENGINE_INTERNALS
+        if not hasattr(engine, name)
+    ]
+    if missing:
+        return missing
+    missing = sorted(
+        {
+            'transport.' + name
+            for reader in engine.readers
+            for name in _TRANSPORT_INTERNALS
+            if not hasattr(reader, name)
+        }
+        | {
+            'protocol.' + name
+            for protocol in engine.protocols
+            for name in _PROTOCOL_INTERNALS
+            if not hasattr(protocol, name)
+        }
+    )
+    if len(engine.readers) != len(engine.protocols):
+        missing.append('engine.protocols matching engine.readers')
+    if engine.loop is None or engine._listen_socket is None:
+        missing.append('a started engine')
+    return missing
+
+
+class _SourceTap(object):
+    """
+    Wraps the protocol of one of zeroconf's sockets, to remember the address
+    which each vula service's records were last received from. Zeroconf
+    doesn't keep track of that, and the addresses in the records themselves
+    are chosen by their sender.
+
+    The protocol must have zeroconf's AsyncListener's data and last_message
+    attributes. Packets are always passed on to it, even if its parsed
+    messages can't be read.
+    """
+
+    def __init__(self, protocol: Any, sources: OrderedDict[str, str]) -> None:
+        missing = [a for a in _PROTOCOL_INTERNALS if not hasattr(protocol, a)]
+        if missing:
+            raise AttributeError("zeroconf listener has no %r" % (missing,))
+        self.protocol = protocol
+        self.sources = sources
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.protocol, name)
+
+    def datagram_received(self, data: bytes, addrs: tuple[Any, ...]) -> None:
+        self.protocol.datagram_received(data, addrs)
+        try:
+            self._record_source(data, addrs[0])
+        except Exception as ex:
+            getLogger().debug("Couldn't record source of %r: %r", data, ex)
+
+    def _record_source(self, data: bytes, source: str) -> None:
+        msg = self.protocol.last_message
+        # duplicate packets are ignored by zeroconf without being parsed
+        if msg is None or self.protocol.data is not data:
+            return
+        if not msg.valid or msg.is_query():
+            return
+        for record in msg.answers():
+            if record.key.endswith(_LABEL):
+                self.sources[record.key] = source
+                self.sources.move_to_end(record.key)
+        while len(self.sources) > _LRU_CACHE_MAX_SIZE:
+            self.sources.popitem(last=False)
+
+
 class VulaServiceListener(ServiceListener):
     """
-    *VulaServiceListener* is for use with *zeroconf*'s *ServiceBrowser*.
+    *VulaServiceListener* is for use with *zeroconf*'s *ServiceBrowser*, and
+    turns resolved services into descriptors for *Discover*.
 
     The key-value pairs conform to
     https://tools.ietf.org/html/rfc6763#section-6.4.
@@ -44,16 +305,31 @@ class VulaServiceListener(ServiceListener):
         self,
         callback: Callable[[Descriptor], None],
         our_wg_pk: Optional[str] = None,
+        descriptor_filter: Optional[DescriptorFilter] = None,
+        source_limiter: Optional[RateLimiter] = None,
+        sources: Optional[OrderedDict[str, str]] = None,
     ) -> None:
         """
         Specifying our_wg_pk is optional, and allows discover to drop our own
         local descriptors before they get to organize. This reduces log noise
         and was helpful for debugging.
+
+        If a descriptor_filter is given, descriptors which haven't changed
+        since they were last passed to the callback are dropped.
+
+        If a source_limiter is given, services are dropped (before their
+        descriptors are parsed) when the address their records were received
+        from, which is looked up by (lowercased) service name in sources, has
+        exceeded its rate. Descriptors' vks aren't rate-limited here, as
+        their signatures haven't been verified yet; organize does that.
         """
         super(VulaServiceListener, self).__init__()
         self.log: Logger = getLogger()
         self.callback = callback
         self.our_wg_pk = our_wg_pk
+        self.descriptor_filter = descriptor_filter
+        self.source_limiter = source_limiter
+        self.sources = sources
 
     def add_service(self, zeroconf: Zeroconf, s_type: str, name: str) -> None:
         """
@@ -72,6 +348,26 @@ class VulaServiceListener(ServiceListener):
         if info is None:
             return
 
+        self.add_service_info(name, info)
+
+    def add_service_info(self, name: str, info: ServiceInfo) -> None:
+        """
+        Passes the descriptor of a resolved service to the callback (unless
+        its pk is our_wg_pk, or the descriptor_filter drops it).
+        """
+        source = None
+        if self.sources is not None:
+            source = self.sources.get(name.lower())
+        if (
+            self.source_limiter is not None
+            and source is not None
+            and not self.source_limiter.allow([source])
+        ):
+            self.log.debug(
+                "discover rate-limited service %r from %s", name, source
+            )
+            return
+
         try:
             desc = Descriptor.from_zeroconf_properties(info.properties)
         except Exception as ex:
@@ -84,12 +380,20 @@ class VulaServiceListener(ServiceListener):
         if str(desc.pk) == self.our_wg_pk:
             self.log.debug("discover ignored descriptor with our_wg_pk")
 
-        else:
+        elif self.descriptor_filter is None or self.descriptor_filter.changed(
+            name, desc
+        ):
             self.callback(desc)
 
     def update_service(self, *a: Any, **kw: Any) -> None:
         return self.add_service(*a, **kw)
 
+    def remove_service(
+        self, zeroconf: Zeroconf, s_type: str, name: str
+    ) -> None:
+        if self.descriptor_filter is not None:
+            self.descriptor_filter.forget(name)
+
 
 class Discover(object):
     dbus = '''
@@ -99,19 +403,138 @@ class Discover(object):
           <arg type='as' name='ip_addrs' direction='in'/>
           <arg type='s' name='our_wg_pk' direction='in'/>
         </method>
+        <method name='refresh'>
+        </method>
+        <method name='stats'>
+          <arg type='s' name='response' direction='out'/>
+        </method>
       </interface>
     </node>
     '''
 
-    def __init__(self) -> None:
+    def __init__(
+        self,
+        max_resolutions: int = _DISCOVER_MAX_RESOLUTIONS,
+        large_segment: bool = False,
+    ) -> None:
+        """
+        In large segment mode, services are resolved after a random delay,
+        and not queried for at all if another host's query has put them in
+        our cache in the meantime.
+        """
+        self.large_segment = large_segment
+        self.cache_hits = 0
+        self.queries = 0
         self.callbacks: list[Callable[[Descriptor], Any]] = []
-        self.browsers: dict[str, tuple[Zeroconf, ServiceBrowser]] = {}
+        # a single zeroconf instance and browser for all of our IPs, running
+        # in an asyncio event loop on its own thread
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_thread: Optional[Thread] = None
+        self.zeroconf: Optional[AsyncZeroconf] = None
+        self.browser: Optional[AsyncServiceBrowser] = None
+        self.listener: Optional[VulaServiceListener] = None
+        self.ip_addrs: list[str] = []
+        # the IPs the zeroconf instance is currently bound to
+        self._bound_ips: list[str] = []
+        # services are resolved concurrently, up to max_resolutions at a time
+        self.max_resolutions = max_resolutions
+        self._resolution_slots: Optional[asyncio.Semaphore] = None
+        self._resolving: set[str] = set()
+        # names of the services the browser currently knows about
+        self.services: set[str] = set()
+        # our IPs -> (interface name, subnet), and vk -> interface name of
+        # recently discovered peers
+        self.interfaces: dict[str, tuple[str, IPv4Network | IPv6Network]] = {}
+        self.attribution: OrderedDict[str, str] = OrderedDict()
         self.log: Logger = getLogger()
+        self.descriptor_filter = DescriptorFilter()
+        # services are rate-limited by the address their records came from
+        self.source_limiter = RateLimiter(
+            _DESCRIPTOR_RATE_LIMIT, _DESCRIPTOR_RATE_BURST
+        )
+        self.sources: OrderedDict[str, str] = OrderedDict()
+
+    def stats(self) -> str:
+        """
+        Returns JSON with counts of forwarded and dropped descriptors.
+        """
+        return json.dumps(
+            dict(
+                cache_hits=self.cache_hits,
+                queries=self.queries,
+                forwarded=self.descriptor_filter.forwarded,
+                unchanged=self.descriptor_filter.suppressed,
+                rate_limited_sources=self.source_limiter.dropped,
+                peers_by_interface=self.peers_by_interface(),
+            )
+        )
+
+    def peers_by_interface(self) -> dict[str, int]:
+        """
+        Returns the number of recently discovered peers on each interface.
+        """
+        counts: dict[str, int] = {}
+        for iface in self.attribution.values():
+            counts[iface] = counts.get(iface, 0) + 1
+        return counts
 
     def callback(self, value: Descriptor) -> None:
+        """
+        Called in the GLib main loop with each new or changed descriptor.
+        """
+        iface = self.attribute(value)
+        if iface is not None:
+            self.attribution[str(value.vk)] = iface
+            self.attribution.move_to_end(str(value.vk))
+            while len(self.attribution) > _LRU_CACHE_MAX_SIZE:
+                self.attribution.popitem(last=False)
         for callback in self.callbacks:
             callback(value)
 
+    def attribute(self, desc: Descriptor) -> Optional[str]:
+        """
+        Returns the name of the interface (among those we are listening on)
+        which has a subnet containing one of the descriptor's addresses.
+
+        >>> from .constants import _TEST_DESC
+        >>> d = Discover()
+        >>> d.interfaces = {'10.89.0.2': ('eth0', IPv4Network('10.89.0.0/24'))}
+        >>> d.attribute(Descriptor.parse(_TEST_DESC))
+        'eth0'
+        >>> d.interfaces = {'10.0.0.2': ('eth1', IPv4Network('10.0.0.0/24'))}
+        >>> d.attribute(Descriptor.parse(_TEST_DESC)) is None
+        True
+        """
+        for addr in desc.all_addrs:
+            for iface, net in self.interfaces.values():
+                if addr in net:
+                    return iface
+        return None
+
+    def _lookup_interfaces(
+        self, ip_addrs: list[str]
+    ) -> dict[str, tuple[str, IPv4Network | IPv6Network]]:
+        """
+        Returns the interface name and subnet of each of our IPs.
+        """
+        interfaces = {}
+        try:
+            with IPRoute() as ipr:
+                names = {
+                    link['index']: link.get_attr('IFLA_IFNAME')
+                    for link in ipr.get_links()
+                }
+                for addr in ipr.get_addr():
+                    ip = addr.get_attr('IFA_ADDRESS')
+                    if ip in ip_addrs:
+                        interfaces[ip] = (
+                            names.get(addr['index'], ip),
+                            ip_interface(f"{ip}/{addr['prefixlen']}").network,
+                        )
+        except Exception as ex:
+            self.log.info("Couldn't look up our interfaces: %r", ex)
+        return interfaces
+
     def listen_on_ip_or_if(self, ip_address: str, interface: str) -> None:
         """
         Deprecated.
@@ -142,40 +565,287 @@ class Discover(object):
         if ip_addr:
             self.listen([ip_addr])
 
-    def listen(
-        self, ip_addrs: list[str], our_wg_pk: Optional[str] = None
+    def _start_loop(self) -> asyncio.AbstractEventLoop:
+        if self.loop is None:
+            self.loop = asyncio.new_event_loop()
+            self._loop_thread = Thread(
+                target=self.loop.run_forever,
+                name="vula-discover-asyncio",
+                daemon=True,
+            )
+            self._loop_thread.start()
+        return self.loop
+
+    def _run(self, coro: Any) -> Any:
+        "Run a coroutine in our event loop, and wait for its result."
+        future: Future[Any] = asyncio.run_coroutine_threadsafe(
+            coro, self._start_loop()
+        )
+        return future.result()
+
+    def _deliver(self, desc: Descriptor) -> None:
+        "Pass a descriptor from the event loop to the GLib main loop."
+
+        def deliver() -> bool:
+            self.callback(desc)
+            return False
+
+        GLib.idle_add(deliver)
+
+    def _on_service_state_change(
+        self,
+        zeroconf: Zeroconf,
+        service_type: str,
+        name: str,
+        state_change: ServiceStateChange,
     ) -> None:
-        for ip_addr in ip_addrs:
-            if ip_addr in self.browsers:
-                self.log.info("Not launching a second browser for %r", ip_addr)
-                continue
-            zeroconf: Zeroconf = Zeroconf(interfaces=[ip_addr])
-            self.log.debug("Starting ServiceBrowser for %r", ip_addr)
-            browser: ServiceBrowser = ServiceBrowser(
-                zeroconf, _LABEL, VulaServiceListener(self.callback, our_wg_pk)
+        """
+        Handler for the browser, called in the event loop.
+        """
+        if state_change is ServiceStateChange.Removed:
+            self.services.discard(name)
+            self.descriptor_filter.forget(name)
+        else:
+            self.services.add(name)
+            self._schedule_resolve(zeroconf, service_type, name)
+
+    def _schedule_resolve(
+        self, zeroconf: Zeroconf, service_type: str, name: str
+    ) -> None:
+        if name not in self._resolving:
+            self._resolving.add(name)
+            asyncio.ensure_future(self._resolve(zeroconf, service_type, name))
+
+    async def _resolve(
+        self, zeroconf: Zeroconf, service_type: str, name: str
+    ) -> None:
+        """
+        Resolve a service without blocking the resolution of others, and
+        pass its descriptor on.
+        """
+        assert self._resolution_slots is not None
+        try:
+            if self.large_segment:
+                await asyncio.sleep(
+                    random.uniform(0, _LARGE_SEGMENT_RESOLVE_JITTER)
+                )
+            info = AsyncServiceInfo(service_type, name)
+            if info.load_from_cache(zeroconf):
+                self.cache_hits += 1
+            else:
+                async with self._resolution_slots:
+                    self.queries += 1
+                    if not await info.async_request(
+                        zeroconf, _DISCOVER_RESOLUTION_TIMEOUT
+                    ):
+                        self.log.debug("discover couldn't resolve %r", name)
+                        return
+            if self.listener is not None:
+                self.listener.add_service_info(name, info)
+        except Exception as ex:
+            self.log.info("discover failed to resolve %r: %r", name, ex)
+        finally:
+            self._resolving.discard(name)
+
+    async def _async_listen(
+        self, ip_addrs: list[str], our_wg_pk: Optional[str]
+    ) -> None:
+        if self.zeroconf is not None and ip_addrs:
+            try:
+                await self._async_rebind(ip_addrs)
+                if self.listener is not None:
+                    self.listener.our_wg_pk = our_wg_pk
+                return
+            except Exception as ex:
+                self.log.info(
+                    "Couldn't change zeroconf's IPs, restarting it: %r", ex
+                )
+        old_zeroconf, old_browser = self.zeroconf, self.browser
+        self.zeroconf = self.browser = None
+        self.services = set()
+        self._bound_ips = []
+        if ip_addrs:
+            self.log.debug("Starting ServiceBrowser for %r", ip_addrs)
+            self._resolution_slots = asyncio.Semaphore(self.max_resolutions)
+            self.listener = VulaServiceListener(
+                self._deliver,
+                our_wg_pk,
+                self.descriptor_filter,
+                self.source_limiter,
+                self.sources,
+            )
+            # IPv6 is always enabled, so that the listening socket can join
+            # the multicast group on IPv6 interfaces added later
+            self.zeroconf = AsyncZeroconf(
+                interfaces=ip_addrs, ip_version=IPVersion.All
             )
-            self.browsers[ip_addr] = (zeroconf, browser)
-        for old_ip in list(self.browsers):
-            if old_ip not in ip_addrs:
+            self._bound_ips = list(ip_addrs)
+            try:
+                await self.zeroconf.zeroconf.async_wait_for_start()
+                for reader in self.zeroconf.zeroconf.engine.readers:
+                    self._tap_sources(reader.transport)
+            except Exception as ex:
                 self.log.info(
-                    "Removing old service browser for %r (new ip_addrs=%r)",
-                    old_ip,
-                    ip_addrs,
+                    "Can't rate-limit services by their source: %r", ex
                 )
-                self.browsers[old_ip][1].cancel()
-                self.browsers[old_ip][0].close()
-                del self.browsers[old_ip]
+            self.browser = AsyncServiceBrowser(
+                self.zeroconf.zeroconf,
+                _LABEL,
+                handlers=[self._on_service_state_change],
+            )
+        if old_browser is not None:
+            self.log.info(
+                "Removing old service browser (new ip_addrs=%r)", ip_addrs
+            )
+            await old_browser.async_cancel()
+        if old_zeroconf is not None:
+            await old_zeroconf.async_close()
+
+    def _tap_sources(self, transport: Any) -> None:
+        transport.set_protocol(
+            _SourceTap(transport.get_protocol(), self.sources)
+        )
+
+    async def _async_rebind(self, ip_addrs: list[str]) -> None:
+        """
+        Add and remove IPs on the running zeroconf instance, keeping its
+        cache and browser, so that only the interfaces which changed are
+        affected.
+
+        python-zeroconf has no API for this, so for each added IP this does
+        what it does for each of its interfaces when it starts (joining the
+        multicast group on the listening socket, and creating a socket to
+        respond from), using its internals. If any of them are missing or
+        different, this raises an exception before changing anything, and
+        the instance is replaced instead.
+        """
+        assert self.zeroconf is not None
+        zc = self.zeroconf.zeroconf
+        unsupported = _unsupported_zeroconf_internals(zc)
+        if unsupported:
+            raise RuntimeError(
+                "unsupported zeroconf version, missing %s"
+                % (", ".join(unsupported),)
+            )
+        engine = zc.engine
+        listen_socket = engine._listen_socket
+        removed = [ip for ip in self._bound_ips if ip not in ip_addrs]
+        added = [ip for ip in ip_addrs if ip not in self._bound_ips]
+        for ip in removed:
+            self.log.info("Stopping mDNS on %s", ip)
+            for i, reader in enumerate(engine.readers):
+                if reader.sock_name[0].split('%')[0] == ip:
+                    _drop_multicast_member(listen_socket, ip, reader.sock)
+                    reader.transport.close()
+                    del engine.readers[i]
+                    del engine.protocols[i]
+                    engine.senders[:] = [
+                        sender
+                        for sender in engine.senders
+                        if sender.transport is not reader.transport
+                    ]
+                    break
+            self._bound_ips.remove(ip)
+        for interface in normalize_interface_choice(added):
+            ip = interface if isinstance(interface, str) else interface[0][0]
+            self.log.info("Starting mDNS on %s", ip)
+            sock = None
+            if add_multicast_member(listen_socket, interface):
+                sock = new_respond_socket(interface)
+            if sock is None:
+                self.log.info("Couldn't start mDNS on %s", ip)
+                continue
+            transport, protocol = await engine.loop.create_datagram_endpoint(
+                lambda: AsyncListener(zc), sock=sock
+            )
+            self._tap_sources(transport)
+            wrapped = make_wrapped_transport(transport)
+            engine.protocols.append(protocol)
+            engine.readers.append(wrapped)
+            engine.senders.append(wrapped)
+            self._bound_ips.append(ip)
+        if added:
+            # ask the new interfaces' peers to announce themselves
+            asyncio.ensure_future(self._async_query(zc))
+
+    def listen(
+        self, ip_addrs: list[str], our_wg_pk: Optional[str] = None
+    ) -> None:
+        """
+        Browse for vula services on the given IPs, with a single zeroconf
+        instance.
+
+        When the IPs change, the instance's sockets for the IPs which were
+        removed are closed, and sockets for the new ones are added, without
+        discarding its cache or restarting the browser. Descriptors already
+        forwarded are not forwarded again.
+        """
+        if sorted(ip_addrs) == sorted(self.ip_addrs):
+            if ip_addrs:
+                self.log.info("Already browsing on %r", ip_addrs)
+            return
+        self.ip_addrs = list(ip_addrs)
+        self.interfaces = self._lookup_interfaces(self.ip_addrs)
+        self._run(self._async_listen(self.ip_addrs, our_wg_pk))
+
+    def refresh(self) -> None:
+        """
+        Forward the descriptors of all services again, changed or not,
+        without restarting the browser or discarding the cache: services
+        with cached records are forwarded immediately, and a burst of queries
+        asks everyone else to announce themselves.
+
+        This doesn't wait for the event loop, so it is safe to call from
+        organize while discover may be waiting to deliver descriptors to it.
+        """
+        self.descriptor_filter.refresh()
+        if self.loop is not None:
+            asyncio.run_coroutine_threadsafe(self._async_refresh(), self.loop)
+
+    async def _async_refresh(self) -> None:
+        if self.zeroconf is None:
+            return
+        zeroconf = self.zeroconf.zeroconf
+        for name in sorted(self.services):
+            self._schedule_resolve(zeroconf, _LABEL, name)
+        await self._async_query(zeroconf)
+
+    async def _async_query(self, zeroconf: Zeroconf) -> None:
+        "Send a burst of queries for vula services."
+        for i in range(_DISCOVER_REFRESH_QUERIES):
+            if i:
+                await asyncio.sleep(2 ** (i - 1))
+                if self.zeroconf is None or (
+                    self.zeroconf.zeroconf is not zeroconf
+                ):
+                    # we have been restarted or shut down since
+                    return
+            out = DNSOutgoing(_FLAGS_QR_QUERY)
+            out.add_question(DNSQuestion(_LABEL, _TYPE_PTR, _CLASS_IN))
+            zeroconf.async_send(out)
 
     def shutdown(self) -> None:
-        for ip, browser in list(self.browsers.items()):
-            del self.browsers[ip]
-            browser[1].cancel()
+        if self.loop is not None:
+            self._run(self._async_listen([], None))
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self.loop = self._loop_thread = None
+        self.ip_addrs = []
 
     def is_alive(self) -> bool:
-        return any(browser[1].is_alive() for browser in self.browsers.values())
+        return (
+            self.browser is not None
+            and self._loop_thread is not None
+            and self._loop_thread.is_alive()
+        )
 
     @classmethod
-    def daemon(cls, use_dbus: bool, ip_address: str, interface: str) -> None:
+    def daemon(
+        cls,
+        use_dbus: bool,
+        ip_address: str,
+        interface: str,
+        large_segment: bool,
+    ) -> None:
         """
         This method implements the non-monolithic daemon mode where we run
         Discover in its own process (as deployed on GNU/systemd).
@@ -183,7 +853,7 @@ class Discover(object):
 
         loop = GLib.MainLoop()
 
-        discover = cls()
+        discover = cls(large_segment=large_segment)
 
         discover.callbacks.append(lambda d: discover.log.debug("%s", d))
 
@@ -235,6 +905,12 @@ class Discover(object):
     help="bind to the primary IP address for the given interface, "
     "automatically choosing which IP to announce",
 )
+@click.option(
+    "--large-segment",
+    is_flag=True,
+    help="delay resolving services, to benefit from other hosts' queries, "
+    "for segments with many vula hosts",
+)
 def main(**kwargs: Any) -> None:
     Discover.daemon(**kwargs)
 
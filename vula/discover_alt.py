@@ -1,5 +1,8 @@
+import ctypes
 import hashlib
+import selectors
 import socket
+import struct
 import threading
 import time
 import zlib
@@ -18,9 +21,67 @@ from .constants import (
     _ORGANIZE_DBUS_NAME,
     _ORGANIZE_DBUS_PATH,
 )
+from .framing import Reassembler
 
-# assuming 60 byte packets. we have 18 bytes padding/payload.
-PAYLOAD_MAX_SIZE = 18
+# the payload follows the 14 byte ethernet header and 28 byte ARP header
+PAYLOAD_OFFSET = 42
+
+# from asm-generic/socket.h (not exported by the socket module)
+_SO_ATTACH_FILTER: int = getattr(socket, "SO_ATTACH_FILTER", 26)
+
+
+def arp_payload_filter(
+    ethertype: int, snaplen: int
+) -> list[tuple[int, int, int, int]]:
+    """
+    Returns a classic BPF program accepting only frames of the given
+    ethertype which are at least snaplen bytes long (and so carry a
+    payload), and whose payload doesn't start with a zero byte (as the
+    padding of ordinary ARP frames does). Accepted frames are truncated to
+    snaplen bytes.
+
+    >>> a, b = socket.socketpair(socket.AF_UNIX, socket.SOCK_DGRAM)
+    >>> attach_filter(b, arp_payload_filter(0x0806, 60))
+    >>> header = bytes(12) + b"\\x08\\x06" + bytes(28)
+    >>> for payload in (bytes(18), b"a" * 18, b"b" * 10, b"c" * 30):
+    ...     _ = a.send(header + payload)
+    >>> b.setblocking(False)
+    >>> b.recv(100)[PAYLOAD_OFFSET:], b.recv(100)[PAYLOAD_OFFSET:]
+    (b'aaaaaaaaaaaaaaaaaa', b'cccccccccccccccccc')
+    >>> b.recv(100)
+    Traceback (most recent call last):
+    ...
+    BlockingIOError: [Errno 11] Resource temporarily unavailable
+    >>> a.close(); b.close()
+    """
+    drop, accept = 7, 6
+    return [
+        (0x28, 0, 0, 12),  # ldh [12]  (ethertype)
+        (0x15, 0, drop - 2, ethertype),  # jeq #ethertype
+        (0x80, 0, 0, 0),  # ld len
+        (0x35, 0, drop - 4, snaplen),  # jge #snaplen
+        (0x30, 0, 0, PAYLOAD_OFFSET),  # ldb [42]  (first payload byte)
+        (0x15, drop - 6, accept - 6, 0),  # jeq #0
+        (0x06, 0, 0, snaplen),  # ret #snaplen
+        (0x06, 0, 0, 0),  # ret #0
+    ]
+
+
+def attach_filter(
+    sock: socket.socket, program: list[tuple[int, int, int, int]]
+) -> None:
+    """
+    Attach a classic BPF program to a socket, so that the kernel drops the
+    packets it rejects before they are queued for us.
+    """
+    instructions = ctypes.create_string_buffer(
+        b"".join(struct.pack("HBBI", *i) for i in program)
+    )
+    sock.setsockopt(
+        socket.SOL_SOCKET,
+        _SO_ATTACH_FILTER,
+        struct.pack("HL", len(program), ctypes.addressof(instructions)),
+    )
 
 
 class Discover_Alt:
@@ -45,178 +106,140 @@ class Discover_Alt:
         self.insert_into_vula = insert_into_vula
         self.max_age = max_age
         self.packet_max_length = packet_max_length
+        self.payload_size = packet_max_length - PAYLOAD_OFFSET
         self.log: Logger = getLogger()
         self.socket = socket.socket(
             socket.PF_PACKET,
             socket.SOCK_RAW,
-            socket.htons(arp_code),  # maybe filter by packet type
+            socket.htons(arp_code),
+        )
+        # only frames which may carry part of a descriptor reach us
+        attach_filter(
+            self.socket, arp_payload_filter(arp_code, packet_max_length)
         )
-        # self.socket.setblocking(False)
-        self.socket.settimeout(1)
+        self.socket.setblocking(False)
+        self.selector = selectors.DefaultSelector()
+        self.selector.register(self.socket, selectors.EVENT_READ)
         self.active = False
         self.peers_lock = threading.Lock()
         self.peers: dict[Any, Any] = {}
         self.sniffing_thread: threading.Thread
-        self.packet_queue_lock = threading.Lock()
-        self.packet_queue: Queue[tuple[bytes, tuple[str, int]]] = Queue()
         self.descriptor_queue_lock = threading.Lock()
         self.descriptor_queue: Queue[str] = Queue()
         self.bus = pydbus.SystemBus()
         self.organize = self.bus.get(_ORGANIZE_DBUS_NAME, _ORGANIZE_DBUS_PATH)
 
-    def receive_packet(self) -> bool:
+    def receive_packets(self) -> int:
         """
-        Listens on the network for ARP packets
-        and adds them to the packet queue.
+        Reads all of the frames waiting on the socket, and returns how many
+        there were.
         """
-        self.log.debug("receive_packet")
-        with self.packet_queue_lock:
+        count = 0
+        now = time.time()
+        while True:
             try:
-                packet = self.socket.recvfrom(self.packet_max_length)
-                self.packet_queue.put(packet)
-                return True
-            except socket.error:
-                pass
-        time.sleep(0)  # XXX TODO: do we still need this?
-        return False
+                packet, _ = self.socket.recvfrom(self.packet_max_length)
+            except BlockingIOError:
+                return count
+            except OSError as ex:
+                self.log.info("receive failed: %r", ex)
+                return count
+            self.process_packet(now, packet)
+            count += 1
 
     def flush_old_peers(self) -> None:
         """
-        Flush stale packet streams by clearing out the data structure.
+        Forget peers we haven't received a frame from for max_age seconds,
+        along with their incomplete messages.
         """
-        self.log.debug("flush_old_peers")
         t = time.time()
         with self.peers_lock:
-            for src_mac in self.peers.keys():
-                if t - self.peers[src_mac]["updated"] > self.max_age:
-                    self.log.debug("New packet stream detected, clearing data")
-                    self.peers[src_mac]["byte_stream"] = b""
+            for src_mac in [
+                src_mac
+                for src_mac, peer in self.peers.items()
+                if t - peer["updated"] > self.max_age
+            ]:
+                self.log.debug("Flushing stale packet stream")
+                del self.peers[src_mac]
 
     def update_peer(
-        self, t: float, src_mac: bytes, candidate: Optional[bytes]
-    ) -> None:
+        self, t: float, src_mac: bytes, candidate: bytes
+    ) -> Optional[bytes]:
         """
-        Update the peer by appending the valid candidate bytes to the byte
-        stream and updating the timestamp.
+        Add a frame to the peer's reassembler and update the timestamp.
+        Returns the peer's message if this frame completed it.
         """
-        self.log.debug("update_peer")
         with self.peers_lock:
-            if candidate is None:
-                self.peers[src_mac] = {"byte_stream": b"", "updated": t}
-                return
             if src_mac not in self.peers:
-                self.peers[src_mac] = {"byte_stream": b"", "updated": t}
+                self.peers[src_mac] = {
+                    "reassembler": Reassembler(self.payload_size),
+                    "updated": t,
+                }
             self.peers[src_mac]["updated"] = t
-            self.log.debug("Received packet")
-            self.peers[src_mac]["byte_stream"] += candidate
-
-    def decrypt_all_broadcasts(self) -> None:
-        """
-        Try to decrypt the packetstream of all entries.
-        Add descriptor to queue if succesfull
-        """
-        self.log.debug("decrypt_all_broadcasts")
-        erase_list = []
-        with self.peers_lock:
-            for src_mac in self.peers.keys():
-                descriptor = self.decrypt_broadcast(src_mac)
-                if descriptor is not None:
-                    self.log.info(
-                        f"inserting into descriptor queue {descriptor}"
-                    )
-                    self.descriptor_queue.put(descriptor)
-                    erase_list.append(src_mac)
-                else:
-                    continue
-        now = time.time()
-        for src_mac in erase_list:
-            self.update_peer(now, src_mac, None)
+            return self.peers[src_mac]["reassembler"].add(candidate)
 
-    def decrypt_broadcast(self, src_mac: bytes) -> Optional[str]:
+    def process_descriptors(self, timeout: float = 1.0) -> bool:
         """
-        Start decryption process.
+        Wait for a descriptor from the descriptor queue, and send it to
+        organize.
         """
-        self.log.debug("decrypt_broadcast")
-        return self.decrypt(self.peers[src_mac]["byte_stream"], src_mac)
-
-    def process_descriptors(self) -> bool:
-        """
-        Empty descriptor queue by sending contents to organize.
-        """
-        self.log.debug("process_descriptors")
         try:
-            descriptor = self.descriptor_queue.get_nowait()
-            if self.insert_into_vula:
-                self.log.debug(
-                    "Inserting descriptor into vula. Descriptor: "
-                    + str(descriptor)
-                )
-                self.organize.process_descriptor_string(descriptor)
-                return True
-            else:
-                self.log.info(descriptor)
-                return True
+            descriptor = self.descriptor_queue.get(timeout=timeout)
         except Empty:
             return False
+        if self.insert_into_vula:
+            self.log.debug(
+                "Inserting descriptor into vula. Descriptor: "
+                + str(descriptor)
+            )
+            self.organize.process_descriptor_string(descriptor)
+        else:
+            self.log.info(descriptor)
+        return True
 
-    def process_packet(self) -> bool:
+    def process_packet(self, t: float, packet: bytes) -> None:
         """
-        Empty packet queue and process contents.
+        Add the payload of a packet to its sender's reassembler, and decrypt
+        the message it completes, if any. The socket's filter has already
+        dropped frames without a payload, but we check again in case frames
+        arrived before it was attached.
         """
-        self.log.debug("process_packet")
-        try:
-            packet = self.packet_queue.get_nowait()
-            candidate = packet[0][42:]
-            if candidate[0] != 0 and len(candidate) == PAYLOAD_MAX_SIZE:
-                src_mac = packet[0][22:28]
-                now = int(time.time())
-                self.update_peer(now, src_mac, candidate)
-                return True
-            else:
-                del packet
-                del candidate
-        except Empty:
-            return False
-        finally:
-            time.sleep(0)
-            return False
+        candidate = packet[PAYLOAD_OFFSET:]
+        if len(candidate) != self.payload_size or candidate[0] == 0:
+            return
+        src_mac = packet[22:28]
+        message = self.update_peer(t, src_mac, candidate)
+        if message is None:
+            return
+        descriptor = self.decrypt(message, src_mac)
+        if descriptor is None:
+            self.log.debug("Dropped message which failed to decrypt")
+            return
+        self.log.info(f"inserting into descriptor queue {descriptor}")
+        self.descriptor_queue.put(descriptor)
 
     def capture(self) -> None:
         """
-        Main body of capture thread. Captures and processes packets.
-        Updates descriptor queue for processing.
+        Main body of capture thread. Waits for frames, and reads all that
+        are pending. Stale peers are flushed whenever we wake up.
         """
         self.log.debug("starting capture")
         while self.active:
-            self.receive_packet()
-            self.log.debug("received packets")
-            self.process_packet()
-            self.log.debug("processed packets")
-            time.sleep(0.5)
+            for _ in self.selector.select(timeout=1.0):
+                self.receive_packets()
+            self.flush_old_peers()
         self.log.debug("stopping capture")
 
     def process(self) -> None:
         """
-        Main body of processing thread. Processes all packets in queue
+        Main body of processing thread. Sends descriptors to organize as
+        they are decrypted.
         """
         self.log.debug("starting processing")
         while self.active:
-            self.decrypt_all_broadcasts()
             self.process_descriptors()
-            self.log.debug("processed descriptors")
-            time.sleep(0.5)
         self.log.debug("stopping process")
 
-    def flush(self) -> None:
-        """
-        Main body of flushing thread. Clean up data structure.
-        """
-        self.log.debug("flush")
-        while self.active:
-            self.flush_old_peers()
-            time.sleep(0.5)
-        self.log.debug("stopping flush")
-
     def decrypt(self, message: bytes, key: bytes) -> Optional[str]:
         """
         Decrypts and decompresses message with given key.
@@ -225,7 +248,7 @@ class Discover_Alt:
         key = hashlib.sha256(key).digest()
         box = nacl.secret.SecretBox(key)
         try:
-            decrypt = box.decrypt(message.strip(b"\x00"))
+            decrypt = box.decrypt(message)
             decrypt = zlib.decompress(decrypt)
             if decrypt[10:15] == b"addrs":
                 return str(decrypt[10:], "utf-8")
@@ -244,8 +267,6 @@ class Discover_Alt:
         self.sniffing_thread.start()
         self.processing_thread = threading.Thread(target=self.process)
         self.processing_thread.start()
-        self.flushing_thread = threading.Thread(target=self.flush)
-        self.flushing_thread.start()
 
     def stop(self) -> None:
         """
@@ -1,9 +1,10 @@
 from __future__ import annotations
 
 import copy
+import time
 import traceback
 from functools import reduce, wraps
-from threading import Lock
+from threading import Condition, Lock, Thread
 from typing import (
     Optional,
     TypeAlias,
@@ -11,6 +12,7 @@ from typing import (
     ParamSpec,
     TypeVar,
     Callable,
+    Iterable,
     Sequence,
 )
 
@@ -87,6 +89,32 @@ class Result(yamlrepr_hl, schemattrdict):
         else:
             return "OK: %s" % (" ".join(map(str, self.actions)))
 
+    @property
+    def details(self) -> dict[str, Any]:
+        """
+        The result as plain values, for organize's typed DBus API: the names
+        of the event, actions and triggers, and the operation and path of
+        each write.
+
+        >>> r = Result(event=('USER_EDIT', 'SET', ['prefs', 'x'], 1),
+        ...            actions=[('EDIT', 'SET', ['prefs', 'x'], 1)],
+        ...            writes=[('SET', ['prefs', 'x'], 1)])
+        >>> r.details['ok'], r.details['event'], r.details['writes']
+        (True, 'USER_EDIT', ['SET prefs.x'])
+        """
+        return dict(
+            ok=self.ok,
+            error=None if self.ok else str(self.error),
+            summary=self.summary,
+            event=self.event[0] if self.event else None,
+            actions=[action[0] for action in self.actions],
+            writes=[
+                "%s %s" % (write[0], ".".join(map(str, write[1])))
+                for write in self.writes
+            ],
+            triggers=[trigger[0] for trigger in self.triggers],
+        )
+
     def add_triggers(self, **kw: Any) -> None:
         for name, args in kw.items():
             self.triggers.append((name, args))
@@ -156,6 +184,8 @@ class Engine(schemattrdict, yamlfile):
         self.info_log: Callable[..., None] = lambda *a: None
         self.debug_log: Callable[..., None] = lambda *a: None
         self.trigger_target: Optional[Sys] = None
+        # incremented each time an event changes the state
+        self.generation: int = 0
         super(Engine, self).__init__(*a, **kw)
 
     def record(self, result: ResultType) -> None:
@@ -195,6 +225,9 @@ class Engine(schemattrdict, yamlfile):
                     # apply new state, cheating the ro_dict
                     dict.update(self, new_state)  # type: ignore
                     self._as_dict = None  # part of careful ro_dict cheating
+                    self.generation += 1
+                    # the lock is still held here, so save should be cheap
+                    # (eg, a Persister's submit method)
                     self.save()
             except Exception as ex:
                 error = [ex, traceback.format_exc()]
@@ -321,6 +354,222 @@ class Engine(schemattrdict, yamlfile):
             raise ValueError("Can't remove type: %r" % type(target[key]))
 
 
+class Persister(object):
+    """
+    Write-behind persistence for engine states.
+
+    Committed states are handed to submit(), which only stores a reference to
+    the snapshot and returns, so that an engine's save callback does not have
+    to do any I/O while the engine's lock is held. A writer thread calls the
+    write function with the latest snapshot; snapshots which are superseded
+    before the writer gets to them are never written.
+
+    A snapshot is written no later than max_staleness seconds after it was
+    submitted (plus the duration of any write which is already in progress).
+    Waiting up to that long allows bursts of events to be coalesced into a
+    single write.
+
+    flush() blocks until the latest submitted snapshot has been written, and
+    stop() flushes and then stops the writer thread. If the writer thread is
+    not running, snapshots are written by the thread calling flush() or
+    stop().
+
+    >>> written = []
+    >>> p = Persister(written.append, max_staleness=60)
+    >>> p.submit({'a': 1})
+    >>> p.submit({'a': 2})
+    >>> p.flush()
+    True
+    >>> written, p.submitted, p.written
+    ([{'a': 2}], 2, 1)
+    """
+
+    def __init__(
+        self,
+        write: Callable[[Any], None],
+        max_staleness: float = 1.0,
+        error_log: Callable[..., None] = lambda *a: None,
+    ) -> None:
+        self.write = write
+        self.max_staleness = max_staleness
+        self.error_log = error_log
+        self.submitted = 0
+        self.written = 0
+        self._cond = Condition()
+        self._pending: Optional[Any] = None
+        self._pending_since = 0.0
+        self._flushing = 0
+        self._writing = False
+        self._stopped = False
+        self._thread = Thread(target=self._run, name="persister", daemon=True)
+
+    def start(self) -> Persister:
+        self._thread.start()
+        return self
+
+    def submit(self, snapshot: Any) -> None:
+        """
+        Schedule a snapshot to be written, replacing any pending snapshot.
+        """
+        with self._cond:
+            if self._pending is None:
+                self._pending_since = time.monotonic()
+            self._pending = snapshot
+            self.submitted += 1
+            self._cond.notify_all()
+
+    def _write_pending(self) -> None:
+        """
+        Write the pending snapshot. Must be called with the condition held;
+        the condition is released while writing.
+        """
+        snapshot, self._pending = self._pending, None
+        self._writing = True
+        self._cond.release()
+        try:
+            self.write(snapshot)
+        except Exception as ex:
+            self.error_log("Error writing state: %r", ex)
+        finally:
+            self._cond.acquire()
+            self._writing = False
+            self.written += 1
+            self._cond.notify_all()
+
+    def _run(self) -> None:
+        with self._cond:
+            while True:
+                while self._pending is None and not self._stopped:
+                    self._cond.wait()
+                if self._pending is None:
+                    return
+                deadline = self._pending_since + self.max_staleness
+                while not (self._flushing or self._stopped):
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                self._write_pending()
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """
+        Wait until the latest submitted snapshot has been written. Returns
+        False if the timeout expired first.
+        """
+        with self._cond:
+            if not self._thread.is_alive():
+                self._cond.wait_for(lambda: not self._writing, timeout)
+                if self._pending is not None and not self._writing:
+                    self._write_pending()
+                return self._pending is None and not self._writing
+            self._flushing += 1
+            self._cond.notify_all()
+            try:
+                return self._cond.wait_for(
+                    lambda: self._pending is None and not self._writing,
+                    timeout,
+                )
+            finally:
+                self._flushing -= 1
+
+    def stop(self) -> None:
+        """
+        Write the latest snapshot, if any, and stop the writer thread.
+        """
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+        if self._thread.is_alive():
+            self._thread.join()
+        self.flush()
+
+
+class TimerWheel(object):
+    """
+    A hashed timer wheel, for scheduling a large number of deadlines at a
+    coarse granularity.
+
+    Keys are scheduled at an absolute deadline (in seconds) and are hashed
+    into one of a fixed number of slots by the tick their deadline falls in.
+    advance() only visits the slots of the ticks which have passed since the
+    previous call, so its cost is independent of the total number of
+    scheduled keys (except after a gap of more than a full revolution, when
+    all slots are visited once). Scheduling or cancelling a key is O(1).
+
+    The wheel does not read the clock; the current time is always passed in.
+
+    >>> w = TimerWheel(tick=10, slots=8)
+    >>> w.advance(100)
+    []
+    >>> w.schedule('a', 125)
+    >>> w.schedule('b', 1000)
+    >>> w.schedule('c', 90)
+    >>> len(w)
+    3
+    >>> w.advance(110)
+    ['c']
+    >>> w.advance(130)
+    ['a']
+    >>> w.schedule('b', 131)
+    >>> w.cancel('b')
+    >>> w.advance(2000)
+    []
+    """
+
+    def __init__(self, tick: int, slots: int) -> None:
+        self.tick = tick
+        self._slots: list[dict[Any, int]] = [{} for _ in range(slots)]
+        self._where: dict[Any, int] = {}
+        self._last: Optional[int] = None
+
+    def __len__(self) -> int:
+        return len(self._where)
+
+    def __contains__(self, key: Any) -> bool:
+        return key in self._where
+
+    def schedule(self, key: Any, deadline: int) -> None:
+        """
+        Schedule key at deadline, replacing any existing deadline for it.
+        Deadlines which have already passed are due at the next advance().
+        """
+        self.cancel(key)
+        if self._last is not None:
+            deadline_tick = max(deadline, self._last) // self.tick
+        else:
+            deadline_tick = deadline // self.tick
+        idx = deadline_tick % len(self._slots)
+        self._slots[idx][key] = deadline
+        self._where[key] = idx
+
+    def cancel(self, key: Any) -> None:
+        idx = self._where.pop(key, None)
+        if idx is not None:
+            del self._slots[idx][key]
+
+    def advance(self, now: int) -> list[Any]:
+        """
+        Returns the keys whose deadline is at or before now, in order of
+        their deadlines, and removes them from the wheel.
+        """
+        nslots = len(self._slots)
+        if self._last is None or now - self._last >= self.tick * nslots:
+            idxs: Iterable[int] = range(nslots)
+        else:
+            idxs = (
+                t % nslots
+                for t in range(self._last // self.tick, now // self.tick + 1)
+            )
+        self._last = now
+        due: list[tuple[int, Any]] = []
+        for idx in idxs:
+            slot = self._slots[idx]
+            for key in [k for k, d in slot.items() if d <= now]:
+                due.append((slot.pop(key), key))
+                del self._where[key]
+        return [key for deadline, key in sorted(due, key=lambda e: e[0])]
+
+
 if __name__ == "__main__":
     import doctest
 
@@ -0,0 +1,125 @@
+"""
+Framing for the layer 2 alternate discovery protocol.
+
+publish_alt splits each encrypted descriptor into frames small enough to
+fit in the padding of an ARP packet, and discover_alt reassembles them.
+Each frame starts with a header of:
+
+- the frame's sequence number plus one (so that the first byte of a frame is
+  never zero, unlike the padding of ordinary ARP packets)
+- a message id, which is random for each message
+- the total length of the message
+
+so the receiver knows when it has a complete message, and can decrypt it
+exactly once.
+"""
+
+import random
+import struct
+from typing import Optional
+
+# assuming 60 byte packets, we have 18 bytes of padding to use
+FRAME_SIZE: int = 18
+
+_HEADER = struct.Struct("!BBH")
+
+MAX_FRAMES: int = 255
+
+
+def chunk_size(frame_size: int = FRAME_SIZE) -> int:
+    return frame_size - _HEADER.size
+
+
+def frame(
+    message: bytes,
+    frame_size: int = FRAME_SIZE,
+    message_id: Optional[int] = None,
+    pad: bool = False,
+) -> list[bytes]:
+    """
+    Split a message into frames of at most frame_size bytes. With pad, the
+    last frame is padded with zeros to frame_size bytes too, as the receiver
+    only accepts frames which fill the padding of an ARP packet (and not
+    every link pads short packets).
+
+    >>> frame(b"abcdefghijklmnopq", message_id=7)
+    [b'\\x01\\x07\\x00\\x11abcdefghijklmn', b'\\x02\\x07\\x00\\x11opq']
+    >>> [len(f) for f in frame(b"abcdefghijklmnopq", pad=True)]
+    [18, 18]
+    >>> frame(bytes(MAX_FRAMES * chunk_size() + 1))
+    Traceback (most recent call last):
+    ...
+    ValueError: message too long: 3571 bytes
+    """
+    size = chunk_size(frame_size)
+    count = -(-len(message) // size)
+    if count > MAX_FRAMES:
+        raise ValueError("message too long: %s bytes" % (len(message),))
+    if message_id is None:
+        message_id = random.getrandbits(8)
+    frames = [
+        _HEADER.pack(seq + 1, message_id, len(message))
+        + message[seq * size : (seq + 1) * size]
+        for seq in range(count)
+    ]
+    if pad and frames:
+        frames[-1] = frames[-1].ljust(frame_size, b"\x00")
+    return frames
+
+
+class Reassembler(object):
+    """
+    Reassembles the frames of one sender's messages, in any order, into a
+    preallocated buffer. Frames of a different message than the one being
+    reassembled start a new message.
+
+    >>> r = Reassembler()
+    >>> a = frame(b"abcdefghijklmnopqrstuvwxyz", message_id=1)
+    >>> b = frame(b"ABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789", message_id=2)
+    >>> [r.add(f) for f in (a[1], b[2], b[0], b[0])]
+    [None, None, None, None]
+    >>> r.add(b[1])
+    b'ABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789'
+    >>> r.add(a[0]), r.add(a[1])
+    (None, b'abcdefghijklmnopqrstuvwxyz')
+    >>> r.add(b"\\x09\\x01\\x00\\x1ajunk"), r.add(b"\\x01")
+    (None, None)
+    """
+
+    def __init__(self, frame_size: int = FRAME_SIZE) -> None:
+        self.chunk_size = chunk_size(frame_size)
+        self.key: Optional[tuple[int, int]] = None
+        self.buffer = bytearray()
+        self.received = bytearray()
+        self.missing = 0
+
+    def add(self, data: bytes) -> Optional[bytes]:
+        """
+        Add a frame. Returns the message once all of its frames are added.
+        """
+        if len(data) < _HEADER.size:
+            return None
+        seq, message_id, length = _HEADER.unpack_from(data)
+        seq -= 1
+        count = -(-length // self.chunk_size)
+        if not 0 <= seq < count:
+            return None
+        if (message_id, length) != self.key:
+            self.key = (message_id, length)
+            self.buffer = bytearray(length)
+            self.received = bytearray(count)
+            self.missing = count
+        if self.received[seq]:
+            return None
+        start = seq * self.chunk_size
+        end = min(start + self.chunk_size, length)
+        chunk = data[_HEADER.size : _HEADER.size + end - start]
+        if len(chunk) != end - start:
+            return None
+        self.buffer[start:end] = chunk
+        self.received[seq] = 1
+        self.missing -= 1
+        if self.missing:
+            return None
+        self.key = None
+        return bytes(self.buffer)
@@ -1,9 +1,9 @@
+import time
+from datetime import timedelta
 from typing import List, TypedDict, Literal, cast, Optional, Any
 
 import pydbus
-import yaml
 
-from vula.common import escape_ansi
 from vula.constants import _ORGANIZE_DBUS_NAME, _ORGANIZE_DBUS_PATH
 from vula.organize import Organize
 
@@ -57,83 +57,52 @@ PrefsTypeKeys = Literal[
 ]
 
 
+def _ago(timestamp: Optional[int]) -> str:
+    if not timestamp:
+        return "none"
+    return str(timedelta(seconds=int(time.time() - timestamp))) + " ago"
+
+
+def _peer(details: dict[str, Any]) -> PeerType:
+    """
+    Convert a peer's details from organize's typed DBus API to the strings
+    the peers view displays.
+    """
+    return PeerType(
+        name=details["name"],
+        id=details["id"],
+        other_names=", ".join(details.get("other_names", [])),
+        status=" ".join(
+            filter(
+                None,
+                [
+                    ("disabled", "enabled")[details["enabled"]],
+                    ("unpinned", "pinned")[details["pinned"]],
+                    ("unverified", "verified")[details["verified"]],
+                    ("", "gateway")[details["use_as_gateway"]],
+                ],
+            )
+        ),
+        endpoint=details.get("endpoint", ""),
+        allowed_ips=", ".join(details.get("allowed_ips", [])),
+        latest_signature=_ago(details.get("latest_signature")),
+        latest_handshake=_ago(details.get("latest_handshake")),
+        wg_pubkey=details["wg_pubkey"],
+    )
+
+
 class DataProvider:
     def get_peers(self) -> List[PeerType]:
         organize = pydbus.SystemBus().get(
             _ORGANIZE_DBUS_NAME, _ORGANIZE_DBUS_PATH
         )
-
-        # Get all peer ids from the dbus
-        ids = organize.peer_ids("enabled")
-
-        peers: List[PeerType] = []
-
-        # Loop over all ids in the list
-        for id in ids:
-            # Create empty dict for peer
-            peer_dict: dict[str, Optional[str]] = {
-                "name": None,
-                "id": None,
-                "other_names": None,
-                "status": None,
-                "endpoint": None,
-                "allowed_ips": None,
-                "latest_signature": None,
-                "latest_handshake": None,
-                "wg_pubkey": None,
-            }
-
-            # Fill in the data
-            peer_raw = organize.show_peer(id)
-            peer_clear = escape_ansi(peer_raw)
-            peer_lines = peer_clear.split("\n")
-
-            peer_dict["name"] = peer_lines[0].lstrip().split(": ")[1]
-            peer_dict["id"] = peer_lines[1].lstrip().split(": ")[1]
-            if "other names" in peer_lines[2]:
-                peer_dict["other_names"] = (
-                    peer_lines[2].lstrip().split(": ")[1]
-                )
-                peer_dict["status"] = peer_lines[3].lstrip().split(": ")[1]
-                peer_dict["endpoint"] = peer_lines[4].lstrip().split(": ")[1]
-                peer_dict["allowed_ips"] = (
-                    peer_lines[5].lstrip().split(": ")[1]
-                )
-                peer_dict["latest_signature"] = (
-                    peer_lines[6].lstrip().split(": ")[1]
-                )
-                peer_dict["latest_handshake"] = (
-                    peer_lines[7].lstrip().split(": ")[1]
-                )
-                peer_dict["wg_pubkey"] = peer_lines[8].lstrip().split(": ")[1]
-            else:
-                peer_dict["status"] = peer_lines[2].lstrip().split(": ")[1]
-                peer_dict["endpoint"] = peer_lines[3].lstrip().split(": ")[1]
-                peer_dict["allowed_ips"] = (
-                    peer_lines[4].lstrip().split(": ")[1]
-                )
-                peer_dict["latest_signature"] = (
-                    peer_lines[5].lstrip().split(": ")[1]
-                )
-                peer_dict["latest_handshake"] = (
-                    peer_lines[6].lstrip().split(": ")[1]
-                )
-                peer_dict["wg_pubkey"] = peer_lines[7].lstrip().split(": ")[1]
-
-            peers.append(cast(PeerType, peer_dict))
-
-        return peers
+        return [_peer(details) for details in organize.get_peers("enabled")]
 
     def get_prefs(self) -> PrefsType:
         organize = pydbus.SystemBus().get(
             _ORGANIZE_DBUS_NAME, _ORGANIZE_DBUS_PATH
         )
-
-        # Get the data from the organize dbus
-        data = organize.show_prefs()
-        items: PrefsType = yaml.safe_load(data)
-
-        return items
+        return cast(PrefsType, organize.read_prefs())
 
     def get_status(self) -> Optional[StatusType]:
         # Fetch the data from the systemd dbus
@@ -168,40 +137,40 @@ class DataProvider:
         organize: Organize = pydbus.SystemBus().get(
             _ORGANIZE_DBUS_NAME, _ORGANIZE_DBUS_PATH
         )
-        organize.remove_peer(peer_vk)
+        organize.delete_peer(peer_vk)
 
     def rename_peer(self, peer_vk: str, name: str) -> None:
         organize: Organize = pydbus.SystemBus().get(
             _ORGANIZE_DBUS_NAME, _ORGANIZE_DBUS_PATH
         )
-        organize.set_peer(peer_vk, ["petname"], name)
+        organize.edit_peer(peer_vk, ["petname"], name)
 
     def pin_and_verify(self, peer_vk: str, peer_name: str) -> None:
         organize: Organize = pydbus.SystemBus().get(
             _ORGANIZE_DBUS_NAME, _ORGANIZE_DBUS_PATH
         )
-        organize.verify_and_pin_peer(peer_vk, peer_name)
+        organize.pin_and_verify_peer(peer_vk, peer_name)
 
     def add_peer(self, peer_vk: str, ip: str) -> None:
         organize: Organize = pydbus.SystemBus().get(
             _ORGANIZE_DBUS_NAME, _ORGANIZE_DBUS_PATH
         )
-        organize.peer_addr_add(peer_vk, ip)
+        organize.add_peer_addr(peer_vk, ip)
 
-    def set_pref(self, pref: str, value: Any) -> str:
+    def _edit_pref(self, operation: str, pref: str, value: Any) -> str:
         organize: Organize = pydbus.SystemBus().get(
             _ORGANIZE_DBUS_NAME, _ORGANIZE_DBUS_PATH
         )
-        return organize.set_pref(pref, value)
+        result = organize.edit_pref(operation, pref, str(value))
+        if not result["ok"]:
+            return "error: %s" % (result["error"],)
+        return result["summary"]
+
+    def set_pref(self, pref: str, value: Any) -> str:
+        return self._edit_pref('SET', pref, value)
 
     def add_pref(self, pref: str, value: Any) -> str:
-        organize: Organize = pydbus.SystemBus().get(
-            _ORGANIZE_DBUS_NAME, _ORGANIZE_DBUS_PATH
-        )
-        return organize.add_pref(pref, value)
+        return self._edit_pref('ADD', pref, value)
 
     def remove_pref(self, pref: str, value: Any) -> str:
-        organize: Organize = pydbus.SystemBus().get(
-            _ORGANIZE_DBUS_NAME, _ORGANIZE_DBUS_PATH
-        )
-        return organize.remove_pref(pref, value)
+        return self._edit_pref('REMOVE', pref, value)
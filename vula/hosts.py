@@ -0,0 +1,190 @@
+"""
+*vula* hosts database functions.
+
+Organize writes the names and IPs of its enabled peers to a flat hosts file
+(_ORGANIZE_HOSTS_FILE) which is consulted by the NSS module. Optionally (when
+the hosts_cdb pref is enabled) it also writes the same entries to an indexed
+constant database (_ORGANIZE_HOSTS_CDB_FILE) in D. J. Bernstein's cdb format,
+so that a lookup costs two hash table probes instead of a parse of the whole
+file, no matter how many peers there are.
+
+The cdb format is simple enough that we implement it here instead of adding a
+dependency. Keys are lowercased hostnames, and each record's value is one IP
+address.
+"""
+
+from __future__ import annotations
+
+import os
+import struct
+from typing import Iterable, Optional
+
+import click
+
+from .constants import _ORGANIZE_HOSTS_CDB_FILE, _ORGANIZE_HOSTS_FILE
+from .notclick import DualUse
+
+_CDB_HEADER_LEN = 2048
+
+
+def cdb_hash(key: bytes) -> int:
+    """
+    The cdb hash function.
+
+    >>> cdb_hash(b'')
+    5381
+    >>> cdb_hash(b'vula.local.')
+    62278758
+    """
+    h = 5381
+    for c in key:
+        h = (((h << 5) + h) ^ c) & 0xFFFFFFFF
+    return h
+
+
+def cdb_dumps(records: Iterable[tuple[bytes, bytes]]) -> bytes:
+    """
+    Returns a cdb containing the given (key, value) records. Keys may occur
+    more than once.
+
+    >>> db = cdb_dumps([(b'a', b'1'), (b'b', b'2'), (b'a', b'3')])
+    >>> len(db)
+    2126
+    >>> Cdb(db).get_all(b'a')
+    [b'1', b'3']
+    """
+    body = bytearray()
+    tables: list[list[tuple[int, int]]] = [[] for _ in range(256)]
+    for key, value in records:
+        h = cdb_hash(key)
+        tables[h & 0xFF].append((h, _CDB_HEADER_LEN + len(body)))
+        body += struct.pack('<II', len(key), len(value)) + key + value
+    header = bytearray()
+    pos = _CDB_HEADER_LEN + len(body)
+    for entries in tables:
+        slots = [(0, 0)] * (len(entries) * 2)
+        for h, rec_pos in entries:
+            i = (h >> 8) % len(slots)
+            while slots[i][1]:
+                i = (i + 1) % len(slots)
+            slots[i] = (h, rec_pos)
+        header += struct.pack('<II', pos, len(slots))
+        for slot in slots:
+            body += struct.pack('<II', *slot)
+        pos += len(slots) * 8
+    return bytes(header + body)
+
+
+class Cdb(object):
+    """
+    A reader for cdb data.
+
+    >>> db = Cdb(cdb_dumps([(b'alice.local.', b'fdff::1')]))
+    >>> db.get(b'alice.local.')
+    b'fdff::1'
+    >>> db.get(b'bob.local.') is None
+    True
+    """
+
+    def __init__(self, data: bytes) -> None:
+        if len(data) < _CDB_HEADER_LEN:
+            raise ValueError("cdb data is too short: %s bytes" % (len(data),))
+        self.data = data
+
+    @classmethod
+    def from_file(cls, path: str) -> Cdb:
+        with open(path, 'rb') as fh:
+            return cls(fh.read())
+
+    def _u32_pair(self, pos: int) -> tuple[int, int]:
+        return struct.unpack_from('<II', self.data, pos)
+
+    def get_all(self, key: bytes) -> list[bytes]:
+        """
+        Returns all values stored for key, in insertion order.
+        """
+        res = []
+        h = cdb_hash(key)
+        table_pos, nslots = self._u32_pair((h & 0xFF) * 8)
+        if not nslots:
+            return res
+        slot = (h >> 8) % nslots
+        for _ in range(nslots):
+            slot_hash, rec_pos = self._u32_pair(table_pos + slot * 8)
+            if not rec_pos:
+                break
+            if slot_hash == h:
+                klen, vlen = self._u32_pair(rec_pos)
+                start = rec_pos + 8
+                if self.data[start : start + klen] == key:
+                    res.append(self.data[start + klen : start + klen + vlen])
+            slot = (slot + 1) % nslots
+        return res
+
+    def get(self, key: bytes) -> Optional[bytes]:
+        res = self.get_all(key)
+        return res[0] if res else None
+
+
+def hosts_cdb(entries: Iterable[tuple[str, str]]) -> bytes:
+    """
+    Returns the cdb for a list of (ip, hostname) hosts file entries.
+
+    >>> Cdb(hosts_cdb([('fdff::1', 'Alice.local.')])).get(b'alice.local.')
+    b'fdff::1'
+    """
+    return cdb_dumps(
+        (host.lower().encode(), ip.encode()) for ip, host in entries
+    )
+
+
+def lookup(
+    name: str,
+    hosts_file: str = _ORGANIZE_HOSTS_FILE,
+    cdb_file: str = _ORGANIZE_HOSTS_CDB_FILE,
+) -> list[str]:
+    """
+    Returns the IPs for a name from organize's hosts database. The indexed
+    cdb file is used if it exists, otherwise the flat hosts file is parsed.
+
+    >>> lookup('alice.local.', '/nonexistent', '/nonexistent')
+    []
+    """
+    if os.path.exists(cdb_file):
+        return [
+            ip.decode()
+            for ip in Cdb.from_file(cdb_file).get_all(name.lower().encode())
+        ]
+    try:
+        with open(hosts_file, encoding='utf-8') as fh:
+            return [
+                fields[0]
+                for fields in map(str.split, fh)
+                if len(fields) > 1 and fields[1].lower() == name.lower()
+            ]
+    except FileNotFoundError:
+        return []
+
+
+@DualUse.object(short_help="Query organize's hosts database")
+class HostsCommands(object):
+    """
+    Commands to query the hosts database written by organize.
+    """
+
+    cli: click.Group
+
+    @DualUse.method()
+    @click.option(
+        '--hosts-file', default=_ORGANIZE_HOSTS_FILE, show_default=True
+    )
+    @click.option('--cdb-file', default=_ORGANIZE_HOSTS_CDB_FILE)
+    @click.argument('name', type=str)
+    def lookup(self, name: str, hosts_file: str, cdb_file: str) -> str:
+        """
+        Print the IPs for a name, as the NSS module would resolve it.
+        """
+        return "\n".join(lookup(name, hosts_file, cdb_file))
+
+
+main = HostsCommands.cli
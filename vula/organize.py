@@ -8,10 +8,17 @@ modifying routing information. It does not need network access.
 
 from __future__ import annotations
 
+import hashlib
+import json
+import multiprocessing
 import os
 import pdb
+import random
+import signal
 import time
-from functools import lru_cache
+from collections import OrderedDict
+from concurrent.futures import Future, ProcessPoolExecutor, as_completed
+from functools import lru_cache, partial
 from ipaddress import (
     ip_address,
     ip_network,
@@ -23,12 +30,15 @@ from ipaddress import (
 from logging import Logger, getLogger
 from pathlib import Path
 from platform import node
+from threading import Lock
 from typing import Any, Self, Optional, Never, cast, Sequence, Callable
 
 import click
 import pydbus
 from click import Context
 from gi.repository import GLib
+from nacl.secret import SecretBox
+from pydbus.generic import signal as dbus_signal
 from pydbus.method_call_context import MethodCallContext
 from schema import And
 from schema import Optional as Optional_
@@ -36,6 +46,7 @@ from schema import Schema, Use
 
 from .common import (
     IPs,
+    RateLimiter,
     addrs_in_subnets,
     attrdict,
     b64_bytes,
@@ -44,6 +55,8 @@ from .common import (
     raw,
     schemattrdict,
     sort_LL_first,
+    variant_dict,
+    yamlfile,
     yamlrepr,
     yamlrepr_hl,
 )
@@ -51,15 +64,26 @@ from .configure import Configure
 from .constants import (
     _DEFAULT_INTERFACE,
     _DEFAULT_TABLE,
+    _DESCRIPTOR_RATE_BURST,
+    _DESCRIPTOR_RATE_LIMIT,
+    _DESCRIPTOR_REFRESH_AGE,
+    _DESCRIPTOR_REFRESH_CHECK_INTERVAL,
+    _DESCRIPTOR_REFRESH_JITTER,
+    _DESCRIPTOR_VALIDITY_PERIOD,
+    _DISCOVER_ALT_DBUS_NAME,
     _DISCOVER_DBUS_NAME,
     _DISCOVER_DBUS_PATH,
     _DOMAIN,
+    _EXPIRY_WHEEL_SLOTS,
+    _EXPIRY_WHEEL_TICK,
     _FWMARK,
     _IP_RULE_PRIORITY,
     _ORGANIZE_CONF_FILE,
     _ORGANIZE_DBUS_NAME,
+    _ORGANIZE_HOSTS_CDB_FILE,
     _ORGANIZE_HOSTS_FILE,
     _ORGANIZE_KEYS_CONF_FILE,
+    _ORGANIZE_PSK_CACHE_FILE,
     _PUBLISH_DBUS_NAME,
     _PUBLISH_DBUS_PATH,
     _WG_PORT,
@@ -69,14 +93,22 @@ from .constants import (
     _IPv6_ULA,
     _LRU_CACHE_MAX_SIZE,
 )
-from .csidh import ctidh, ctidh_parameters, hkdf
+from .csidh import (
+    ctidh,
+    ctidh_dh_raw,
+    ctidh_parameters,
+    hkdf,
+    psk_cache_key,
+)
 from .discover import Discover
-from .engine import Engine, Result
+from .engine import Engine, Persister, Result, TimerWheel
+from .hosts import hosts_cdb
 from .notclick import DualUse
-from .peer import Descriptor, PeerCommands, Peers, Peer
+from .peer import Descriptor, DescriptorVerifier, PeerCommands, Peers, Peer
 from .prefs import Prefs, PrefsCommands
 from .publish import Publish
 from .sys_routes import Sys
+from .unicast import UnicastRefresh
 
 
 class SystemState(schemattrdict):
@@ -177,6 +209,11 @@ class OrganizeState(Engine, yamlrepr_hl):
         prefs=Prefs.default, system_state={}, peers={}, event_log=[]
     )
 
+    def __init__(self, *a: Any, **kw: Any) -> None:
+        # called with the ids of peers whose expiry time may have changed
+        self.schedule_expiry: Callable[[list[str]], None] = lambda *a: None
+        super(OrganizeState, self).__init__(*a, **kw)
+
     def _check_freshness(self, descriptor: Descriptor) -> bool:
         # FIXME: check dt and vf here
         return True
@@ -184,6 +221,52 @@ class OrganizeState(Engine, yamlrepr_hl):
     def record(self, res: Result) -> None:
         if self.prefs.record_events:
             self.event_log.append(raw(res))
+        if res.ok and res.writes:
+            self.schedule_expiry(self._expiry_changed(res))
+
+    def _expiry_changed(self, res: Result) -> list[str]:
+        """
+        Returns the ids of the peers whose expiry time might have been changed
+        by the writes of a result.
+        """
+        ids: dict[str, None] = {}
+        for _, path, value in res.writes:
+            if type(path) is str:
+                path = path.split('.')
+            if path[0] == 'prefs' and 'expire_time' in (path[1:] or value):
+                return list(self.peers)
+            elif path[0] == 'peers' and len(path) > 1:
+                ids[path[1]] = None
+        return list(ids)
+
+    def peer_expiry(self, peer: Peer) -> Optional[int]:
+        """
+        Returns the time at which a peer expires, or None if it doesn't.
+
+        Unpinned peers expire expire_time seconds after the end of the
+        validity period (vf plus dt) of their latest descriptor. Pinned peers
+        never expire, and a negative expire_time disables expiry.
+        """
+        if peer.pinned or self.prefs.expire_time < 0:
+            return None
+        return int(
+            peer.descriptor.vf + peer.descriptor.dt + self.prefs.expire_time
+        )
+
+    @Engine.event
+    def event_EXPIRE_PEERS(self, now: int, vks: Sequence[str]) -> None:
+        """
+        Removes those of the given peers which have expired at the time now.
+        The time is an argument of the event, rather than read from the
+        clock, so that replaying the event produces the same result.
+        """
+        for vk in vks:
+            peer = self.peers.get(vk)
+            if peer is None:
+                continue
+            expiry = self.peer_expiry(peer)
+            if expiry is not None and expiry <= now:
+                self.action_EXPIRE_PEER(peer, expiry)
 
     @Engine.event
     def event_VERIFY_AND_PIN_PEER(self, vk: str, hostname: str) -> None:
@@ -315,13 +398,47 @@ class OrganizeState(Engine, yamlrepr_hl):
                     # multiple default routes, but only one can get
                     # allowedips=/0 so we just take the first one.)
                     break
-        for peer in self.peers.values():
+        affected = self._peers_affected_by(new_system_state)
+        self.info_log(
+            "re-evaluating %i of %i peers for new system state",
+            len(affected),
+            len(self.peers),
+        )
+        for peer in affected:
             self._update_peer(peer, system_state=new_system_state)
         self._SET('system_state', new_system_state)
 
         # TODO:
         # remove endpoints from pinned peers that became non-local
 
+    def _peers_affected_by(self, new_system_state: SystemState) -> list[Peer]:
+        """
+        Returns the peers which need to be re-evaluated for a new system
+        state: those which have an address in a subnet which appeared or
+        disappeared, or which have an address which became or stopped being
+        a gateway. The evaluation of other peers' addresses can't change, so
+        they are left alone (and don't produce any writes or triggers).
+        """
+        old_system_state = self.system_state
+        changed_subnets = set(old_system_state.current_subnets_no_ULA) ^ set(
+            new_system_state.current_subnets_no_ULA
+        )
+        changed_gateways = set(old_system_state.gateways) ^ set(
+            new_system_state.gateways
+        )
+        affected = []
+        for peer in self.peers.values():
+            addrs = (
+                set(peer.descriptor.all_addrs)
+                | set(peer.IPv4addrs)
+                | set(peer.IPv6addrs)
+            )
+            if addrs & changed_gateways or any(
+                addr in subnet for addr in addrs for subnet in changed_subnets
+            ):
+                affected.append(peer)
+        return affected
+
     @Engine.event
     def event_INCOMING_DESCRIPTOR(self, descriptor: Descriptor) -> Any:
         """
@@ -468,6 +585,28 @@ class OrganizeState(Engine, yamlrepr_hl):
         assert self.result is not None
         self.result.add_triggers(sync_peer=(peer.id,))
 
+    @Engine.event
+    def event_PSK_READY(self, c: str) -> None:
+        """
+        The CTIDH PSK for the CTIDH public key c has been derived. PSKs are
+        secret, so they are kept outside of the engine state (by Organize);
+        this event just resyncs the peers using this key, which were
+        configured without an endpoint while the PSK was being derived.
+        """
+        for peer in self.peers.limit(enabled=True).values():
+            if str(peer.descriptor.c) == c:
+                self.action_SYNC_PEER(peer)
+
+    @Engine.action
+    def action_SYNC_PEER(self, peer: Peer) -> None:
+        assert self.result is not None
+        self.result.add_triggers(sync_peer=(peer.id,))
+
+    @Engine.action
+    def action_EXPIRE_PEER(self, peer: Peer, expiry: int) -> None:
+        self.info_log(f"Expiring {peer.name_and_id!r} (expired at {expiry})")
+        self.action_REMOVE_PEER(peer)
+
     @Engine.action
     def action_REMOVE_PEER(self, peer: Peer) -> None:
         self._REMOVE('peers', peer.id)
@@ -499,6 +638,17 @@ class OrganizeState(Engine, yamlrepr_hl):
         pass  # the decorator actually does the logging
 
 
+class OrganizeSignals(object):
+    """
+    DBus signals emitted by organize. pydbus keeps the subscribers of a
+    signal in a dict keyed by the object it is bound to, and Organize (being
+    an attrdict) isn't hashable, so Organize binds these to an instance of
+    this class instead.
+    """
+
+    DescriptorsChanged = dbus_signal()
+
+
 @DualUse.object(
     short_help="Maintain routes and wg peer configurations",
     invoke_without_command=True,
@@ -525,6 +675,12 @@ class OrganizeState(Engine, yamlrepr_hl):
     show_default=True,
     help="YAML state file",
 )
+@click.option(
+    "--psk-cache-file",
+    default=_ORGANIZE_PSK_CACHE_FILE,
+    show_default=True,
+    help="Encrypted cache file for CTIDH PSKs",
+)
 @click.option(
     "-k",
     "--keys-file",
@@ -577,6 +733,12 @@ class Organize(attrdict):
           <arg type='s' name='response' direction='out'/>
           <arg type='b' name='interactive' direction='in'/>
         </method>
+        <method name='ctidh_stats'>
+          <arg type='s' name='response' direction='out'/>
+        </method>
+        <method name='descriptor_stats'>
+          <arg type='s' name='response' direction='out'/>
+        </method>
         <method name='test_auth'>
             <arg type='b' name='interactive' direction='in'/>
             <arg type='s' name='response' direction='out'/>
@@ -621,6 +783,9 @@ class Organize(attrdict):
         <method name='our_latest_descriptors'>
           <arg type='s' name='descriptors' direction='out'/>
         </method>
+        <signal name='DescriptorsChanged'>
+          <arg type='s' name='descriptors'/>
+        </signal>
         <method name='get_vk_by_name'>
           <arg type='s' name='hostname' direction='in'/>
           <arg type='s' name='response' direction='out'/>
@@ -663,6 +828,60 @@ class Organize(attrdict):
           <arg type='s' name='response' direction='out'/>
         </method>
       </interface>
+      <interface name='local.vula.organize2.Peers'>
+        <method name='get_peer'>
+          <arg type='s' name='query' direction='in'/>
+          <arg type='a{sv}' name='peer' direction='out'/>
+        </method>
+        <method name='get_peers'>
+          <arg type='s' name='which' direction='in'/>
+          <arg type='aa{sv}' name='peers' direction='out'/>
+        </method>
+        <method name='get_our_descriptors'>
+          <arg type='a{ss}' name='descriptors' direction='out'/>
+        </method>
+        <method name='edit_peer'>
+          <arg type='s' name='vk' direction='in'/>
+          <arg type='as' name='path' direction='in'/>
+          <arg type='s' name='value' direction='in'/>
+          <arg type='a{sv}' name='result' direction='out'/>
+        </method>
+        <method name='delete_peer'>
+          <arg type='s' name='query' direction='in'/>
+          <arg type='a{sv}' name='result' direction='out'/>
+        </method>
+        <method name='add_peer_addr'>
+          <arg type='s' name='vk' direction='in'/>
+          <arg type='s' name='ip' direction='in'/>
+          <arg type='a{sv}' name='result' direction='out'/>
+        </method>
+        <method name='del_peer_addr'>
+          <arg type='s' name='vk' direction='in'/>
+          <arg type='s' name='ip' direction='in'/>
+          <arg type='a{sv}' name='result' direction='out'/>
+        </method>
+        <method name='pin_and_verify_peer'>
+          <arg type='s' name='vk' direction='in'/>
+          <arg type='s' name='hostname' direction='in'/>
+          <arg type='a{sv}' name='result' direction='out'/>
+        </method>
+      </interface>
+      <interface name='local.vula.organize2.Prefs'>
+        <method name='read_prefs'>
+          <arg type='a{sv}' name='prefs' direction='out'/>
+        </method>
+        <method name='edit_pref'>
+          <arg type='s' name='operation' direction='in'/>
+          <arg type='s' name='pref' direction='in'/>
+          <arg type='s' name='value' direction='in'/>
+          <arg type='a{sv}' name='result' direction='out'/>
+        </method>
+      </interface>
+      <interface name='local.vula.organize2.Debug'>
+        <method name='get_stats'>
+          <arg type='a{sv}' name='stats' direction='out'/>
+        </method>
+      </interface>
     </node>
     '''
 
@@ -681,6 +900,45 @@ class Organize(attrdict):
         self._state.info_log = self.log.info
         self._state.debug_log = self.log.debug
         self._current_descriptors: dict[str, str] = {}
+        # emitted with a JSON object of our descriptor for each interface
+        self.DescriptorsChanged = OrganizeSignals().DescriptorsChanged
+        # interface -> (unsigned content, signed descriptor, refresh time)
+        self._published_descriptors: dict[
+            str, tuple[dict[str, Any], Descriptor, int]
+        ] = {}
+        self._hosts_hash: Optional[str] = None
+        self._persister: Optional[Persister] = None
+        self._psk_pool: Optional[ProcessPoolExecutor] = None
+        self._psk_lock = Lock()
+        self._psks: OrderedDict[bytes, str] = OrderedDict()
+        self._psk_pending: set[bytes] = set()
+        self._psk_persister: Optional[Persister] = None
+        self._psk_warmup: dict[str, Any] = {}
+        self._verifier: Optional[DescriptorVerifier] = None
+        self._unicast: Optional[UnicastRefresh] = None
+        # unique DBus names of discover and discover_alt
+        self._discover_senders: set[str] = set()
+        # digests of recently processed descriptors, mapped to the state
+        # generation they were processed at (or None if their signature is
+        # invalid, which doesn't depend on the state)
+        self._seen_descriptors: OrderedDict[bytes, Optional[int]] = (
+            OrderedDict()
+        )
+        self._seen_lock = Lock()
+        self._seen_hits = 0
+        self._seen_misses = 0
+        # admission control for descriptors, per DBus sender and per vk
+        self._source_limiter = RateLimiter(
+            _DESCRIPTOR_RATE_LIMIT, _DESCRIPTOR_RATE_BURST
+        )
+        self._vk_limiter = RateLimiter(
+            _DESCRIPTOR_RATE_LIMIT, _DESCRIPTOR_RATE_BURST
+        )
+        self._expiry_lock = Lock()
+        self._expiry_wheel = TimerWheel(
+            tick=_EXPIRY_WHEEL_TICK, slots=_EXPIRY_WHEEL_SLOTS
+        )
+        self._state.schedule_expiry = self._schedule_expiry
 
         if ctx.invoked_subcommand is None:
             self.run(monolithic=False)
@@ -708,6 +966,176 @@ class Organize(attrdict):
         psk = hkdf(raw_key)
         return psk
 
+    def ctidh_psk(self, pk: bytes) -> Optional[str]:
+        """
+        Non-blocking variant of ctidh_dh. Returns the PSK for a CTIDH public
+        key if it has already been derived. Otherwise, its derivation is
+        started in the PSK process pool, None is returned, and a PSK_READY
+        event is fired once the PSK is available.
+
+        When the process pool isn't running (ie, when organize isn't running
+        as a daemon), this is the same as ctidh_dh.
+        """
+        if self._psk_pool is None:
+            return self.ctidh_dh(pk)
+        pk = bytes(pk)
+        with self._psk_lock:
+            if pk in self._psks:
+                self._psks.move_to_end(pk)
+                return self._psks[pk]
+            if pk not in self._psk_pending:
+                self.log.debug(f"Deriving CTIDH PSK for pk {pk!r}")
+                self._psk_pending.add(pk)
+                future = self._psk_pool.submit(
+                    ctidh_dh_raw, bytes(self._keys.pq_ctidhP512_sec_key), pk
+                )
+                future.add_done_callback(partial(self._psk_done, pk))
+        return None
+
+    def _psk_done(self, pk: bytes, future: Future[bytes]) -> None:
+        """
+        Called from an executor thread when a PSK worker has finished.
+        """
+        try:
+            # XXX see comment about hybrid construction in ctidh_dh
+            psk = hkdf(future.result())
+        except Exception as ex:
+            self.log.error("Deriving CTIDH PSK for %r failed: %r", pk, ex)
+            with self._psk_lock:
+                self._psk_pending.discard(pk)
+            return
+        self._add_psk(pk, psk)
+        GLib.idle_add(self._psk_ready, pk)
+
+    def _add_psk(self, pk: bytes, psk: str) -> None:
+        with self._psk_lock:
+            self._psks[pk] = psk
+            self._psk_pending.discard(pk)
+            while len(self._psks) > _LRU_CACHE_MAX_SIZE:
+                self._psks.popitem(last=False)
+            if self._psk_persister is not None:
+                self._psk_persister.submit(dict(self._psks))
+
+    def _warm_up_psks(self) -> None:
+        """
+        Derive the CTIDH PSKs of all enabled peers which aren't cached yet,
+        in parallel in the PSK process pool, so that the first sync doesn't
+        need to wait for them one at a time.
+        """
+        assert self._psk_pool is not None
+        start = time.monotonic()
+        pks = {
+            bytes(peer.descriptor.c)
+            for peer in self.peers.limit(enabled=True).values()
+        }
+        with self._psk_lock:
+            todo = [pk for pk in pks if pk not in self._psks]
+        self.log.info(
+            "CTIDH warm-up: %i of %i PSKs cached, deriving %i",
+            len(pks) - len(todo),
+            len(pks),
+            len(todo),
+        )
+        sk = bytes(self._keys.pq_ctidhP512_sec_key)
+        futures = {
+            self._psk_pool.submit(ctidh_dh_raw, sk, pk): pk for pk in todo
+        }
+        derived = 0
+        for done, future in enumerate(as_completed(futures), 1):
+            try:
+                self._add_psk(futures[future], hkdf(future.result()))
+                derived += 1
+            except Exception as ex:
+                self.log.error(
+                    "Deriving CTIDH PSK for %r failed: %r", futures[future], ex
+                )
+            if done == len(todo) or done % max(1, len(todo) // 10) == 0:
+                self.log.info(
+                    "CTIDH warm-up: %i/%i PSKs derived (%.1fs)",
+                    done,
+                    len(todo),
+                    time.monotonic() - start,
+                )
+        self._psk_warmup = dict(
+            peers=len(pks),
+            cached=len(pks) - len(todo),
+            derived=derived,
+            seconds=round(time.monotonic() - start, 3),
+        )
+        self.log.info(
+            "CTIDH warm-up finished: derived %i PSKs in %.2fs",
+            derived,
+            self._psk_warmup['seconds'],
+        )
+
+    def ctidh_stats(self) -> str:
+        """
+        Returns JSON with the startup CTIDH warm-up statistics, and the number
+        of cached and pending PSKs.
+        """
+        return json.dumps(self._ctidh_stats())
+
+    def _ctidh_stats(self) -> dict[str, Any]:
+        with self._psk_lock:
+            return dict(
+                warmup=self._psk_warmup,
+                cached_psks=len(self._psks),
+                pending_psks=len(self._psk_pending),
+            )
+
+    def _psk_cache_box(self) -> SecretBox:
+        return SecretBox(psk_cache_key(bytes(self._keys.pq_ctidhP512_sec_key)))
+
+    def _load_psk_cache(self) -> None:
+        """
+        Load the CTIDH PSKs derived by a previous organize process, so that
+        they don't need to be derived again. The cache is discarded if it was
+        written for a different CTIDH key (or can't be decrypted).
+        """
+        try:
+            with open(self.psk_cache_file, 'rb') as fh:
+                data = fh.read()
+        except FileNotFoundError:
+            return
+        try:
+            cache = json.loads(self._psk_cache_box().decrypt(data))
+            if cache['ctidh_pk'] != str(self._keys.pq_ctidhP512_pub_key):
+                raise ValueError("cache is for a different CTIDH key")
+            psks = {
+                bytes(b64_bytes.with_len(64).validate(pk)): psk
+                for pk, psk in cache['psks'].items()
+            }
+        except Exception as ex:
+            self.log.info("Discarding CTIDH PSK cache: %r", ex)
+            return
+        with self._psk_lock:
+            self._psks.update(psks)
+        self.log.info("Loaded %i CTIDH PSKs from cache", len(psks))
+
+    def _write_psk_cache(self, psks: dict[bytes, str]) -> None:
+        """
+        Write the CTIDH PSK cache, encrypted with a key derived from our
+        CTIDH secret key. This is called by the PSK cache persister thread.
+        """
+        data = json.dumps(
+            dict(
+                ctidh_pk=str(self._keys.pq_ctidhP512_pub_key),
+                psks={str(b64_bytes(pk)): psk for pk, psk in psks.items()},
+            )
+        )
+        Path(self.psk_cache_file).touch(mode=0o600)
+        with click.open_file(
+            self.psk_cache_file, mode='wb', atomic=True
+        ) as fh:
+            fh.write(self._psk_cache_box().encrypt(data.encode()))
+        chown_like_dir_if_root(self.psk_cache_file)
+        self.log.debug("CTIDH PSK cache updated: %i PSKs", len(psks))
+
+    def _psk_ready(self, pk: bytes) -> bool:
+        self.log.info(f"CTIDH PSK for pk {pk!r} is ready")
+        self.state.event_PSK_READY(str(b64_bytes(pk)))
+        return False
+
     @property
     def v6_enabled(self) -> bool:
         """
@@ -737,35 +1165,43 @@ class Organize(attrdict):
         """
         return node() + _DOMAIN
 
+    def _service_descriptor_fields(
+        self, ip_addrs: list[IPv4Address | IPv6Address]
+    ) -> dict[str, Any]:
+        """
+        Returns the content of our descriptor for some IPs, without the vf
+        field and unsigned.
+        """
+        # XXX add Curve448 pk for hybrid DH
+        addrs = sort_LL_first(ip_addrs)
+        return {
+            "p": self.prefs.primary_ip,
+            "pk": self._keys.wg_Curve25519_pub_key,
+            "c": self._keys.pq_ctidhP512_pub_key,
+            "v4a": (
+                ','.join(str(a) for a in addrs if a.version == 4)
+                if self.v4_enabled
+                else ()
+            ),
+            "v6a": (
+                ','.join(str(a) for a in addrs if a.version == 6)
+                if self.v6_enabled
+                else ()
+            ),
+            "vk": self._keys.vk_Ed25519_pub_key,
+            "dt": str(_DESCRIPTOR_VALIDITY_PERIOD),
+            "port": str(self.port),
+            "hostname": self.hostname,
+            "r": '',
+            "e": False,
+        }
+
     def _construct_service_descriptor(
         self, ip_addrs: list[IPv4Address | IPv6Address], vf: int
     ) -> Descriptor:
         self.log.info("Constructing service descriptor id: %s", vf)
-        # XXX add Curve448 pk for hybrid DH
-        addrs = sort_LL_first(ip_addrs)
         return Descriptor(
-            {
-                "p": self.prefs.primary_ip,
-                "pk": self._keys.wg_Curve25519_pub_key,
-                "c": self._keys.pq_ctidhP512_pub_key,
-                "v4a": (
-                    ','.join(str(a) for a in addrs if a.version == 4)
-                    if self.v4_enabled
-                    else ()
-                ),
-                "v6a": (
-                    ','.join(str(a) for a in addrs if a.version == 6)
-                    if self.v6_enabled
-                    else ()
-                ),
-                "vk": self._keys.vk_Ed25519_pub_key,
-                "vf": vf,
-                "dt": "86400",
-                "port": str(self.port),
-                "hostname": self.hostname,
-                "r": '',
-                "e": False,
-            }
+            dict(self._service_descriptor_fields(ip_addrs), vf=vf)
         ).sign(self._keys.vk_Ed25519_sec_key)
 
     @DualUse.method()
@@ -835,54 +1271,125 @@ class Organize(attrdict):
     def prefs(self) -> Prefs:
         return cast(Prefs, self.state.prefs)
 
-    @DualUse.method()
-    def _write_hosts_file(self) -> bool:
+    def _hosts_file_entries(
+        self, state: dict[str, Any]
+    ) -> list[tuple[str, str]]:
         """
-        Write the hosts file
+        Returns the (ip, hostname) entries of the hosts file for a state, in
+        order.
         """
-        hosts_file: str = _ORGANIZE_HOSTS_FILE
+        peers: Peers = state['peers']
+        prefs: Prefs = state['prefs']
         hosts = {
             name: peer.primary_ip
-            for peer in self.peers.limit(enabled=True).values()
+            for peer in peers.limit(enabled=True).values()
             for name in peer.enabled_names
         }
         hosts_v4 = {
             name: ips[0]
-            for peer in self.peers.limit(enabled=True).values()
+            for peer in peers.limit(enabled=True).values()
             for name in peer.enabled_names
             if (ips := [a for a in peer.enabled_ips if a.version == 4])
         }
+        entries = [(str(prefs.primary_ip), self.hostname)]
+        if v4s := IPs(state['system_state'].current_ips).v4s:
+            entries.append((str(v4s[0]), self.hostname))
+        entries += [(str(ip), host) for host, ip in hosts.items()]
+        entries += [
+            (str(ip), host)
+            for host, ip in hosts_v4.items()
+            if hosts[host] != ip
+        ]
+        return entries
+
+    @DualUse.method()
+    def _write_hosts_file(
+        self, state: Optional[dict[str, Any]] = None
+    ) -> bool:
+        """
+        Write the hosts file (and the indexed hosts cdb, if the hosts_cdb pref
+        is enabled), if the name to IP mapping has changed since the last
+        write. Returns True if the files were written.
+        """
+        if state is None:
+            state = self.state
+        prefs: Prefs = state['prefs']
+        hosts_file: str = _ORGANIZE_HOSTS_FILE
+        cdb_file: str = _ORGANIZE_HOSTS_CDB_FILE
+        entries = self._hosts_file_entries(state)
+        content = "".join("%s %s\n" % entry for entry in entries)
+        digest = hashlib.sha256(
+            content.encode() + bytes([bool(prefs.hosts_cdb)])
+        ).hexdigest()
+        if self._hosts_hash is None and os.path.exists(hosts_file):
+            # after a restart, the files written by the previous organize
+            # process might already be current (unless it crashed while
+            # writing them, so the cdb is compared too)
+            with open(hosts_file, encoding='utf-8') as fh:
+                current = fh.read() == content
+            if prefs.hosts_cdb:
+                current = current and os.path.exists(cdb_file)
+                if current:
+                    with open(cdb_file, 'rb') as cdb_fh:
+                        current = cdb_fh.read() == hosts_cdb(entries)
+            else:
+                current = current and not os.path.exists(cdb_file)
+            if current:
+                self._hosts_hash = digest
+        if digest == self._hosts_hash:
+            self.log.debug("hosts file is unchanged")
+            return False
         Path(hosts_file).touch(mode=0o644)
         with click.open_file(
             hosts_file, mode='w', encoding='utf-8', atomic=True
         ) as fh:
-            fh.write(f"{self.prefs.primary_ip} {self.hostname}\n")
-            if v4s := IPs(self.state.system_state.current_ips).v4s:
-                fh.write(f"{v4s[0]} {self.hostname}\n")
-            fh.write(
-                "\n".join("%s %s" % (ip, host) for host, ip in hosts.items())
-                + "\n"
-            )
-            fh.write(
-                "\n".join(
-                    "%s %s" % (ip, host)
-                    for host, ip in hosts_v4.items()
-                    if hosts[host] != ip
-                )
-                + "\n"
-            )
+            fh.write(content)
         chown_like_dir_if_root(hosts_file)
+        if prefs.hosts_cdb:
+            Path(cdb_file).touch(mode=0o644)
+            with click.open_file(cdb_file, mode='wb', atomic=True) as fh:
+                fh.write(hosts_cdb(entries))
+            chown_like_dir_if_root(cdb_file)
+        elif os.path.exists(cdb_file):
+            # a stale index would shadow the hosts file for resolvers
+            os.unlink(cdb_file)
+        self._hosts_hash = digest
+        self.log.info("hosts file updated: %i entries", len(entries))
         return True
 
+    def _write_state(self, state: dict[str, Any]) -> None:
+        """
+        Write a snapshot of the state to the state file, and update the hosts
+        file. While the main loop is running, this is called by the persister
+        thread.
+        """
+        yamlfile(state).write_yaml_file(
+            self.state_file, mode=0o600, autochown=True
+        )
+        self.log.info("vula state file updated: %i peers", len(state['peers']))
+        self._write_hosts_file(state)
+
+    def _save_behind(self) -> None:
+        """
+        Engine save callback used while the persister is running. This is
+        called with the engine lock held, so it only hands a snapshot of the
+        committed state to the persister.
+        """
+        assert self._persister is not None
+        self._persister.max_staleness = self.prefs.max_state_staleness
+        self._persister.submit(dict(self._state))
+
     @DualUse.method()
     def save(self) -> None:
         """
         Save state to disk. (Should be no-op if run from the commandline in a
         new organize instance.)
         """
-        self.state.write_yaml_file(self.state_file, mode=0o600, autochown=True)
-        self.log.info("vula state file updated: %i peers", len(self.peers))
-        self._write_hosts_file()
+        if self._persister is not None:
+            self._persister.submit(dict(self._state))
+            self._persister.flush()
+        else:
+            self._write_state(dict(self._state))
 
     @DualUse.method()
     def verify_and_pin_peer(self, vk: str, hostname: str) -> str:
@@ -908,13 +1415,10 @@ class Organize(attrdict):
         res: list[str] = []
         res += self.sys.sync_interfaces(dryrun=dryrun)
         res += self.sys.sync_iprules(dryrun=dryrun)
-        for peer in self.peers.values():
-            self.log.debug("syncing peer %s", peer.name_and_id)
-            try:
-                peer_res = self.sys.sync_peer(peer.id, dryrun)
-            except Exception as ex:
-                peer_res = repr(ex)
-            res.append(peer_res)
+        try:
+            res += self.sys.sync_peers(dryrun=dryrun)
+        except Exception as ex:
+            res.append(repr(ex))
         res += self.sys.remove_unknown(dryrun=dryrun)
         res = list(filter(None, res))
         if res and not firstrun:
@@ -930,10 +1434,39 @@ class Organize(attrdict):
         #            )
         return res
 
+    def _schedule_expiry(self, vks: list[str]) -> None:
+        """
+        (Re)schedule the expiry of the given peers in the expiry timer wheel.
+        """
+        with self._expiry_lock:
+            for vk in vks:
+                peer = self.peers.get(vk)
+                expiry = self.state.peer_expiry(peer) if peer else None
+                if expiry is None:
+                    self._expiry_wheel.cancel(vk)
+                else:
+                    self._expiry_wheel.schedule(vk, expiry)
+
+    def _expire_peers(self) -> bool:
+        """
+        Called periodically from the main loop. Fires an EXPIRE_PEERS event
+        for the peers whose expiry time has passed, if there are any.
+        """
+        now = int(time.time())
+        with self._expiry_lock:
+            due = self._expiry_wheel.advance(now)
+        if due:
+            res = self.state.event_EXPIRE_PEERS(now, due)
+            if res.error:
+                self.log.error("Error expiring peers: %r", res.error)
+            # peers which weren't expired need to be rescheduled
+            self._schedule_expiry([vk for vk in due if vk in self.peers])
+        return True
+
     @DualUse.method()
     def rediscover(self) -> str:
-        self.discover.listen([], self.our_wg_pk)
-        self._instruct_zeroconf()
+        self.discover.refresh()
+        self._instruct_zeroconf(force=True)
         return ",".join(map(str, self.state.system_state.current_ips))
 
     @DualUse.method()
@@ -971,11 +1504,33 @@ class Organize(attrdict):
             system_bus = pydbus.SystemBus()
             system_bus.publish(_ORGANIZE_DBUS_NAME, self)
             main_loop = GLib.MainLoop()
+            # from here on, state is written by the persister thread instead
+            # of while the engine lock is held
+            self._persister = Persister(
+                self._write_state,
+                max_staleness=self.prefs.max_state_staleness,
+                error_log=self.log.error,
+            ).start()
+            self._state.save = self._save_behind
+            # derive CTIDH PSKs in worker processes, instead of blocking
+            # while syncing peers, and remember them across restarts
+            self._psk_pool = ProcessPoolExecutor(
+                mp_context=multiprocessing.get_context('spawn')
+            )
+            self._psk_persister = Persister(
+                self._write_psk_cache,
+                max_staleness=self.prefs.max_state_staleness,
+                error_log=self.log.error,
+            ).start()
+            self._load_psk_cache()
+            self._warm_up_psks()
+            # verify incoming descriptors' signatures on worker threads
+            self._verifier = DescriptorVerifier(self._descriptor_verified)
 
         if monolithic or no_dbus:
-            self.discover = Discover()
+            self.discover = Discover(large_segment=self.prefs.large_segment)
             self.discover.callbacks.append(self.process_descriptor)
-            self.publish = Publish()
+            self.publish = Publish(large_segment=self.prefs.large_segment)
         else:
             self.discover = system_bus.get(
                 _DISCOVER_DBUS_NAME, _DISCOVER_DBUS_PATH
@@ -1035,12 +1590,98 @@ class Organize(attrdict):
         self.sync()
 
         if not no_dbus:
+            self._schedule_expiry(list(self.peers))
+            GLib.timeout_add_seconds(_EXPIRY_WHEEL_TICK, self._expire_peers)
+            GLib.timeout_add_seconds(
+                _DESCRIPTOR_REFRESH_CHECK_INTERVAL, self._refresh_descriptors
+            )
+            if self.prefs.unicast_refresh:
+                self._start_unicast_refresh()
+            GLib.unix_signal_add(
+                GLib.PRIORITY_DEFAULT, signal.SIGTERM, main_loop.quit
+            )
             self.log.info("calling GLib.MainLoop().run()")
-            main_loop.run()  # type: ignore[no-untyped-call]
+            try:
+                main_loop.run()  # type: ignore[no-untyped-call]
+            finally:
+                self.log.info("Flushing state before exit")
+                self._persister.stop()
+                self._psk_pool.shutdown(wait=False, cancel_futures=True)
+                self._psk_persister.stop()
+                self._verifier.shutdown(wait=False)
+                if self._unicast is not None:
+                    self._unicast.close()
+
+    def _start_unicast_refresh(self) -> None:
+        """
+        Listen for descriptors sent directly by pinned peers, on our primary
+        IP (which is only reachable over the WireGuard tunnel).
+        """
+        unicast = UnicastRefresh(self._unicast_descriptor_received)
+        try:
+            unicast.listen(str(self.prefs.primary_ip))
+        except OSError as ex:
+            self.log.info("Couldn't start unicast descriptor refresh: %r", ex)
+            return
+        self._unicast = unicast
+
+    def _unicast_descriptor_received(
+        self, descriptor_string: str, source: str
+    ) -> None:
+        """
+        Process a descriptor sent to us directly, if it is from a pinned
+        peer's primary IP (which WireGuard ensures only that peer can send
+        from).
+        """
+        descriptor = Descriptor.parse(descriptor_string)
+        peer = self.peers.get(descriptor.id)
+        if peer is None or not peer.pinned or str(peer.primary_ip) != source:
+            self.log.info(
+                "Ignored unicast descriptor from %s: not a pinned peer's "
+                "primary IP",
+                source,
+            )
+            return
+        self.log.debug("Received unicast descriptor from %s", peer.name)
+        self.process_descriptor(descriptor)
+
+    def _send_unicast_refresh(self, descriptors: list[str]) -> None:
+        """
+        Send our descriptors to our pinned peers over the WireGuard tunnel, so
+        that they learn about our new addresses without waiting for mDNS.
+        """
+        if self._unicast is None:
+            return
+        ips = [
+            str(peer.primary_ip)
+            for peer in self.peers.limit(pinned=True, enabled=True).values()
+        ]
+        if ips:
+            count = self._unicast.send(descriptors, ips)
+            self.log.info(
+                "Sent %d descriptors to %d pinned peers", count, len(ips)
+            )
+
+    def _refresh_descriptors(self) -> bool:
+        """
+        Re-sign and publish our descriptors before they expire. Called
+        periodically from the main loop.
+        """
+        self._instruct_zeroconf()
+        return True
 
-    def _instruct_zeroconf(self) -> None:
+    def _instruct_zeroconf(self, force: bool = False) -> None:
+        """
+        Instruct discover and publish to use our current interfaces and IPs.
+
+        Our descriptor for an interface is only re-signed (with a new vf)
+        when its content changes or it is older than _DESCRIPTOR_REFRESH_AGE
+        (less a random jitter of up to _DESCRIPTOR_REFRESH_JITTER), and
+        publish is only instructed when some descriptor changed (or if force
+        is True). Discover is instructed every time.
+        """
         descriptors: dict[str, str] = {}
-        vf: int = int(time.time())
+        now: int = int(time.time())
         ips_to_publish = []
         discover_ips = []
         for iface, ips in self.state.system_state.current_interfaces.items():
@@ -1051,9 +1692,24 @@ class Organize(attrdict):
                 and not any(ip in net for net in self.prefs.subnets_forbidden)
             ]
             ips_to_publish.extend(list(map(str, ips)))
-            descriptors[iface] = str(
-                self._construct_service_descriptor(ips, vf)
-            )
+            fields = self._service_descriptor_fields(ips)
+            previous = self._published_descriptors.get(iface)
+            if (
+                previous is not None
+                and previous[0] == fields
+                and now < previous[2]
+            ):
+                desc = previous[1]
+            else:
+                desc = self._construct_service_descriptor(ips, now)
+                self._published_descriptors[iface] = (
+                    fields,
+                    desc,
+                    now
+                    + _DESCRIPTOR_REFRESH_AGE
+                    - random.randint(0, _DESCRIPTOR_REFRESH_JITTER),
+                )
+            descriptors[iface] = str(desc)
 
             # python-zeroconf wants IPs instead of interfaces for its
             # "interfaces" argument, so we give it one IP per interface.
@@ -1065,6 +1721,18 @@ class Organize(attrdict):
             if v6s := ips.v6s:
                 discover_ips.append(str(sort_LL_first(v6s)[0]))
 
+        for iface in list(self._published_descriptors):
+            if iface not in descriptors:
+                del self._published_descriptors[iface]
+
+        # discover is always instructed, so that it learns our IPs if it was
+        # restarted (which it ignores if they haven't changed)
+        self.discover.listen(discover_ips, self.our_wg_pk)
+
+        if descriptors == self._current_descriptors and not force:
+            self.log.debug("Descriptors unchanged, not publishing them again")
+            return
+
         ips_to_publish = sorted(i for i in map(str, ips_to_publish))
         self.log.info(
             "discovering on {ips} and publishing {pub}".format(
@@ -1078,9 +1746,10 @@ class Organize(attrdict):
                 ),
             )
         )
-        self.discover.listen(discover_ips, self.our_wg_pk)
         self.publish.listen(descriptors)
+        self._send_unicast_refresh(list(descriptors.values()))
         self._current_descriptors = descriptors
+        self.DescriptorsChanged(json.dumps(descriptors))
         self.log.info("Current IP(s): {}".format(ips_to_publish))
         self.log.debug(
             "Current descriptors: {}".format(self._current_descriptors)
@@ -1107,8 +1776,20 @@ class Organize(attrdict):
         return str(peer.descriptor) if peer else ''
 
     def process_descriptor_string(
-        self: Organize, descriptor_string: str
-    ) -> Optional[str]:
+        self: Organize,
+        descriptor_string: str,
+        dbus_context: Optional[MethodCallContext] = None,
+    ) -> str:
+        """
+        Parse and process a descriptor, and return the result.
+
+        Descriptors from discover and discover_alt are queued for
+        verification (see process_descriptor), but those from any other DBus
+        caller (such as "vula peer import" and "vula verify") are verified
+        immediately, so that the caller gets the result of processing them.
+        """
+        if self._seen_descriptor(descriptor_string):
+            return self._unprocessed_descriptor("duplicate descriptor")
         self.log.debug("about to parse descriptor: %r", descriptor_string)
         try:
             descriptor = Descriptor.parse(descriptor_string)
@@ -1117,28 +1798,215 @@ class Organize(attrdict):
                 "organize failed to parse descriptor because %r (descriptor "
                 "was %r)" % (ex, descriptor_string)
             )
-            return None
+            return self._unprocessed_descriptor(
+                "failed to parse descriptor: %r" % (ex,), error=True
+            )
 
         if descriptor is None:
             self.log.info(
                 "organize failed to parse descriptor (descriptor was %r)"
                 % (descriptor,)
             )
-            return None
+            return self._unprocessed_descriptor(
+                "failed to parse descriptor", error=True
+            )
 
-        return self.process_descriptor(descriptor)
+        if dbus_context is None or self._from_discover(dbus_context):
+            # discover has already rate-limited these by their source address
+            return self._verify_and_process_descriptor(descriptor)
+        return self._verify_and_process_descriptor(
+            descriptor, queue=False, source=dbus_context.sender
+        )
+
+    def process_descriptor(self: Organize, descriptor: Descriptor) -> str:
+        """
+        Verify a descriptor's signature and, if it is valid, process it.
+
+        While the verifier pool is running, the descriptor is only queued for
+        verification (and a result saying so is returned); valid descriptors
+        are then processed in the main loop once they have been verified.
+
+        Exact duplicates of recently processed descriptors are skipped, as
+        long as the state hasn't changed since they were processed.
+        """
+        if self._seen_descriptor(str(descriptor)):
+            return self._unprocessed_descriptor("duplicate descriptor")
+        return self._verify_and_process_descriptor(descriptor)
+
+    def _verify_and_process_descriptor(
+        self: Organize,
+        descriptor: Descriptor,
+        queue: bool = True,
+        source: Optional[str] = None,
+    ) -> str:
+        if not self._admit_descriptor(descriptor, source):
+            return self._unprocessed_descriptor("rate limited")
+        if queue and self._verifier is not None:
+            if not self._verifier.submit(descriptor):
+                self.log.info(
+                    "Dropped descriptor because the verification queue is "
+                    "full: %r" % (descriptor,)
+                )
+                return self._unprocessed_descriptor(
+                    "verification queue is full"
+                )
+            return self._unprocessed_descriptor("queued for verification")
 
-    def process_descriptor(
-        self: Organize, descriptor: Descriptor
-    ) -> Optional[str]:
         if not descriptor.verify_signature():
             self.log.info(
                 "Discarded descriptor with invalid signature: %r"
                 % (descriptor,)
             )
-            return None
+            self._remember_descriptor(str(descriptor), None)
+            return self._unprocessed_descriptor(
+                "invalid signature", error=True
+            )
+        if not self._charge_vk(descriptor):
+            return self._unprocessed_descriptor("rate limited")
+
+        return self._process_verified_descriptor(descriptor)
+
+    @staticmethod
+    def _unprocessed_descriptor(reason: str, error: bool = False) -> str:
+        """
+        Returns the result for a descriptor which was not (or not yet)
+        processed by the event engine, in the same format as the results of
+        processed descriptors.
+        """
+        res: dict[str, Any] = dict(
+            event=['INCOMING_DESCRIPTOR'],
+            actions=[] if error else [['IGNORE', reason]],
+            writes=[],
+        )
+        if error:
+            res['error'] = reason
+        return str(yamlrepr(Result(res)))
+
+    def _from_discover(self, dbus_context: MethodCallContext) -> bool:
+        """
+        Returns True if a DBus method call is from discover or discover_alt.
+        """
+        sender = dbus_context.sender
+        if sender in self._discover_senders:
+            return True
+        for name in (_DISCOVER_DBUS_NAME, _DISCOVER_ALT_DBUS_NAME):
+            try:
+                owner = dbus_context.bus.dbus.GetNameOwner(name)
+            except GLib.Error:
+                continue
+            if owner == sender:
+                self._discover_senders.add(sender)
+                return True
+        return False
+
+    def _admit_descriptor(
+        self, descriptor: Descriptor, source: Optional[str] = None
+    ) -> bool:
+        """
+        Returns False if the descriptor's source (the DBus sender, for
+        descriptors not forwarded by discover) or its vk has exceeded its
+        rate limit, so that floods are dropped before signature verification.
+
+        The vk's bucket is only checked here, and is charged by _charge_vk
+        once the signature has been verified, so that forged descriptors
+        can't use up the rate of the vk they claim.
+        """
+        if source is not None and not self._source_limiter.allow([source]):
+            self.log.debug("Rate-limited descriptor from %r", source)
+            return False
+        if not self._vk_limiter.check([str(descriptor.vk)]):
+            self.log.debug("Rate-limited descriptor for vk %s", descriptor.vk)
+            return False
+        return True
+
+    def _charge_vk(self, descriptor: Descriptor) -> bool:
+        """
+        Takes a token from the bucket of a verified descriptor's vk, and
+        returns False if it has exceeded its rate limit.
+        """
+        if not self._vk_limiter.allow([str(descriptor.vk)]):
+            self.log.debug("Rate-limited descriptor for vk %s", descriptor.vk)
+            return False
+        return True
+
+    def _seen_descriptor(self, descriptor_string: str) -> bool:
+        """
+        Returns True if a descriptor string is identical to a recently
+        processed descriptor (and the state hasn't changed since then).
+        """
+        digest = hashlib.sha256(descriptor_string.encode()).digest()
+        with self._seen_lock:
+            if digest in self._seen_descriptors:
+                generation = self._seen_descriptors[digest]
+                if generation is None or generation == self.state.generation:
+                    self._seen_descriptors.move_to_end(digest)
+                    self._seen_hits += 1
+                    return True
+            self._seen_misses += 1
+        return False
+
+    def _remember_descriptor(
+        self, descriptor_string: str, generation: Optional[int]
+    ) -> None:
+        digest = hashlib.sha256(descriptor_string.encode()).digest()
+        with self._seen_lock:
+            self._seen_descriptors[digest] = generation
+            self._seen_descriptors.move_to_end(digest)
+            while len(self._seen_descriptors) > _LRU_CACHE_MAX_SIZE:
+                self._seen_descriptors.popitem(last=False)
+
+    def descriptor_stats(self) -> str:
+        """
+        Returns JSON with the duplicate descriptor cache's hit and miss
+        counts, and the numbers of descriptors dropped by rate limiting and by
+        the verifier.
+        """
+        return json.dumps(self._descriptor_stats())
+
+    def _descriptor_stats(self) -> dict[str, Any]:
+        with self._seen_lock:
+            return dict(
+                cache_size=len(self._seen_descriptors),
+                cache_hits=self._seen_hits,
+                cache_misses=self._seen_misses,
+                rate_limited_sources=self._source_limiter.dropped,
+                rate_limited_vks=self._vk_limiter.dropped,
+                verifier_dropped=(
+                    self._verifier.dropped if self._verifier else 0
+                ),
+            )
 
+    def _descriptor_verified(
+        self, descriptor: Descriptor, valid: bool
+    ) -> None:
+        """
+        Called by the verifier pool's worker threads.
+        """
+        if not valid:
+            self.log.info(
+                "Discarded descriptor with invalid signature: %r"
+                % (descriptor,)
+            )
+            self._remember_descriptor(str(descriptor), None)
+            return
+        if self._charge_vk(descriptor):
+            GLib.idle_add(self._process_verified_descriptor_idle, descriptor)
+
+    def _process_verified_descriptor_idle(
+        self, descriptor: Descriptor
+    ) -> bool:
+        self._process_verified_descriptor(descriptor)
+        return False
+
+    def _process_verified_descriptor(
+        self: Organize, descriptor: Descriptor
+    ) -> str:
+        # the generation is read before the event, so that if the event (or
+        # a concurrent one) changes the state, the next identical descriptor
+        # is processed again
+        generation = self.state.generation
         res = self.state.event_INCOMING_DESCRIPTOR(descriptor)
+        self._remember_descriptor(str(descriptor), generation)
         assert res is not None
 
         # if res.writes:
@@ -1220,6 +2088,84 @@ class Organize(attrdict):
             self.state.event_USER_EDIT('REMOVE', ['prefs', pref], value)
         )
 
+    # The local.vula.organize2 interfaces return native DBus types instead of
+    # strings formatted for humans, so that clients don't need to parse them.
+
+    def get_peer(self, query: str) -> dict[str, GLib.Variant]:
+        """
+        Returns the details of the peer matching a vk, hostname, or IP (or an
+        empty dict if none does).
+        """
+        peer = self.peers.query(query)
+        if not peer:
+            return {}
+        return variant_dict(
+            peer.details(self.sys.get_stats().get(str(peer.descriptor.pk)))
+        )
+
+    def get_peers(self, which: str) -> list[dict[str, GLib.Variant]]:
+        """
+        Returns the details of all, enabled, or disabled peers.
+        """
+        stats = self.sys.get_stats()
+        return [
+            variant_dict(
+                self.peers[vk].details(
+                    stats.get(str(self.peers[vk].descriptor.pk))
+                )
+            )
+            for vk in self.peer_ids(which)
+        ]
+
+    def get_our_descriptors(self) -> dict[str, str]:
+        return dict(self._current_descriptors)
+
+    def edit_peer(
+        self, vk: str, path: list[str], value: str
+    ) -> dict[str, GLib.Variant]:
+        result = self.state.event_USER_EDIT('SET', ['peers', vk] + path, value)
+        return variant_dict(result.details)
+
+    def delete_peer(self, query: str) -> dict[str, GLib.Variant]:
+        return variant_dict(self.state.event_USER_REMOVE_PEER(query).details)
+
+    def add_peer_addr(self, vk: str, ip: str) -> dict[str, GLib.Variant]:
+        result = self.state.event_USER_PEER_ADDR_ADD(vk, ip)
+        return variant_dict(result.details)
+
+    def del_peer_addr(self, vk: str, ip: str) -> dict[str, GLib.Variant]:
+        result = self.state.event_USER_PEER_ADDR_DEL(vk, ip)
+        return variant_dict(result.details)
+
+    def pin_and_verify_peer(
+        self, vk: str, hostname: str
+    ) -> dict[str, GLib.Variant]:
+        result = self.state.event_VERIFY_AND_PIN_PEER(vk, hostname)
+        return variant_dict(result.details)
+
+    def read_prefs(self) -> dict[str, GLib.Variant]:
+        return variant_dict(self.state.prefs._dict())
+
+    def edit_pref(
+        self, operation: str, pref: str, value: str
+    ) -> dict[str, GLib.Variant]:
+        """
+        SET a preference to a value, or ADD or REMOVE a value to or from a
+        list or dict preference.
+        """
+        if operation not in ('SET', 'ADD', 'REMOVE'):
+            raise ValueError("Unknown operation %r" % (operation,))
+        result = self.state.event_USER_EDIT(operation, ['prefs', pref], value)
+        return variant_dict(result.details)
+
+    def get_stats(self) -> dict[str, GLib.Variant]:
+        return variant_dict(
+            dict(
+                descriptors=self._descriptor_stats(),
+                ctidh=self._ctidh_stats(),
+            )
+        )
+
     @DualUse.method()
     def eventlog(self) -> str:
         return "\n".join(
@@ -3,7 +3,9 @@ from __future__ import annotations
 import json
 import time
 from base64 import b64encode
+from concurrent.futures import ThreadPoolExecutor
 from datetime import timedelta
+from functools import lru_cache
 from io import StringIO
 from ipaddress import (
     IPv4Address,
@@ -13,7 +15,9 @@ from ipaddress import (
     IPv4Network,
     IPv6Network,
 )
-from typing import List, Any, Optional, TextIO, cast
+from logging import getLogger
+from threading import Lock
+from typing import List, Any, Callable, Optional, TextIO, cast
 from typing_extensions import Self
 
 import click
@@ -22,7 +26,7 @@ from nacl.exceptions import BadSignatureError
 from nacl.signing import SigningKey, VerifyKey
 from schema import And, Optional as Optional_, Regex, Schema, Use
 
-from .constants import _VULA_ULA_SUBNET
+from .constants import _LRU_CACHE_MAX_SIZE, _VULA_ULA_SUBNET
 
 from .common import (
     Bug,
@@ -200,10 +204,25 @@ class Descriptor(schemattrdict, serializable):
             # log.info("Unable to parse descriptor: %s (%r)", error, descriptor)
         return descriptor
 
+    # descriptors are read-only, so this is built at most once per instance
+    _sig_buf: Optional[bytes] = None
+
     def _build_sig_buf(self: Descriptor) -> bytes:
-        return " ".join(
-            "%s=%s;" % (k, v) for k, v in sorted(self.items()) if k != 's'
-        ).encode()
+        """
+        Returns the bytes which the signature is over.
+
+        >>> from vula.constants import _TEST_DESC
+        >>> desc = Descriptor.parse(_TEST_DESC)
+        >>> desc._build_sig_buf() is desc._build_sig_buf()
+        True
+        >>> Descriptor(desc, port=1)._build_sig_buf() == desc._build_sig_buf()
+        False
+        """
+        if self._sig_buf is None:
+            self._sig_buf = " ".join(
+                "%s=%s;" % (k, v) for k, v in sorted(self.items()) if k != 's'
+            ).encode()
+        return self._sig_buf
 
     def __str__(self) -> str:
         return " ".join("%s=%s;" % kv for kv in sorted(self.items()))
@@ -290,7 +309,7 @@ class Descriptor(schemattrdict, serializable):
         sig = self.get('s')
         if not sig:
             return False
-        verify_public_key = VerifyKey(self.vk)
+        verify_public_key = _verify_key(bytes(self.vk))
         buf_to_verify: bytes = self._build_sig_buf()
         try:
             verify_public_key.verify(buf_to_verify, sig)
@@ -335,6 +354,80 @@ class Descriptor(schemattrdict, serializable):
         return sio.read()
 
 
+@lru_cache(maxsize=_LRU_CACHE_MAX_SIZE)
+def _verify_key(vk: bytes) -> VerifyKey:
+    return VerifyKey(vk)
+
+
+class DescriptorVerifier(object):
+    """
+    Verifies the signatures of descriptors on a pool of worker threads (the
+    verification itself doesn't hold the GIL), and calls callback with each
+    descriptor and whether its signature is valid.
+
+    Descriptors submitted while max_pending others are waiting to be verified
+    are dropped, so that a flood of descriptors can't grow the queue without
+    bound.
+
+    >>> from vula.constants import _TEST_DESC, _TEST_DESC_UNSIGNED
+    >>> results = []
+    >>> v = DescriptorVerifier(lambda d, ok: results.append((d.hostname, ok)))
+    >>> v.submit(Descriptor.parse(_TEST_DESC))
+    True
+    >>> v.submit(Descriptor.parse(_TEST_DESC_UNSIGNED))
+    True
+    >>> v.shutdown()
+    >>> for result in sorted(results):
+    ...     print(result)
+    ('vula-bookworm-test1.local.', False)
+    ('vula-bookworm-test2.local.', True)
+    """
+
+    def __init__(
+        self,
+        callback: Callable[[Descriptor, bool], None],
+        workers: Optional[int] = None,
+        max_pending: int = 1024,
+    ) -> None:
+        self.log = getLogger()
+        self.callback = callback
+        self.max_pending = max_pending
+        self.verified = 0
+        self.dropped = 0
+        self._pending = 0
+        self._lock = Lock()
+        self._pool = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="verify"
+        )
+
+    def submit(self, descriptor: Descriptor) -> bool:
+        """
+        Queue a descriptor for verification. Returns False if it was dropped.
+        """
+        with self._lock:
+            if self._pending >= self.max_pending:
+                self.dropped += 1
+                return False
+            self._pending += 1
+        self._pool.submit(self._verify, descriptor)
+        return True
+
+    def _verify(self, descriptor: Descriptor) -> None:
+        try:
+            valid = descriptor.verify_signature()
+        finally:
+            with self._lock:
+                self._pending -= 1
+                self.verified += 1
+        try:
+            self.callback(descriptor, valid)
+        except Exception as ex:
+            self.log.error("Error processing verified descriptor: %r", ex)
+
+    def shutdown(self, wait: bool = True) -> None:
+        self._pool.shutdown(wait=wait)
+
+
 class Peer(schemattrdict):
     schema = Schema(
         And(
@@ -495,7 +588,17 @@ class Peer(schemattrdict):
             self.descriptor.port,
         )
 
-    def wg_config(self: Peer, ctidh_psk: str) -> attrdict:
+    def wg_config(self: Peer, ctidh_psk: Optional[str]) -> attrdict:
+        """
+        Returns the wireguard config for the peer. If its CTIDH PSK hasn't
+        been derived yet (ctidh_psk is None), the config removes the
+        wireguard peer, clearing any endpoint, PSK and allowed IPs it was
+        configured with, so that packets routed to the peer are dropped
+        rather than sent without the PSK. (Setting empty allowed IPs would
+        not do, as pyroute2 can only add allowed IPs.)
+        """
+        if ctidh_psk is None:
+            return attrdict(public_key=str(self.descriptor.pk), remove=True)
         return attrdict(
             public_key=str(self.descriptor.pk),
             endpoint_addr=str(self.endpoint_addr),
@@ -504,6 +607,34 @@ class Peer(schemattrdict):
             preshared_key=ctidh_psk,
         )
 
+    def details(
+        self, stats: Optional[dict[str, Any]] = None
+    ) -> dict[str, Any]:
+        """
+        The information shown by *show*, as plain values for organize's
+        typed DBus API. Times are unix timestamps, and the handshake and
+        transfer fields are omitted if the WireGuard peer isn't configured.
+        """
+        return dict(
+            name=self.name,
+            id=self.id,
+            other_names=self.other_names,
+            enabled=bool(self.enabled),
+            pinned=bool(self.pinned),
+            verified=bool(self.verified),
+            use_as_gateway=bool(self.use_as_gateway),
+            configured=bool(stats),
+            endpoint=self.endpoint,
+            primary_ip=self.primary_ip,
+            allowed_ips=self._wg_allowed_ips,
+            disabled_ips=self.disabled_ips,
+            latest_signature=int(self.descriptor.vf),
+            latest_handshake=(stats or {}).get('latest_handshake') or None,
+            rx_bytes=(stats or {}).get('rx_bytes'),
+            tx_bytes=(stats or {}).get('tx_bytes'),
+            wg_pubkey=self.descriptor.pk,
+        )
+
     def show(self, stats: Optional[dict[str, Any]] = None) -> str:
         green_or_yellow = (
             green if self.pinned and self.verified and self.enabled else yellow
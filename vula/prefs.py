@@ -3,7 +3,6 @@ from __future__ import annotations
 from ipaddress import ip_network
 
 import click
-import yaml
 from schema import Schema, Use
 from ipaddress import ip_address
 
@@ -35,11 +34,15 @@ class Prefs(yamlrepr_hl, schemattrdict):
             'ephemeral_mode': Flexibool,
             'accept_default_route': Flexibool,
             'overwrite_unpinned': Flexibool,  # TODO
-            'expire_time': Use(int),  # TODO
+            'expire_time': Use(int),
             'primary_ip': Use(ip_address),  # TODO
             'record_events': Flexibool,
             'enable_ipv6': Flexibool,
             'enable_ipv4': Flexibool,
+            'hosts_cdb': Flexibool,
+            'max_state_staleness': Use(float),
+            'large_segment': Flexibool,
+            'unicast_refresh': Flexibool,
         }
     )
 
@@ -71,6 +74,10 @@ class Prefs(yamlrepr_hl, schemattrdict):
         primary_ip=0,
         enable_ipv6=True,
         enable_ipv4=True,
+        hosts_cdb=False,
+        max_state_staleness=1.0,
+        large_segment=False,
+        unicast_refresh=True,
     )
 
 
@@ -95,7 +102,7 @@ class PrefsCommands(object):
         """
         Show preferences.
         """
-        res = str(yamlrepr_hl(yaml.safe_load(self.organize.show_prefs())))
+        res = str(yamlrepr_hl(self.organize.read_prefs()))
         return res
 
     @DualUse.method()
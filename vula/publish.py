@@ -3,7 +3,7 @@
  informed by organize over DBus or as controlled by organize in monolith mode.
 
 >>> p = Publish()
->>> type(p.zeroconfs)
+>>> type(p.services)
 <class 'dict'>
 >>> type(p.log)
 <class 'logging.RootLogger'>
@@ -20,7 +20,13 @@ import pydbus
 from gi.repository import GLib
 from zeroconf import NonUniqueNameException, ServiceInfo, Zeroconf
 
-from .constants import _LABEL, _PUBLISH_DBUS_NAME, _VULA_ULA_SUBNET
+from .constants import (
+    _LABEL,
+    _LARGE_SEGMENT_HOST_TTL,
+    _LARGE_SEGMENT_TTL_FRACTION,
+    _PUBLISH_DBUS_NAME,
+    _VULA_ULA_SUBNET,
+)
 from .peer import Descriptor
 
 
@@ -35,72 +41,113 @@ class Publish(object):
     </node>
     '''
 
-    def __init__(self) -> None:
+    def __init__(self, large_segment: bool = False) -> None:
+        """
+        In large segment mode, our records have longer TTLs (tied to the
+        descriptor's dt), so that other hosts need to query for them less
+        often.
+        """
         self.log: Logger = getLogger()
+        self.large_segment = large_segment
+        # a responder for each interface, bound only to that interface's IPs
+        # so that each segment only learns its own addresses, along with the
+        # service it announces and the IPs it is bound to
         self.zeroconfs: dict[str, Zeroconf] = {}
+        self.services: dict[str, ServiceInfo] = {}
+        self.bound_ips: dict[str, set[str]] = {}
+
+    def _service_info(self, iface: str, desc_string: str) -> ServiceInfo:
+        desc = Descriptor.parse(desc_string)
+        listen_IPs: list[IPv4Address | IPv6Address] = [
+            a for a in desc.all_addrs if a not in _VULA_ULA_SUBNET
+        ]
+        ttls: dict[str, int] = {}
+        if self.large_segment:
+            ttls = dict(
+                host_ttl=_LARGE_SEGMENT_HOST_TTL,
+                other_ttl=int(desc.dt * _LARGE_SEGMENT_TTL_FRACTION),
+            )
+        return ServiceInfo(
+            _LABEL,
+            name=hostname() + "." + _LABEL,
+            addresses=[ip.packed for ip in listen_IPs],
+            port=desc.port,
+            properties=desc.as_zeroconf_properties,
+            server=desc.hostname,
+            **ttls,
+        )
+
+    def _remove(self, iface: str) -> None:
+        self.zeroconfs.pop(iface).close()
+        self.services.pop(iface, None)
+        del self.bound_ips[iface]
 
     def listen(self, new_announcements: dict[str, str]) -> None:
-        # First we remove all old zeroconf listeners that are not in our new
-        # instructions
-        for iface, zc in list(self.zeroconfs.items()):
+        # First we remove the responders of interfaces that are not in our
+        # new instructions
+        for iface in list(self.zeroconfs):
             if iface not in new_announcements:
                 self.log.info(
                     "Removing old service announcement for %r", iface
                 )
-                zc.close()
-                del self.zeroconfs[iface]
-        # Now we add a zeroconf listener for each new IP and ServiceInfo if it
-        # is not already existing, else we update the old zc object with the
-        # new desc
+                self._remove(iface)
+        # Now we update the records of existing responders in place if they
+        # changed, and start a responder for each new interface. Zeroconf
+        # can't bind to more IPs once started, so an interface's responder
+        # is only restarted when it needs to publish on an IP it isn't bound
+        # to; the other interfaces' responders are left alone.
         for iface, desc_string in new_announcements.items():
-            desc = Descriptor.parse(desc_string)
-            listen_IPs: list[IPv4Address | IPv6Address] = [
-                a for a in desc.all_addrs if a not in _VULA_ULA_SUBNET
-            ]
-            self.log.debug(
-                "Starting mDNS service announcement for %r with listen_IPs %r",
-                iface,
-                listen_IPs,
-            )
-            name: str = hostname() + "." + _LABEL
-            service_info: ServiceInfo = ServiceInfo(
-                _LABEL,
-                name=name,
-                addresses=[ip.packed for ip in listen_IPs],
-                port=desc.port,
-                properties=desc.as_zeroconf_properties,
-                server=desc.hostname,
-            )
+            info = self._service_info(iface, desc_string)
+            ips = set(info.parsed_addresses())
+            if iface in self.zeroconfs and not ips <= self.bound_ips[iface]:
+                self.log.info(
+                    "Restarting mDNS responder for %r on %r",
+                    iface,
+                    sorted(ips),
+                )
+                self._remove(iface)
             zeroconf = self.zeroconfs.get(iface)
-            if zeroconf:
-                # Do update dance
-                self.log.debug("Updating vula service: %s", service_info)
-                zeroconf.update_service(service_info)
-                self.log.debug("Updating vula service.")
-
-            else:
+            old = self.services.get(iface)
+            if zeroconf is None:
+                self.log.debug(
+                    "Starting mDNS service announcement for %r with "
+                    "listen_IPs %r",
+                    iface,
+                    sorted(ips),
+                )
                 zeroconf = self.zeroconfs[iface] = Zeroconf(
-                    # note that the "interfaces" argument to zeroconf is a list
-                    # of IPs
-                    interfaces=[str(ip) for ip in listen_IPs],
+                    # note that the "interfaces" argument to zeroconf is a
+                    # list of IPs
+                    interfaces=sorted(ips),
                 )
-                self.log.debug("Registering vula service: %s", service_info)
+                self.bound_ips[iface] = ips
+            if old is None:
+                self.log.debug("Registering vula service: %s", info)
                 try:
-                    zeroconf.register_service(service_info)
+                    zeroconf.register_service(info)
                     self.log.debug("Registered vula mDNS publishing service.")
                 except NonUniqueNameException:
                     self.log.debug(
                         "Unable to register vula mDNS publishing service."
                     )
+                    continue
+            elif (
+                old.properties != info.properties
+                or old.addresses != info.addresses
+                or old.server != info.server
+            ):
+                self.log.debug("Updating vula service: %s", info)
+                zeroconf.update_service(info)
+            self.services[iface] = info
 
     @classmethod
-    def daemon(cls) -> None:
+    def daemon(cls, large_segment: bool) -> None:
         """
         This method implements the non-monolithic daemon mode where we run
         publish in its own process (as we deploy on GNU/systemd).
         """
         loop = GLib.MainLoop()
-        publish = cls()
+        publish = cls(large_segment=large_segment)
         publish.log.debug("Debug level logging enabled")
         pydbus.SystemBus().publish(_PUBLISH_DBUS_NAME, publish)
         publish.log.debug("dbus enabled")
@@ -108,6 +155,11 @@ class Publish(object):
 
 
 @click.command(short_help="Layer 3 mDNS publish daemon")
+@click.option(
+    "--large-segment",
+    is_flag=True,
+    help="use longer record TTLs, for segments with many vula hosts",
+)
 def main(**kwargs: Any) -> None:
     Publish.daemon(**kwargs)
 
@@ -1,9 +1,10 @@
-import csv
 import fcntl
 import hashlib
+import heapq
+import itertools
 import json
-import math
 import random
+import selectors
 import socket
 import struct
 import threading
@@ -18,16 +19,106 @@ import nacl.secret
 import nacl.utils
 import pydbus
 from gi.repository import GLib
+from pyroute2 import IPRoute, IPRSocket
+from pyroute2.netlink.rtnl import RTMGRP_NEIGH
+from pyroute2.netlink.rtnl.ndmsg import NUD_FAILED, NUD_INCOMPLETE, NUD_NOARP
 
 from .constants import (
     _ORGANIZE_DBUS_NAME,
     _ORGANIZE_DBUS_PATH,
     _PUBLISH_ALT_DBUS_NAME,
 )
+from .framing import frame
 
 SockType: TypeAlias = dict[str, Any]
 
 
+class NeighbourTable(object):
+    """
+    The IPv4 addresses in the kernel's neighbour (ARP) table, per interface
+    index, kept up to date by netlink events rather than by re-reading
+    /proc/net/arp.
+
+    >>> from pyroute2.netlink.rtnl.ndmsg import ndmsg
+    >>> def event(name, ip, state=2):
+    ...     msg = ndmsg()
+    ...     msg.update(ifindex=2, state=state, family=socket.AF_INET)
+    ...     msg.update(attrs=[('NDA_DST', ip)], event=name)
+    ...     return msg
+    >>> table = NeighbourTable()
+    >>> table.update(event('RTM_NEWNEIGH', '10.0.0.1'))
+    >>> table.update(event('RTM_NEWNEIGH', '10.0.0.2'))
+    >>> table.update(event('RTM_NEWNEIGH', '10.0.0.3', NUD_FAILED))
+    >>> table.update(event('RTM_DELNEIGH', '10.0.0.1'))
+    >>> table.get(2), table.get(3)
+    (['10.0.0.2'], [])
+    """
+
+    def __init__(self) -> None:
+        self.log: Logger = getLogger()
+        self.lock = threading.Lock()
+        self.neighbours: dict[int, set[str]] = {}
+        # each monitor thread has its own stop event, so that restarting
+        # the table doesn't depend on the old thread having exited yet
+        self.stopped: Optional[threading.Event] = None
+
+    def update(self, msg: Any) -> None:
+        if msg['family'] != socket.AF_INET:
+            return
+        ip = msg.get_attr('NDA_DST')
+        if ip is None:
+            return
+        with self.lock:
+            neighbours = self.neighbours.setdefault(msg['ifindex'], set())
+            if msg.get('event') == 'RTM_NEWNEIGH' and not (
+                msg['state'] & (NUD_FAILED | NUD_INCOMPLETE | NUD_NOARP)
+            ):
+                neighbours.add(ip)
+            else:
+                neighbours.discard(ip)
+
+    def get(self, ifindex: int) -> list[str]:
+        with self.lock:
+            return sorted(self.neighbours.get(ifindex, ()))
+
+    def start(self) -> None:
+        """
+        Subscribe to neighbour events, then load the current table.
+        """
+        if self.stopped is not None:
+            return
+        ip = IPRSocket()
+        ip.bind(groups=RTMGRP_NEIGH)
+        with IPRoute() as ipr:
+            for msg in ipr.get_neighbours(family=socket.AF_INET):
+                self.update(msg)
+        self.stopped = threading.Event()
+        threading.Thread(
+            target=self.monitor, args=(ip, self.stopped), daemon=True
+        ).start()
+
+    def stop(self) -> None:
+        if self.stopped is not None:
+            self.stopped.set()
+            self.stopped = None
+
+    def monitor(self, ip: IPRSocket, stopped: threading.Event) -> None:
+        """
+        Main body of the monitor thread. Waits for neighbour events with a
+        timeout, so that it notices when it has been stopped even if there
+        are none.
+        """
+        with selectors.DefaultSelector() as selector:
+            selector.register(ip, selectors.EVENT_READ)
+            while not stopped.is_set():
+                if not selector.select(timeout=1.0):
+                    continue
+                for msg in ip.get():
+                    if msg.get('event') in ('RTM_NEWNEIGH', 'RTM_DELNEIGH'):
+                        self.update(msg)
+        ip.close()
+
+
 class Publish_Alt:
     dbus = '''
     <node>
@@ -83,54 +174,105 @@ class Publish_Alt:
         self.time_interval = time_interval
         self.log: Logger = getLogger()
         self.publish_entries: Queue[dict[str, Any]] = Queue()
-        self.packets: Queue[dict[str, Any]] = Queue()
+        # packets waiting to be sent, as (time, sequence, socket, packet)
+        self.send_schedule: list[tuple[float, int, socket.socket, bytes]] = []
+        self.send_condition = threading.Condition()
+        self._send_sequence = itertools.count()
+        # ip -> (descriptor, mac address, frames of its encrypted message)
+        self.trains: dict[str, tuple[str, bytes, list[bytes]]] = {}
+        self.neighbours = NeighbourTable()
         self.active = False
         self.publishing_thread: threading.Thread
         self.packet_sending_thread: threading.Thread
+        self.organize_descriptors: dict[str, str] = {}
+        self.descriptors_lock = threading.Lock()
+        self.descriptors_changed = threading.Event()
+        # set to wake the publishing thread before its next entry is due
+        self.wakeup = threading.Event()
         self.bus = pydbus.SystemBus()
         self.organize = self.bus.get(_ORGANIZE_DBUS_NAME, _ORGANIZE_DBUS_PATH)
+        self.organize.DescriptorsChanged.connect(self.on_descriptors_changed)
         self.ip_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
 
     def get_descriptors(self) -> None:
         """
-        Update descriptors by querying organize.
+        Update descriptors by querying organize. This is only needed at
+        startup; after that, organize tells us when they change.
         """
-        self.organize_descriptors = json.loads(
-            self.organize.our_latest_descriptors()
-        )
+        descriptors = json.loads(self.organize.our_latest_descriptors())
+        with self.descriptors_lock:
+            self.organize_descriptors = descriptors
+
+    def on_descriptors_changed(self, descriptors: str) -> None:
+        """
+        Handler for organize's DescriptorsChanged signal, which carries a
+        JSON object of our descriptor for each interface.
+        """
+        self.log.debug("Descriptors changed")
+        with self.descriptors_lock:
+            self.organize_descriptors = json.loads(descriptors)
+        self.descriptors_changed.set()
+        self.wakeup.set()
 
-    def set_descriptors(self, sock: SockType) -> None:
+    def set_descriptors(self, sock: SockType) -> bool:
         """
-        Set descriptor of ip
+        Set descriptor of ip. Returns False if organize has no descriptor for
+        its interface.
         """
-        self.descriptor[sock["ip"]] = self.load_descriptor(sock["ip"])
+        descriptor = self.load_descriptor(sock["if_name"])
+        if descriptor is None:
+            self.log.debug(f"No descriptor for {sock['if_name']}")
+            return False
+        self.descriptor[sock["ip"]] = descriptor
         self.log.debug("Descriptors " + str(self.descriptor))
+        return True
 
-    def load_descriptor(self, ip: str) -> str:
+    def load_descriptor(self, if_name: str) -> Optional[str]:
         """
-        Undo the JSON stuff done in organize and return descriptor.
+        Return organize's current descriptor for the interface.
         """
-        return " ".join(
-            "%s=%s;" % kv
-            for kv in sorted(self.organize_descriptors.get(ip).items())
-        )
+        with self.descriptors_lock:
+            return self.organize_descriptors.get(if_name)
 
-    def get_information(self, sock: SockType) -> None:
+    def get_information(self, sock: SockType) -> bool:
         """
         Update specific information
         """
         sock["dest_ip"] = self.get_arp(sock)
         self.op_code = self.get_op_code()
-        self.set_descriptors(sock)
+        return self.set_descriptors(sock)
 
     def run(self) -> None:
         """
-        Main body for publishing thread.
+        Main body for publishing thread. Sleeps until the next entry is due,
+        until new entries are added, or until organize tells us that our
+        descriptors have changed (in which case every entry is published
+        again at once).
         """
+        self.get_descriptors()
         while self.active:
-            self.get_descriptors()
-            self.process_publish_entry(time.time())
-            time.sleep(0.1)
+            self.wakeup.clear()
+            if self.descriptors_changed.is_set():
+                self.descriptors_changed.clear()
+                for entry in list(self.publish_entries.queue):
+                    entry["updated"] = 0
+            now = time.time()
+            for _ in range(self.publish_entries.qsize()):
+                self.process_publish_entry(now)
+            self.wakeup.wait(self.next_publish_time(now) - now)
+
+    def next_publish_time(self, now: float) -> float:
+        """
+        Returns when the next periodic entry is due to be published (or one
+        interval from now, if there are no entries).
+        """
+        return min(
+            (
+                entry["updated"] + self.time_interval
+                for entry in list(self.publish_entries.queue)
+            ),
+            default=now + self.time_interval,
+        )
 
     def process_publish_entry(self, t: float) -> bool:
         """
@@ -139,20 +281,19 @@ class Publish_Alt:
         """
         try:
             publish_entry = self.publish_entries.get_nowait()
-            if t - publish_entry["updated"] > self.time_interval:
+            if t - publish_entry["updated"] >= self.time_interval:
                 self.log.debug(publish_entry)
                 # get dynamic information
-                self.get_information(publish_entry)
-                message = self.compress_and_encrypt(
-                    self.descriptor[publish_entry["ip"]],
-                    publish_entry["mac_addr"],
-                )  # compress and encrypt message
-                # generate packet header
-                self.packets.put(
-                    {
-                        "packets": self.get_packets(publish_entry, message),
-                        "socket": publish_entry["socket"],
-                    }
+                if not self.get_information(publish_entry):
+                    # wait for organize to tell us about a descriptor
+                    publish_entry["updated"] = t
+                    self.publish_entries.put(publish_entry)
+                    return True
+                self.schedule_packets(
+                    publish_entry["socket"],
+                    self.get_packets(
+                        publish_entry, self.get_frames(publish_entry)
+                    ),
                 )
                 publish_entry["updated"] = t
                 if not publish_entry["periodic"]:
@@ -168,54 +309,90 @@ class Publish_Alt:
         except Empty:
             return False
 
-    def get_packets(
-        self, sock: SockType, packet_payload: bytes
-    ) -> list[bytes]:
+    def get_frames(self, sock: SockType) -> list[bytes]:
+        """
+        Returns the frames of our encrypted descriptor for this entry, which
+        are only recomputed when the descriptor or MAC address changes.
+        """
+        descriptor = self.descriptor[sock["ip"]]
+        cached = self.trains.get(sock["ip"])
+        if cached is not None and cached[:2] == (descriptor, sock["mac_addr"]):
+            return cached[2]
+        message = self.compress_and_encrypt(descriptor, sock["mac_addr"])
+        # split encrypted payload into frames of 18 bytes per packet
+        # for a total packet length of 60 bytes, including the last one
+        frames = frame(
+            message,
+            self.arp_packet_max_length - len(self.generate_header(sock)),
+            pad=True,
+        )
+        self.trains[sock["ip"]] = (descriptor, sock["mac_addr"], frames)
+        return frames
+
+    def get_packets(self, sock: SockType, frames: list[bytes]) -> list[bytes]:
         """
-        Split message up into packets and return them for processing.
+        Prefix the frames with an ARP header and return them for sending.
         """
         self.log.debug("getting packets")
         packet_header = self.generate_header(sock)
-        # segment encrypted payload into chunks of 18 bytes per packet
-        # for a total packet length of 60 bytes
-        packets = []
-        number_of_packets = math.ceil(
-            len(packet_payload)
-            / (self.arp_packet_max_length - len(packet_header))
-        )
-        for i in range(number_of_packets):
-            packet = (
-                packet_header
-                + packet_payload[
-                    i
-                    * ((self.arp_packet_max_length - len(packet_header))) : (
-                        i + 1
-                    )  # add corresponding packet chunk
-                    * ((self.arp_packet_max_length - len(packet_header)))
-                ]
-            )
-            packets.append(packet)
-        return packets
+        return [packet_header + f for f in frames]
+
+    def schedule_packets(
+        self,
+        sock: socket.socket,
+        packets: list[bytes],
+        t: Optional[float] = None,
+    ) -> None:
+        """
+        Schedule a train of packets for sending, with a random delay between
+        each.
+        """
+        if t is None:
+            t = time.monotonic()
+        with self.send_condition:
+            for packet in packets:
+                heapq.heappush(
+                    self.send_schedule,
+                    (t, next(self._send_sequence), sock, packet),
+                )
+                t += random.uniform(self.interval_min, self.interval_max)
+            self.send_condition.notify()
+
+    def due_packets(
+        self, now: float
+    ) -> list[tuple[float, int, socket.socket, bytes]]:
+        """
+        Remove and return all of the packets which are due to be sent.
+        """
+        due = []
+        while self.send_schedule and self.send_schedule[0][0] <= now:
+            due.append(heapq.heappop(self.send_schedule))
+        return due
 
     def send_packets(self) -> None:
         """
-        Main body for sending thread. Sends packets in queue over the network.
-        Imposes random delay between packets.
+        Main body for sending thread. Sleeps until the next packet is due,
+        and then sends all of the packets which are due in one batch, so that
+        trains on several interfaces are interleaved rather than sent one
+        after another.
         """
         self.log.debug("setting up packet sending thread")
         while self.active:
-            try:
-                entry = self.packets.get_nowait()
-                packets = entry["packets"]
-                for i in range(len(packets)):
-                    self.log.debug(f"Sending packet {i + 1} of {len(packets)}")
-                    entry["socket"].send(packets[i])
-                    time.sleep(
-                        random.uniform(self.interval_min, self.interval_max)
+            with self.send_condition:
+                due = self.due_packets(time.monotonic())
+                if not due:
+                    self.send_condition.wait(
+                        self.send_schedule[0][0] - time.monotonic()
+                        if self.send_schedule
+                        else 1.0
                     )
-            except Empty:
-                pass
-            time.sleep(0.5)
+                    continue
+            self.log.debug(f"Sending {len(due)} packets")
+            for _, _, sock, packet in due:
+                try:
+                    sock.send(packet)
+                except OSError as ex:
+                    self.log.debug(f"Failed to send packet: {ex!r}")
 
     def get_op_code(self) -> bytes:
         """
@@ -247,18 +424,15 @@ class Publish_Alt:
             )[20:24]
         )
 
-    def get_interface_name(self, ip: str) -> Optional[str]:
+    def get_interface(self, ip: str) -> tuple[Optional[str], int]:
         """
-        Return interface name associated with IP.
+        Return name and index of interface associated with IP.
         """
-        interfaces = socket.if_nameindex()
-        for interface in interfaces:
-            try:
-                if ip == self.get_ip(interface[1]):
-                    return interface[1]
-            except OSError:
-                pass
-        return None
+        with IPRoute() as ipr:
+            for addr in ipr.get_addr(family=socket.AF_INET, address=ip):
+                index = addr["index"]
+                return ipr.get_links(index)[0].get_attr("IFLA_IFNAME"), index
+        return None, 0
 
     def get_mac(self, sock: SockType) -> bytes:
         """
@@ -312,24 +486,18 @@ class Publish_Alt:
 
     def get_arp(self, sock: SockType) -> bytes:
         """
-        Pick random entry of ARP cache to be used as destination address.
+        Pick random neighbour of the interface to be used as destination
+        address.
         """
-        with open("/proc/net/arp") as arp_table:  # read arp cache
-            reader = list(
-                csv.reader(arp_table, skipinitialspace=True, delimiter=" ")
-            )
-        arp_cache = [
-            a[0] for a in reader[1:]
-        ]  # skip header line and read ip field
-        if len(arp_cache) == 0:
+        neighbours = self.neighbours.get(sock["if_index"])
+        if len(neighbours) == 0:
             dest_ip = (
-                socket.inet_aton(self.get_ip(sock["if_name"]))[0:3] + b"\x01"
+                socket.inet_aton(sock["ip"])[0:3] + b"\x01"
             )  # if chache is empty, take 0x01 address of own ip
         else:
-            random_ip = random.choice(arp_cache)  # pick random ip
+            random_ip = random.choice(neighbours)  # pick random ip
             dest_ip = socket.inet_aton(random_ip)
             self.log.debug("Setting random arp ip as destination.")
-            self.log.debug("Arp cache: " + str(arp_cache))
             self.log.debug("Chosen Destination ip: " + str(random_ip))
         return dest_ip
 
@@ -339,6 +507,7 @@ class Publish_Alt:
         starts the publishing process.
         """
         self.log.info("Starting alternative publish")
+        self.neighbours.start()
         self.setup(ip_addrs)
         if not self.active:
             self.active = True
@@ -355,6 +524,11 @@ class Publish_Alt:
         """
         self.log.info("Stoping alternative publish")
         self.active = False
+        self.wakeup.set()
+        self.neighbours.stop()
+        with self.send_condition:
+            self.send_schedule.clear()
+            self.send_condition.notify()
         self.clear_broadcast_queue()
 
     def setup(self, ip_addrs: list[str], periodically: bool = True) -> None:
@@ -364,17 +538,20 @@ class Publish_Alt:
         self.log.debug("publish setup")
         for ip in ip_addrs:
             s = socket.socket(socket.AF_PACKET, socket.SOCK_RAW)
-            if_name = self.get_interface_name(ip)
+            if_name, if_index = self.get_interface(ip)
             s.bind((if_name, 0))
             socket_entry = {
                 "socket": s,
                 "periodic": periodically,
                 "if_name": if_name,
+                "if_index": if_index,
                 "ip": ip,
                 "updated": 0,
             }
             socket_entry["mac_addr"] = self.get_mac(socket_entry)
             self.publish_entries.put(socket_entry)
+        # new entries are due at once
+        self.wakeup.set()
 
     def clear_broadcast_queue(self) -> None:
         """
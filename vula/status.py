@@ -4,11 +4,11 @@ from logging import getLogger
 from sys import platform
 
 from platform import node
-import json
-from typing import Any
+from typing import Any, Callable
 
 import click
 import pydbus
+from gi.repository import GLib
 
 try:
     from systemd import daemon
@@ -23,6 +23,36 @@ from .constants import _ORGANIZE_DBUS_NAME, _ORGANIZE_DBUS_PATH, _DOMAIN
 from .notclick import green, red, yellow
 
 
+def _print_ctidh_stats(
+    organize: Any, printer: Callable[[str, str], None], verbose: int
+) -> None:
+    try:
+        ctidh_stats = organize.get_stats()['ctidh']
+    except AttributeError:
+        # organize is too old to have the organize2 interfaces, so the proxy
+        # doesn't have the method
+        return
+    except GLib.Error as ex:
+        if not any(
+            name in ex.message
+            for name in ('UnknownMethod', 'UnknownInterface')
+        ):
+            raise
+        return
+    if warmup := ctidh_stats.get('warmup'):
+        printer(
+            "active",
+            "CTIDH warm-up derived {derived} of {peers} peers' PSKs "
+            "in {seconds}s ({cached} were cached)".format(**warmup),
+        )
+    if verbose:
+        printer(
+            "active",
+            "{cached_psks} CTIDH PSKs cached; "
+            "{pending_psks} pending".format(**ctidh_stats),
+        )
+
+
 @click.command(short_help="Print status")
 @click.option(
     '-s',
@@ -113,8 +143,8 @@ def main(only_systemd: bool, verbose: int) -> None:
             enabled_peers = organize.peer_ids('enabled')
             disabled_peers = organize.peer_ids('disabled')
 
-            descs = json.loads(organize.our_latest_descriptors())
-            prefs = Prefs(json.loads(organize.get_prefs()))
+            descs = organize.get_our_descriptors()
+            prefs = Prefs(organize.read_prefs())
             if descs:
                 descs = {
                     iface: Descriptor.parse(desc)
@@ -162,6 +192,7 @@ def main(only_systemd: bool, verbose: int) -> None:
                 "active",
                 f"{node() + _DOMAIN}'s vula ULA is {prefs.primary_ip}",
             )
+            _print_ctidh_stats(organize, printer, verbose)
 
     elif _ORGANIZE_DBUS_NAME in bus.dbus.ListActivatableNames():
         printer("activatable", _ORGANIZE_DBUS_NAME + ' dbus service')
@@ -268,7 +268,9 @@ class Sys(object):
         res: list[str] = []
         if peer.enabled:
             self.log.debug("syncing enabled peer %s", peer.name)
-            ctidh_psk = self.organize.ctidh_dh(peer.descriptor.c)
+            ctidh_psk = self.organize.ctidh_psk(peer.descriptor.c)
+            if ctidh_psk is None:
+                self.log.info("null-routing %s until PSK is ready", peer.name)
             res.append(
                 self.wgi.apply_peerconfig(peer.wg_config(ctidh_psk), dryrun)
             )
@@ -294,6 +296,55 @@ class Sys(object):
         result = filter(None, res)
         return "\n".join(result)
 
+    def sync_peers(self, dryrun: bool = False) -> list[str]:
+        """
+        Syncs all enabled peers' wg configs and routes. Unlike calling
+        sync_peer for each peer, this dumps the wg interface only once and
+        submits all wg changes in as few netlink messages as possible.
+        Returns a list of strings.
+
+        As when syncing peers one at a time, an error in one peer's wg config
+        or routes doesn't stop the others from being synced.
+        """
+        res: list[str] = []
+        configs = []
+        peers = list(self.organize.peers.limit(enabled=True).values())
+        for peer in peers:
+            self.log.debug("syncing enabled peer %s", peer.name)
+            try:
+                ctidh_psk = self.organize.ctidh_psk(peer.descriptor.c)
+                if ctidh_psk is None:
+                    self.log.info(
+                        "null-routing %s until PSK is ready", peer.name
+                    )
+                configs.append(peer.wg_config(ctidh_psk))
+            except Exception as ex:
+                res.append(repr(ex))
+        try:
+            res.append(self.wgi.apply_peerconfigs(configs, dryrun))
+        except Exception as ex:
+            res.append(repr(ex))
+        for peer in peers:
+            try:
+                res.append(
+                    self.sync_routes(
+                        peer.routes,
+                        table=self.organize.table,
+                        dryrun=dryrun,
+                    )
+                )
+                if peer.use_as_gateway:
+                    res.append(
+                        self.sync_routes(
+                            _GW_ROUTES,
+                            table=_LINUX_MAIN_ROUTING_TABLE,
+                            dryrun=dryrun,
+                        )
+                    )
+            except Exception as ex:
+                res.append(repr(ex))
+        return list(filter(None, res))
+
     def sync_iprules(self, dryrun: bool = False) -> list[str]:
         routing_table = self.organize.table
         mark = self.organize.fwmark
@@ -423,18 +474,32 @@ class Sys(object):
             str(peer.descriptor.pk)
             for peer in self.organize.peers.limit(enabled=True).values()
         ]
-        for peer in self.wgi.peers:
-            if peer['public_key'] not in enabled_pks:
-                if not dryrun:
-                    res.append(self.remove_wg_peer(peer['public_key'], dryrun))
-                    self.log.info(
-                        "Removing unexpected peer pk: (%s)", peer['public_key']
-                    )
-                res.append(
-                    "wg set {interface} peer {pk} remove".format(
-                        interface=self.wg_name, pk=peer['public_key']
-                    )
+        unknown_pks = [
+            peer['public_key']
+            for peer in self.wgi.peers
+            if peer['public_key'] not in enabled_pks
+        ]
+        if unknown_pks and not dryrun:
+            for pk in unknown_pks:
+                self.log.info("Removing unexpected peer pk: (%s)", pk)
+            # this uses the interface data from the latest query rather than
+            # dumping the interface again
+            res.append(
+                self.wgi.apply_peerconfigs(
+                    [
+                        attrdict(public_key=pk, remove=True)
+                        for pk in unknown_pks
+                    ],
+                    dryrun,
+                    query=False,
+                )
+            )
+        for pk in unknown_pks:
+            res.append(
+                "wg set {interface} peer {pk} remove".format(
+                    interface=self.wg_name, pk=pk
                 )
+            )
         expected_routes = [
             str(dst)
             for peer in self.organize.peers.limit(enabled=True).values()
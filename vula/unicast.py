@@ -0,0 +1,124 @@
+"""
+*vula* unicast descriptor refresh.
+
+When our addresses change, waiting for the next mDNS announcement and
+browse cycle delays our pinned peers learning our new addresses. Instead,
+organize sends its new descriptors directly to the primary IPs of its
+pinned peers. These are only routed over the WireGuard tunnel, and
+WireGuard's roaming brings the packet to the peer's endpoint from our new
+address. The peer processes the descriptor as if it had been discovered.
+"""
+
+from __future__ import annotations
+
+import socket
+from ipaddress import ip_address
+from logging import Logger, getLogger
+from typing import Callable, Iterable, Optional
+
+from gi.repository import GLib
+
+from .constants import _UNICAST_REFRESH_PORT
+
+# descriptors are a few hundred bytes; anything larger is not one
+_MAX_DATAGRAM_SIZE: int = 4096
+
+# from linux/in.h (not exported by the socket module)
+_IP_FREEBIND: int = getattr(socket, "IP_FREEBIND", 15)
+
+
+class UnicastRefresh(object):
+    """
+    A UDP socket bound to our primary IP, which sends our descriptors to
+    peers and passes received descriptors to a callback (along with the
+    address they were received from) in the GLib main loop.
+
+    >>> received = []
+    >>> a = UnicastRefresh(lambda d, ip: received.append((d, ip)), port=0)
+    >>> a.listen('127.0.0.1')
+    >>> b = UnicastRefresh(lambda d, ip: None, port=a.port)
+    >>> b.listen('127.0.0.2')
+    >>> b.send(['hello'], ['127.0.0.1'])
+    1
+    >>> import time; time.sleep(0.1)
+    >>> a._receive()
+    True
+    >>> received
+    [('hello', '127.0.0.2')]
+    >>> a.close(); b.close()
+    """
+
+    def __init__(
+        self,
+        callback: Callable[[str, str], None],
+        port: int = _UNICAST_REFRESH_PORT,
+    ) -> None:
+        self.log: Logger = getLogger()
+        self.callback = callback
+        self.port = port
+        self.sock: Optional[socket.socket] = None
+        self._watch: Optional[int] = None
+        self.sent = 0
+        self.received = 0
+
+    def listen(self, ip: str) -> None:
+        """
+        Bind to our primary IP. IP_FREEBIND allows this before the address
+        has been configured on the vula interface.
+        """
+        family = (
+            socket.AF_INET6 if ip_address(ip).version == 6 else socket.AF_INET
+        )
+        sock = socket.socket(family, socket.SOCK_DGRAM)
+        sock.setsockopt(socket.SOL_IP, _IP_FREEBIND, 1)
+        sock.setblocking(False)
+        sock.bind((ip, self.port))
+        self.sock = sock
+        self.port = sock.getsockname()[1]
+        self._watch = GLib.io_add_watch(
+            sock.fileno(), GLib.IO_IN, lambda *a: self._receive()
+        )
+
+    def _receive(self) -> bool:
+        assert self.sock is not None
+        while True:
+            try:
+                data, addr = self.sock.recvfrom(_MAX_DATAGRAM_SIZE)
+            except BlockingIOError:
+                return True
+            self.received += 1
+            try:
+                self.callback(data.decode(), addr[0])
+            except Exception as ex:
+                self.log.info(
+                    "Failed to process unicast descriptor from %s: %r",
+                    addr[0],
+                    ex,
+                )
+
+    def send(self, descriptors: Iterable[str], ips: Iterable[str]) -> int:
+        """
+        Send each descriptor to each IP. Returns the number of datagrams sent.
+        """
+        assert self.sock is not None
+        count = 0
+        ips = list(ips)
+        for descriptor in descriptors:
+            for ip in ips:
+                try:
+                    self.sock.sendto(descriptor.encode(), (ip, self.port))
+                    count += 1
+                except OSError as ex:
+                    self.log.debug(
+                        "Couldn't send descriptor to %s: %r", ip, ex
+                    )
+        self.sent += count
+        return count
+
+    def close(self) -> None:
+        if self._watch is not None:
+            GLib.source_remove(self._watch)
+            self._watch = None
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
@@ -28,7 +28,13 @@ from typing import (
 import click
 from pyroute2 import IPRoute
 from pyroute2 import WireGuard as PyRoute2WireGuard
+from pyroute2.netlink import NLM_F_ACK, NLM_F_REQUEST
 from pyroute2.netlink import nla as netlink_atom
+from pyroute2.netlink.generic.wireguard import (
+    WG_CMD_SET_DEVICE,
+    WG_GENL_VERSION,
+    wgmsg,
+)
 from schema import And, Optional as Optional_, Or, Schema, Use
 
 
@@ -269,6 +275,10 @@ class Interface(attrdict, yamlrepr_hl):
     # Type informations
     cli: click.Group
 
+    # Upper bound for the size of a batched WG_CMD_SET_DEVICE message. This
+    # is the buffer size used by the wg(8) tool (MNL_SOCKET_BUFFER_SIZE).
+    _SET_PEERS_MAX_MSG_LEN: int = 8192
+
     def __init__(self, name: str, ipr: Optional[IPRoute] = None):
         """
         >>> iface = Interface("test interface")
@@ -405,6 +415,50 @@ class Interface(attrdict, yamlrepr_hl):
         """
         self.query()
         cur = self._peers_by_pubkey.get(new["public_key"])
+        res, changed = self._diff_peerconfig(cur, new)
+        if changed and not dryrun:
+            self.set(peer=new)
+        return "\n".join(filter(None, res))
+
+    def apply_peerconfigs(
+        self,
+        peers: list[attrdict],
+        dryrun: bool = False,
+        query: bool = True,
+    ) -> str:
+        """
+        This is the batched form of apply_peerconfig: it diffs the whole list
+        of desired peer configs against a single interface dump, and submits
+        all of the necessary changes with set_peers. Peers which the kernel
+        rejects are reported in the result.
+
+        If query is False, the interface data from the previous query is used
+        instead of dumping the interface again.
+        """
+        if query:
+            self.query()
+        current = self._peers_by_pubkey
+        res: list[str] = []
+        todo: list[attrdict] = []
+        for new in peers:
+            lines, changed = self._diff_peerconfig(
+                current.get(new["public_key"]), new
+            )
+            res.extend(lines)
+            if changed:
+                todo.append(new)
+        if todo and not dryrun:
+            res.extend(r for r in self.set_peers(todo) if isinstance(r, str))
+        return "\n".join(filter(None, res))
+
+    def _diff_peerconfig(
+        self, cur: Optional[PeerConfig], new: attrdict
+    ) -> tuple[list[str], bool]:
+        """
+        Compares a desired peer config with the current one (or None, if the
+        peer is not configured), removing unchanged keys from new. Returns the
+        list of steps and a bool indicating if new needs to be set.
+        """
         res: list[str] = []
         if cur:
             if new.get('remove'):
@@ -444,9 +498,10 @@ class Interface(attrdict, yamlrepr_hl):
                 new['endpoint_addr'] = cur['endpoint_addr']
         else:
             if new.get('remove'):
-                return "# can't remove non-existent wireguard peer %s" % (
-                    new['public_key'],
-                )
+                return [
+                    "# can't remove non-existent wireguard peer %s"
+                    % (new['public_key'],)
+                ], False
 
         if (
             cur
@@ -455,54 +510,122 @@ class Interface(attrdict, yamlrepr_hl):
         ):
             # pyroute2/wg bug workaround
             self.log.debug("apply_peerconfig: no wg update necessary")
+            return res, False
 
+        if cur:
+            res.append(
+                '# reconfigure wireguard peer %s' % (new['public_key'],)
+            )
         else:
-            if cur:
-                res.append(
-                    '# reconfigure wireguard peer %s' % (new['public_key'],)
-                )
-            else:
-                res.append(
-                    '# configure new wireguard peer %s' % (new['public_key'],)
-                )
-
             res.append(
-                "vula wg set {interface} peer {pk} "
-                "{remove}{endpoint}{args}{allowed_ips}".format(
-                    remove="remove " if new.get('remove') else "",
-                    endpoint=(
-                        "endpoint %s:%s "
-                        % (new['endpoint_addr'], new['endpoint_port'])
-                        if (
-                            new.get('endpoint_addr')
-                            and new.get('endpoint_port')
-                        )
-                        else ''
-                    ),
-                    args="".join(
-                        f"{k}"
-                        f" {'<redacted psk>' if k == 'preshared_key' else v} "
-                        for k, v in new.items()
-                        if k in ('persistent_keepalive', 'preshared_key')
-                    ),
-                    allowed_ips=(
-                        'allowed-ips %s '
-                        % ",".join(ip for ip in new.get('allowed_ips', ()))
-                        if 'allowed_ips' in new
-                        else ""
-                    ),
-                    interface=self.name,
-                    pk=new['public_key'],
-                )
+                '# configure new wireguard peer %s' % (new['public_key'],)
             )
 
-            for line in res:
-                self.log.info("[#] %s", line)
+        res.append(
+            "vula wg set {interface} peer {pk} "
+            "{remove}{endpoint}{args}{allowed_ips}".format(
+                remove="remove " if new.get('remove') else "",
+                endpoint=(
+                    "endpoint %s:%s "
+                    % (new['endpoint_addr'], new['endpoint_port'])
+                    if (new.get('endpoint_addr') and new.get('endpoint_port'))
+                    else ''
+                ),
+                args="".join(
+                    f"{k}"
+                    f" {'<redacted psk>' if k == 'preshared_key' else v} "
+                    for k, v in new.items()
+                    if k in ('persistent_keepalive', 'preshared_key')
+                ),
+                allowed_ips=(
+                    'allowed-ips %s '
+                    % ",".join(ip for ip in new.get('allowed_ips', ()))
+                    if 'allowed_ips' in new
+                    else ""
+                ),
+                interface=self.name,
+                pk=new['public_key'],
+            )
+        )
 
-            if not dryrun:
-                self.set(peer=new)
+        for line in res:
+            self.log.info("[#] %s", line)
 
-        return "\n".join(filter(None, res))
+        return res, True
+
+    def set_peers(self, peers: list[attrdict]) -> list[Any]:
+        """
+        Configures (or removes) many peers with as few WG_CMD_SET_DEVICE
+        messages as possible. PyRoute2's WireGuard.set only accepts one peer
+        per message, but the kernel accepts any number of peers as long as
+        the message fits in its receive buffer, so we build the messages
+        ourselves (using pyroute2 to encode each peer) and split them when
+        they grow beyond _SET_PEERS_MAX_MSG_LEN bytes.
+
+        If the kernel rejects a message, it stops at the peer it rejected, so
+        the peers of that message are retried one at a time. Returns the list
+        of netlink acknowledgements, with a string describing the failure in
+        place of each peer which was rejected on its own.
+        """
+        res: list[Any] = []
+        chunks = [list(peers)] if peers else []
+        while chunks:
+            chunk = chunks.pop(0)
+            msg = self._set_peers_msg(chunk)
+            if len(msg.data) > self._SET_PEERS_MAX_MSG_LEN and len(chunk) > 1:
+                half = len(chunk) // 2
+                chunks[:0] = [chunk[:half], chunk[half:]]
+                continue
+            self.log.debug(
+                "Calling WG_CMD_SET_DEVICE for %r with %s peers (%s bytes)",
+                self.name,
+                len(chunk),
+                len(msg.data),
+            )
+            try:
+                self._wg.sendto(msg.data, (0, 0))
+                ack = self._wg.get()[0]
+                err = ack['header'].get('error', None)
+            except Exception as ex:
+                err = ex
+            if err is None:
+                res.append(ack)
+            elif len(chunk) > 1:
+                self.log.info(
+                    "WG_CMD_SET_DEVICE failed with %r, retrying %s peers "
+                    "one at a time",
+                    err,
+                    len(chunk),
+                )
+                chunks[:0] = [[peer] for peer in chunk]
+            else:
+                self.log.error(
+                    "Failed to configure wireguard peer %s: %r",
+                    chunk[0]['public_key'],
+                    err,
+                )
+                res.append(
+                    "# failed to configure wireguard peer %s: %r"
+                    % (chunk[0]['public_key'], err)
+                )
+        return res
+
+    def _set_peers_msg(self, peers: list[attrdict]) -> wgmsg:
+        wg_peers = []
+        for peer in peers:
+            scratch = wgmsg()
+            self._wg._wg_set_peer(scratch, peer)
+            wg_peers.extend(scratch['attrs'][0][1])
+        msg = wgmsg()
+        msg['attrs'].append(['WGDEVICE_A_IFNAME', self.name])
+        msg['attrs'].append(['WGDEVICE_A_PEERS', wg_peers])
+        msg['cmd'] = WG_CMD_SET_DEVICE
+        msg['version'] = WG_GENL_VERSION
+        msg['header']['type'] = self._wg.prid
+        msg['header']['flags'] = NLM_F_REQUEST | NLM_F_ACK
+        msg['header']['pid'] = self._wg.pid
+        msg.encode()
+        return msg
 
     @property
     def peers(self) -> list[PeerConfig]: